@@ -27,6 +27,10 @@ SECRET_KEY = "dsadasdasdsad"  # os.environ.get('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True  # int(os.environ.get('DEBUG'))
 
+# Тестовый запуск: SQLite и кэш в памяти, без файлов метрик и событий, даже если
+# в окружении заданы POSTGRES_URL или REDIS_URL. manage.py test выставляет флаг сам
+TESTING = os.environ.get("DJANGO_TESTING") == "1"
+
 ALLOWED_HOSTS = ["django-exchange-app.onrender.com", "127.0.0.1"]
 
 # Application definition
@@ -41,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "exchange_app.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -73,11 +78,50 @@ WSGI_APPLICATION = "exchange.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
-if os.environ.get("POSTGRES_URL"):
+
+# Соединения переживают запрос: DB_CONN_MAX_AGE секунд (0 - новое соединение на каждый
+# запрос, пусто - без ограничения), перед повторным использованием проверяются.
+# Пул соединений (psycopg 3 с psycopg[pool]) включается размером DB_POOL_MAX_SIZE
+conn_max_age = os.environ.get("DB_CONN_MAX_AGE", "600")
+conn_max_age = int(conn_max_age) if conn_max_age else None
+
+# Запросы сервиса: подготовка на сервере PostgreSQL (выключить за PgBouncer в режиме
+# транзакций) и размер кэша разобранных запросов в соединении Oracle и SQLite
+DATABASE_STATEMENTS = {
+    "PREPARE": os.environ.get("DB_PREPARE_STATEMENTS", "1") == "1",
+    "CACHE_SIZE": int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100)),
+}
+
+if TESTING:
+    # Тесты идут на SQLite в памяти (NAME тестовой базы не используется)
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {"cached_statements": DATABASE_STATEMENTS["CACHE_SIZE"]},
+        }
+    }
+elif os.environ.get("POSTGRES_URL"):
     # Replace the SQLite DATABASES configuration with PostgreSQL:
     DATABASES = {
         "default": dj_database_url.config(default=os.environ.get("POSTGRES_URL"))
     }
+    if os.environ.get("DB_POOL_MAX_SIZE"):
+        # Пул Django не совместим с постоянными соединениями
+        conn_max_age = 0
+        DATABASES["default"].setdefault("OPTIONS", {})["pool"] = {
+            "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.environ["DB_POOL_MAX_SIZE"]),
+            "timeout": 10,
+        }
+elif os.environ.get("SQLITE_PATH"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ["SQLITE_PATH"],
+            "OPTIONS": {"cached_statements": DATABASE_STATEMENTS["CACHE_SIZE"]},
+        }
+    }
 else:
     DATABASES = {
         "default": {
@@ -87,15 +131,13 @@ else:
             "PASSWORD": "1234",
             "HOST": "localhost",
             "PORT": "1521",
-
+            "OPTIONS": {"stmtcachesize": DATABASE_STATEMENTS["CACHE_SIZE"]},
         }
     }
-    # DATABASES = {
-    #     'default': {
-    #         'ENGINE': 'django.db.backends.sqlite3',
-    #         'NAME': BASE_DIR / 'db.sqlite3',
-    #     }
-    # }
+
+for database in DATABASES.values():
+    database["CONN_MAX_AGE"] = conn_max_age
+    database["CONN_HEALTH_CHECKS"] = os.environ.get("DB_CONN_HEALTH_CHECKS", "1") == "1"
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -143,6 +185,25 @@ if not DEBUG:
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 LOGOUT_REDIRECT_URL = "/exchange"
 
+# HTTP-клиент API Нацбанка (таймауты в секундах)
+NBRB_CLIENT = {
+    "base_url": os.environ.get("NBRB_API_URL", "https://api.nbrb.by/exrates"),
+    "connect_timeout": 3.05,
+    "read_timeout": float(os.environ.get("NBRB_READ_TIMEOUT", 10)),
+    "retries": 2,
+    "backoff": 0.5,
+    "pool_size": 10,
+    "failure_threshold": 5,
+    "reset_timeout": 30,
+}
+
+# Кэш справочника валют Нацбанка (TTL в секундах)
+NBRB_CACHE = {
+    "TTL": int(os.environ.get("NBRB_CACHE_TTL", 6 * 60 * 60)),
+    "MAX_ENTRIES": 8,
+    "SNAPSHOT_DIR": os.environ.get("NBRB_CACHE_DIR", BASE_DIR / ".nbrb_cache"),
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -164,10 +225,120 @@ LOGGING = {
         },
     },
     'loggers': {
+        # Каждый SQL-запрос в консоли - только по явному SQL_LOG_LEVEL=DEBUG,
+        # время запросов собирается в метриках (/metrics)
         'django.db.backends': {
-            'level': 'DEBUG',
+            'level': os.environ.get('SQL_LOG_LEVEL', 'WARNING'),
             'handlers': ['console'],
             'propagate': False,
         },
     },
 }
+
+# Метрики Prometheus (/metrics). Каждый воркер пишет свои ряды в файл
+# каталога DIR; файлы завершившихся воркеров при сборе сворачиваются в totals.json.
+METRICS = {
+    "ENABLED": os.environ.get("METRICS_ENABLED", "1") == "1",
+    # Тесты держат метрики только в памяти процесса
+    "DIR": None if TESTING else os.environ.get("METRICS_DIR", BASE_DIR / ".metrics"),
+    "FLUSH_INTERVAL": 5,
+    "MAX_SERIES": 2000,
+    # Доступ: заголовок Authorization: Bearer TOKEN или вход сотрудника (is_staff);
+    # PUBLIC открывает эндпоинт всем, если доступ ограничен на уровне сети
+    "TOKEN": os.environ.get("METRICS_TOKEN"),
+    "PUBLIC": os.environ.get("METRICS_PUBLIC") == "1",
+}
+
+# Сжатые файлы архива транзакций закрытых месяцев (команда archive_transactions)
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", BASE_DIR / "archive")
+
+# Политика хранения (manage.py purge policy): сколько дней истории курсов держать
+# (0 - всю) и сколько закрытых месяцев транзакций оставлять до переноса в архив
+# (пусто - не архивировать). Удаление идёт порциями CHUNK_SIZE с паузой PAUSE секунд;
+# удаление курсов по фильтру со страницы курсов - не больше REQUEST_ROWS строк за запрос
+RETENTION = {
+    "RATES_DAYS": int(os.environ.get("RETENTION_RATES_DAYS", 0)),
+    "TRANSACTIONS_KEEP_MONTHS": (
+        int(os.environ["RETENTION_TRANSACTIONS_MONTHS"])
+        if os.environ.get("RETENTION_TRANSACTIONS_MONTHS")
+        else None
+    ),
+    "CHUNK_SIZE": 1000,
+    "PAUSE": 0.1,
+    "REQUEST_ROWS": int(os.environ.get("RETENTION_REQUEST_ROWS", 5000)),
+}
+
+# Общий для воркеров кэш: Redis при REDIS_URL (нужен пакет redis),
+# иначе файловый кэш на диске сервера. Кэш auth - сессии и пользователи сессий
+# (AUTH_CACHE_TTL секунд, не больше MAX_ENTRIES записей в файловом кэше)
+AUTH_CACHE = {
+    "TTL": int(os.environ.get("AUTH_CACHE_TTL", 300)),
+    "MAX_ENTRIES": int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", 10000)),
+}
+if TESTING:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "auth": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "auth",
+        },
+    }
+elif os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        },
+        "auth": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+            "KEY_PREFIX": "auth",
+            "TIMEOUT": AUTH_CACHE["TTL"],
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ.get("CACHE_DIR", BASE_DIR / ".cache"),
+        },
+        "auth": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.path.join(os.environ.get("CACHE_DIR", BASE_DIR / ".cache"), "auth"),
+            "TIMEOUT": AUTH_CACHE["TTL"],
+            "OPTIONS": {"MAX_ENTRIES": AUTH_CACHE["MAX_ENTRIES"]},
+        },
+    }
+
+# Сессия читается из кэша auth, запись идёт и в кэш, и в django_session
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+SESSION_CACHE_ALIAS = "auth"
+# Пользователь сессии - из кэша auth. ModelBackend остаётся для сессий,
+# открытых до его включения
+AUTHENTICATION_BACKENDS = [
+    "exchange_app.auth.CachedModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
+# Матрица котировок (/exchange/api/quotes/): наценка в процентах, время жизни в кэше
+QUOTES = {
+    "MARKUP": os.environ.get("QUOTES_MARKUP", "1.5"),
+    "CACHE_TIMEOUT": 24 * 60 * 60,
+}
+
+# Пулы потоков асинхронных представлений: запросы к БД и к API Нацбанка
+ASYNC_EXECUTORS = {
+    "DB_THREADS": 0 if TESTING else int(os.environ.get("ASYNC_DB_THREADS", 8)),
+    "HTTP_THREADS": int(os.environ.get("ASYNC_HTTP_THREADS", 4)),
+}
+
+# Поток изменений курсов и кассы (/exchange/events/). С DIR события идут через
+# файл каталога и доходят до всех воркеров сервера, без него - только в пределах процесса
+EVENTS = {
+    "DIR": None if TESTING else os.environ.get("EVENTS_DIR", BASE_DIR / ".events"),
+    "POLL_INTERVAL": 0.5,
+    "MAX_BYTES": 1_000_000,
+    "HISTORY": 500,
+    "QUEUE_SIZE": 100,
+    "KEEPALIVE": 15,
+}
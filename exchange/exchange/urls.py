@@ -19,8 +19,11 @@ from django.contrib import admin
 from django.shortcuts import redirect
 from django.urls import path, include
 
+from exchange_app.views import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", lambda request: redirect("exchange_app:index")),
+    path("metrics", metrics_view, name="metrics"),
     path("exchange/", include("exchange_app.urls", namespace="exchange")),
 ]
@@ -1,7 +1,30 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ExchangeAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "exchange_app"
     verbose_name = "Обмен валют"
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.signals import user_logged_out as logged_out
+        from django.db.models.signals import post_delete, post_save
+
+        from .auth import user_logged_out, user_saved
+        from .events import publish_cash, publish_currencies, publish_rates
+        from .metrics import install_execute_wrapper, is_enabled
+        from .quotes import warm_quotes
+        from .signals import cash_changed, currencies_changed, rates_changed
+
+        rates_changed.connect(warm_quotes)
+        rates_changed.connect(publish_rates)
+        cash_changed.connect(publish_cash)
+        currencies_changed.connect(publish_currencies)
+        user_model = get_user_model()
+        post_save.connect(user_saved, sender=user_model)
+        post_delete.connect(user_saved, sender=user_model)
+        logged_out.connect(user_logged_out)
+        if is_enabled():
+            connection_created.connect(install_execute_wrapper)
@@ -0,0 +1,206 @@
+# exchange/archive.py
+import csv
+import gzip
+import heapq
+import os
+import re
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+TRANSACTIONS_TABLE = "exchange_transactions"
+
+# Столбцы файла архива: идентификаторы и названия на момент архивации
+ARCHIVE_FIELDS = [
+    "transaction_id",
+    "transaction_date",
+    "operator_id",
+    "username",
+    "currency_from_id",
+    "currency_from_name",
+    "currency_to_id",
+    "currency_to_name",
+    "amount",
+    "exchanged_amount",
+    "change_in_base",
+    "amount_in_base",
+]
+MONEY_FIELDS = ["amount", "exchanged_amount", "change_in_base", "amount_in_base"]
+
+
+def utc_moment(value):
+    """Момент в UTC; Oracle и SQLite без зоны возвращают его в UTC."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=dt_timezone.utc)
+    return value.astimezone(dt_timezone.utc)
+
+
+def month_start(value):
+    """Первое число месяца (UTC) для даты или момента времени."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=dt_timezone.utc)
+        value = value.astimezone(dt_timezone.utc).date()
+    return value.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """Границы месяца [начало, начало следующего) в UTC."""
+    start = datetime.combine(month, datetime.min.time(), dt_timezone.utc)
+    return start, datetime.combine(add_months(month, 1), datetime.min.time(), dt_timezone.utc)
+
+
+def parse_month(value):
+    """'2024-01' -> date(2024, 1, 1), None для некорректной строки."""
+    try:
+        return datetime.strptime(value, "%Y-%m").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def ensure_month_partitions(cursor, dialect, first_month, last_month):
+    """Создаёт недостающие помесячные секции транзакций в диапазоне месяцев."""
+    # Oracle создаёт секции сам (интервальное секционирование)
+    if not dialect.partitions_query:
+        return
+    cursor.execute(dialect.partitions_query, [TRANSACTIONS_TABLE])
+    existing = {row[0] for row in cursor.fetchall()}
+    month = first_month
+    while month <= last_month:
+        if dialect.month_partition(TRANSACTIONS_TABLE, month) not in existing:
+            for statement in dialect.create_month_partition(
+                    TRANSACTIONS_TABLE, "transaction_date", month
+            ):
+                cursor.execute(statement)
+        month = add_months(month, 1)
+
+
+def drop_month(cursor, dialect, month, row_count):
+    """
+    Удаляет секцию месяца целиком, если в ней ровно row_count строк - все они
+    уже перенесены в архив. Секция блокируется от записи до подсчёта, поэтому
+    строки, записанные после чтения месяца, не пропадут вместе с ней.
+    Возвращает True, если секция удалена; иначе строки удаляет вызывающий.
+    """
+    statements = dialect.lock_month_partition(TRANSACTIONS_TABLE, month)
+    if not statements:
+        return False
+    try:
+        with transaction.atomic():
+            for statement in statements:
+                cursor.execute(statement)
+    except DatabaseError:
+        # Секции за месяц нет
+        return False
+    start, end = month_bounds(month)
+    cursor.execute(
+        f"SELECT COUNT(*) FROM {TRANSACTIONS_TABLE} "
+        "WHERE transaction_date >= %s AND transaction_date < %s",
+        [dialect.datetime_param(start), dialect.datetime_param(end)],
+    )
+    if cursor.fetchone()[0] != row_count:
+        return False
+    for statement in dialect.drop_month_partition(TRANSACTIONS_TABLE, month):
+        cursor.execute(statement)
+    return True
+
+
+class TransactionArchive:
+    """
+    Холодный архив транзакций: по одному сжатому CSV на месяц (UTC),
+    строки в порядке истории - от новых к старым.
+    """
+
+    file_pattern = re.compile(r"^(\d{4}-\d{2})\.csv\.gz$")
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, month):
+        return os.path.join(self.directory, f"{month:%Y-%m}.csv.gz")
+
+    def months(self):
+        """Архивные месяцы, от новых к старым."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        months = [parse_month(m.group(1)) for m in map(self.file_pattern.match, names) if m]
+        return sorted(filter(None, months), reverse=True)
+
+    def write(self, month, rows):
+        """
+        Записывает строки месяца (кортежи в порядке ARCHIVE_FIELDS, от новых
+        к старым) во временный файл и атомарно заменяет им архив месяца.
+        Строки, уже лежащие в архиве, сохраняются: новые сливаются с ними
+        по порядку истории, повторы по transaction_id пропускаются.
+        Пустой месяц не записывается. Возвращает число строк в архиве.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(month)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        archived = (
+            tuple(record[field] for field in ARCHIVE_FIELDS) for record in self.read(month)
+        )
+        merged = heapq.merge(
+            rows, archived, key=lambda row: (utc_moment(row[1]), row[0]), reverse=True
+        )
+        count, previous_id = 0, None
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(ARCHIVE_FIELDS)
+                for row in merged:
+                    if row[0] == previous_id:
+                        # Строка уже в архиве: прошлая архивация не успела удалить её
+                        continue
+                    previous_id = row[0]
+                    row = list(row)
+                    row[1] = utc_moment(row[1]).isoformat()
+                    writer.writerow(row)
+                    count += 1
+            if count:
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return count
+
+    def read(self, month, operator_id=None, offset=0, limit=None):
+        """Потоковое чтение строк месяца с фильтром по оператору."""
+        try:
+            f = gzip.open(self.path(month), "rt", encoding="utf-8", newline="")
+        except OSError:
+            return
+        with f:
+            matched = 0
+            for record in csv.DictReader(f):
+                if operator_id and int(record["operator_id"]) != int(operator_id):
+                    continue
+                matched += 1
+                if matched <= offset:
+                    continue
+                if limit is not None and matched > offset + limit:
+                    return
+                yield self.parse(record)
+
+    @staticmethod
+    def parse(record):
+        row = dict(record)
+        for field in ("transaction_id", "operator_id", "currency_from_id", "currency_to_id"):
+            row[field] = int(row[field])
+        for field in MONEY_FIELDS:
+            row[field] = Decimal(row[field]) if row[field] else None
+        row["transaction_date"] = datetime.fromisoformat(row["transaction_date"])
+        return row
+
+
+def get_archive():
+    return TransactionArchive(settings.ARCHIVE_DIR)
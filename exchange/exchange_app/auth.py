@@ -0,0 +1,58 @@
+# exchange/auth.py
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+AUTH_CACHE_ALIAS = "auth"
+
+
+def user_cache_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def get_auth_cache():
+    return caches[AUTH_CACHE_ALIAS]
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend, читающий пользователя сессии из общего кэша воркеров:
+    страницы не обращаются к auth_user на каждый запрос. Запись сбрасывается
+    при сохранении и удалении пользователя (пароль, права) и при выходе.
+    """
+
+    def get_user(self, user_id):
+        cache = get_auth_cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, settings.AUTH_CACHE["TTL"])
+        # Вход запрещается и для записи из кэша, как в ModelBackend
+        return user if self.user_can_authenticate(user) else None
+
+
+def invalidate_user(user_id):
+    """
+    Сброс пользователя в кэше сразу и после фиксации: запрос, прочитавший
+    старую строку до фиксации, не оставит её в кэше.
+    """
+    cache = get_auth_cache()
+    key = user_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def user_saved(sender, instance, **kwargs):
+    """Обработчик post_save и post_delete пользователя."""
+    if instance.pk is not None:
+        invalidate_user(instance.pk)
+
+
+def user_logged_out(sender, request, user, **kwargs):
+    """Обработчик выхода: сессию удаляет cached_db, пользователя - этот обработчик."""
+    if user is not None:
+        invalidate_user(user.pk)
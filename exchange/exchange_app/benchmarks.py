@@ -0,0 +1,112 @@
+# exchange/benchmarks.py
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .statements import statements
+
+
+class Rollback(Exception):
+    """Откат пишущего замера, чтобы повторные прогоны шли на тех же данных."""
+
+
+def percentile(values, percent):
+    """Процентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(func, iterations, warmup=1):
+    """
+    Вызывает func iterations раз и возвращает задержки в миллисекундах
+    (p50, p95, p99, среднее, минимум, максимум) и число SQL-запросов на вызов.
+    """
+    for _ in range(warmup):
+        func()
+    timings, queries = [], 0
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries += len(captured)
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "queries_per_call": round(queries / iterations, 2),
+    }
+
+
+def measure_rolled_back(func, iterations, warmup=1):
+    """measure() для пишущих операций: все изменения откатываются."""
+    try:
+        with transaction.atomic():
+            result = measure(func, iterations, warmup)
+            raise Rollback
+    except Rollback:
+        pass
+    return result
+
+
+def build_cases(service, client, operator_id, currency_from_id, currency_to_id):
+    """Набор замеров: имя -> (функция, пишущий ли замер)."""
+
+    def exchange():
+        _, _, error = service.exchange_currency_with_transaction(
+            operator_id, str(currency_from_id), str(currency_to_id), Decimal(10), None
+        )
+        if error:
+            raise RuntimeError(error)
+
+    def page(path):
+        def get():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path}: HTTP {response.status_code}")
+
+        return get
+
+    def new_connection(func):
+        # Цена запроса без постоянных соединений: подключение и подготовка запросов заново
+        def call():
+            connection.close()
+            func()
+
+        return call
+
+    def unprepared(func):
+        def call():
+            prepare, statements.prepare = statements.prepare, False
+            try:
+                func()
+            finally:
+                statements.prepare = prepare
+
+        return call
+
+    return {
+        "exchange_currency_with_transaction": (exchange, True),
+        "get_rates": (service.get_rates, False),
+        "get_rates_new_connection": (new_connection(service.get_rates), False),
+        "get_rates_unprepared": (unprepared(service.get_rates), False),
+        "get_rate_history": (
+            lambda: service.get_rate_history(
+                currency_to_id, date.today() - timedelta(days=365), date.today(), "week"
+            ),
+            False,
+        ),
+        "get_transactions": (lambda: service.get_transactions(), False),
+        "get_transactions_operator": (lambda: service.get_transactions(operator_id), False),
+        "rates_page": (page("/exchange/rates/"), False),
+        "history_page": (page("/exchange/exchange_history/"), False),
+    }
@@ -0,0 +1,33 @@
+# exchange/checkpoints.py
+from django.db import connection
+
+from .dialects import get_dialect
+
+
+def get_checkpoint(name):
+    """Сохранённая позиция задания или None."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT position FROM job_checkpoints WHERE name = %s", [name])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def save_checkpoint(cursor, name, position):
+    """Позиция задания в текущей транзакции: фиксируется вместе с обработанной порцией."""
+    current_timestamp = get_dialect().current_timestamp
+    cursor.execute(
+        f"UPDATE job_checkpoints SET position = %s, updated_at = {current_timestamp} "
+        "WHERE name = %s",
+        [str(position), name],
+    )
+    if cursor.rowcount == 0:
+        cursor.execute(
+            f"INSERT INTO job_checkpoints (name, position, updated_at) "
+            f"VALUES (%s, %s, {current_timestamp})",
+            [name, str(position)],
+        )
+
+
+def clear_checkpoint(name):
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM job_checkpoints WHERE name = %s", [name])
@@ -0,0 +1,449 @@
+# exchange/dialects.py
+import itertools
+import re
+import sqlite3
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import connection as default_connection
+
+# Денежные столбцы SQLite объявляются типом fixed_decimal и читаются как Decimal.
+# Отдельное имя типа не затрагивает DecimalField моделей Django ("decimal").
+sqlite3.register_converter("fixed_decimal", lambda value: Decimal(value.decode()))
+
+
+class Dialect:
+    """
+    Различия SQL между поддерживаемыми СУБД: типы столбцов для миграций,
+    ограничение выборки, блокировки, upsert и триггер обновления кассы.
+    """
+
+    vendor = None
+
+    identity_pk = None
+    integer = None
+    boolean = None
+    date = "DATE"
+    timestamp = "TIMESTAMP"
+    current_date = "CURRENT_DATE"
+    current_timestamp = "CURRENT_TIMESTAMP"
+
+    supports_returning = True
+    supports_partial_indexes = True
+    supports_partitioning = False
+    # Серверные подготовленные запросы (PREPARE/EXECUTE)
+    supports_prepare = False
+    # Запрос имён секций таблицы, где их надо создавать заранее
+    partitions_query = None
+
+    def decimal(self, precision, scale):
+        return f"NUMERIC({precision}, {scale})"
+
+    def varchar(self, length):
+        return f"VARCHAR({length})"
+
+    def add_column(self, table, column, column_type):
+        return f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+
+    def drop_column(self, table, column):
+        return f"ALTER TABLE {table} DROP COLUMN {column}"
+
+    def limit(self, count):
+        return f"LIMIT {int(count)}"
+
+    def truncate_date(self, column, unit):
+        """Начало дня, недели (понедельник) или месяца для даты column."""
+        return f"CAST(date_trunc('{unit}', {column}) AS DATE)"
+
+    def lock_rows(self, alias, column):
+        """Блокировка выбранных строк таблицы alias до конца транзакции."""
+        return f"FOR UPDATE OF {alias}"
+
+    def lock_table(self, table):
+        """
+        Блокировка таблицы от вставки и изменения строк до конца транзакции;
+        чтение не блокируется. Пустая строка - отдельной блокировки не нужно.
+        """
+        return f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE"
+
+    def accumulate(self, table, key_columns, value_columns):
+        """
+        Вставка строки или прибавление value_columns к существующей
+        строке с тем же ключом. Параметры: ключ, затем значения.
+        """
+        columns = [*key_columns, *value_columns]
+        updates = ", ".join(
+            f"{column} = {table}.{column} + excluded.{column}" for column in value_columns
+        )
+        return f"""
+            INSERT INTO {table} ({", ".join(columns)})
+            VALUES ({", ".join(["%s"] * len(columns))})
+            ON CONFLICT ({", ".join(key_columns)}) DO UPDATE SET {updates}
+        """
+
+    def datetime_param(self, value):
+        """Момент времени для передачи в запрос: всегда в UTC."""
+        return value.astimezone(dt_timezone.utc)
+
+    def prepare(self, name, sql):
+        """Подготовка запроса sql под именем name на сервере."""
+        raise NotImplementedError
+
+    def execute_prepared(self, name, param_count):
+        """Выполнение подготовленного запроса с param_count параметрами."""
+        raise NotImplementedError
+
+    def partition_transactions_by_month(self):
+        """Перевод exchange_transactions на помесячные секции по transaction_date."""
+        return []
+
+    @staticmethod
+    def month_partition(table, month):
+        return f"{table}_p{month:%Y%m}"
+
+    def create_month_partition(self, table, column, month):
+        """Секция месяца month (первое число, границы по UTC)."""
+        return []
+
+    def lock_month_partition(self, table, month):
+        """Блокировка секции месяца от записи до конца транзакции (пусто - секций нет)."""
+        return []
+
+    def drop_month_partition(self, table, month):
+        return []
+
+    def exchange_trigger(self, ledger=False):
+        """
+        Триггер, меняющий остатки кассы после записи транзакции.
+        ledger - триггер пишет и движения в журнал кассы cash_ledger.
+        """
+        raise NotImplementedError
+
+    # Источник строки для INSERT ... SELECT без таблицы
+    dual = ""
+
+    def ledger_inserts(self, new):
+        """
+        Движения кассы по транзакции для тела триггера: приход исходной валюты,
+        выдача целевой и сдача в базовой (нулевая сдача не пишется).
+        new - ссылка на вставленную строку (NEW. или :NEW.). Строки журнала
+        вставляются после изменения остатков, уже под блокировкой строк кассы.
+        """
+        movements = [
+            (f"{new}currency_from_id", f"{new}amount", "exchange_in"),
+            (f"{new}currency_to_id", f"-{new}exchanged_amount", "exchange_out"),
+            ("1", f"-{new}change_in_base", "change"),
+        ]
+        return "".join(
+            f"""
+                INSERT INTO cash_ledger (currency_id, amount, kind, transaction_id, created_at)
+                SELECT {currency}, {amount}, '{kind}', {new}transaction_id, {new}transaction_date{self.dual}
+                WHERE {amount} <> 0;
+            """
+            for currency, amount, kind in movements
+        )
+
+    def drop_exchange_trigger(self):
+        return ["DROP TRIGGER update_cash_after_exchange"]
+
+
+class OracleDialect(Dialect):
+    vendor = "oracle"
+
+    identity_pk = "NUMBER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY"
+    integer = "NUMBER"
+    boolean = "NUMBER(1)"
+    current_date = "SYSDATE"
+
+    supports_returning = False
+    supports_partial_indexes = False
+    supports_partitioning = True
+
+    dual = " FROM dual"
+
+    def decimal(self, precision, scale):
+        return f"NUMBER({precision}, {scale})"
+
+    def varchar(self, length):
+        return f"VARCHAR2({length})"
+
+    def add_column(self, table, column, column_type):
+        return f"ALTER TABLE {table} ADD {column} {column_type}"
+
+    def limit(self, count):
+        return f"FETCH FIRST {int(count)} ROWS ONLY"
+
+    def truncate_date(self, column, unit):
+        fmt = {"day": "DD", "week": "IW", "month": "MM"}[unit]
+        return f"TRUNC({column}, '{fmt}')"
+
+    def lock_rows(self, alias, column):
+        return f"FOR UPDATE OF {alias}.{column}"
+
+    def accumulate(self, table, key_columns, value_columns):
+        columns = [*key_columns, *value_columns]
+        source = ", ".join(f"%s {column}" for column in columns)
+        matches = " AND ".join(f"d.{column} = s.{column}" for column in key_columns)
+        updates = ", ".join(f"d.{column} = d.{column} + s.{column}" for column in value_columns)
+        return f"""
+            MERGE INTO {table} d
+            USING (SELECT {source} FROM dual) s
+            ON ({matches})
+            WHEN MATCHED THEN UPDATE SET {updates}
+            WHEN NOT MATCHED THEN INSERT ({", ".join(columns)})
+            VALUES ({", ".join(f"s.{column}" for column in columns)})
+        """
+
+    def datetime_param(self, value):
+        # Oracle хранит TIMESTAMP без зоны, в UTC
+        return value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+
+    def partition_transactions_by_month(self):
+        # Интервальное секционирование: секции новых месяцев создаёт сама СУБД
+        return [
+            """
+            ALTER TABLE exchange_transactions MODIFY
+            PARTITION BY RANGE (transaction_date) INTERVAL (NUMTOYMINTERVAL(1, 'MONTH'))
+            (PARTITION exchange_transactions_p0 VALUES LESS THAN (TIMESTAMP '2000-01-01 00:00:00'))
+            ONLINE UPDATE INDEXES
+            """
+        ]
+
+    def lock_month_partition(self, table, month):
+        return [
+            f"LOCK TABLE {table} PARTITION FOR (TIMESTAMP '{month:%Y-%m-%d} 00:00:00') "
+            f"IN EXCLUSIVE MODE"
+        ]
+
+    def drop_month_partition(self, table, month):
+        return [
+            f"ALTER TABLE {table} DROP PARTITION FOR (TIMESTAMP '{month:%Y-%m-%d} 00:00:00') "
+            f"UPDATE GLOBAL INDEXES"
+        ]
+
+    def exchange_trigger(self, ledger=False):
+        return [
+            f"""
+            CREATE OR REPLACE TRIGGER update_cash_after_exchange
+            AFTER INSERT ON exchange_transactions
+            FOR EACH ROW
+            BEGIN
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash + :NEW.amount
+                WHERE currency_id = :NEW.currency_from_id;
+
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash - :NEW.exchanged_amount
+                WHERE currency_id = :NEW.currency_to_id;
+
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash - :NEW.change_in_base
+                WHERE currency_id = 1;
+                {self.ledger_inserts(":NEW.") if ledger else ""}
+            END;
+            """
+        ]
+
+
+class PostgresDialect(Dialect):
+    vendor = "postgresql"
+
+    identity_pk = "BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY"
+    integer = "BIGINT"
+    boolean = "SMALLINT"
+    timestamp = "TIMESTAMP WITH TIME ZONE"
+
+    supports_partitioning = True
+    supports_prepare = True
+
+    partitions_query = """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s
+    """
+
+    def partition_transactions_by_month(self):
+        """
+        Пересоздание таблицы секционированной: первичный ключ дополняется
+        столбцом секционирования, все строки сначала попадают в секцию
+        по умолчанию, помесячные секции затем забирают из неё свои строки.
+        Триггер и индексы создаются заново после переноса данных.
+        """
+        return [
+            "ALTER TABLE exchange_transactions RENAME TO exchange_transactions_unpartitioned",
+            # Имена индексов не меняются вместе с таблицей и заняли бы имя нового ключа
+            "ALTER INDEX exchange_transactions_pkey RENAME TO exchange_transactions_unpartitioned_pkey",
+            "DROP TRIGGER update_cash_after_exchange ON exchange_transactions_unpartitioned",
+            "CREATE SEQUENCE exchange_transactions_id_seq",
+            """
+            CREATE TABLE exchange_transactions (
+                LIKE exchange_transactions_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                PRIMARY KEY (transaction_id, transaction_date),
+                FOREIGN KEY (operator_id) REFERENCES auth_user(id),
+                FOREIGN KEY (currency_from_id) REFERENCES cash_reserves(currency_id),
+                FOREIGN KEY (currency_to_id) REFERENCES cash_reserves(currency_id)
+            ) PARTITION BY RANGE (transaction_date)
+            """,
+            """
+            ALTER TABLE exchange_transactions
+            ALTER COLUMN transaction_id SET DEFAULT nextval('exchange_transactions_id_seq')
+            """,
+            "ALTER SEQUENCE exchange_transactions_id_seq OWNED BY exchange_transactions.transaction_id",
+            "CREATE TABLE exchange_transactions_default PARTITION OF exchange_transactions DEFAULT",
+            "INSERT INTO exchange_transactions SELECT * FROM exchange_transactions_unpartitioned",
+            """
+            SELECT setval('exchange_transactions_id_seq', COALESCE(MAX(transaction_id), 0) + 1, false)
+            FROM exchange_transactions
+            """,
+            "DROP TABLE exchange_transactions_unpartitioned",
+            """
+            CREATE INDEX exchange_tx_operator_date_idx
+            ON exchange_transactions (operator_id, transaction_date, transaction_id)
+            """,
+            """
+            CREATE INDEX exchange_tx_date_id_idx
+            ON exchange_transactions (transaction_date, transaction_id)
+            """,
+            *self.exchange_trigger(),
+        ]
+
+    def prepare(self, name, sql):
+        # PREPARE уходит без параметров: %s становятся $1, $2..., %% - знаком процента
+        numbers = itertools.count(1)
+        body = PLACEHOLDERS.sub(lambda m: "%" if m.group() == "%%" else f"${next(numbers)}", sql)
+        return f"PREPARE {name} AS {body}"
+
+    def execute_prepared(self, name, param_count):
+        if not param_count:
+            return f"EXECUTE {name}"
+        return f"EXECUTE {name} ({', '.join(['%s'] * param_count)})"
+
+    def create_month_partition(self, table, column, month):
+        partition = self.month_partition(table, month)
+        next_month = (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+        start, end = f"{month:%Y-%m-%d} 00:00:00+00", f"{next_month:%Y-%m-%d} 00:00:00+00"
+        return [
+            f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)",
+            # Строки месяца, попавшие в секцию по умолчанию, переезжают в новую секцию
+            f"""
+            WITH moved AS (
+                DELETE FROM {table}_default
+                WHERE {column} >= '{start}' AND {column} < '{end}'
+                RETURNING *
+            )
+            INSERT INTO {partition} SELECT * FROM moved
+            """,
+            f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM ('{start}') TO ('{end}')",
+        ]
+
+    def lock_month_partition(self, table, month):
+        # Запрещает вставку, не мешая чтению; повторная архивация ждёт первую
+        return [f"LOCK TABLE {self.month_partition(table, month)} IN SHARE ROW EXCLUSIVE MODE"]
+
+    def drop_month_partition(self, table, month):
+        return [f"DROP TABLE IF EXISTS {self.month_partition(table, month)}"]
+
+    def exchange_trigger(self, ledger=False):
+        return [
+            f"""
+            CREATE OR REPLACE FUNCTION update_cash_after_exchange() RETURNS trigger AS $$
+            BEGIN
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash + NEW.amount
+                WHERE currency_id = NEW.currency_from_id;
+
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash - NEW.exchanged_amount
+                WHERE currency_id = NEW.currency_to_id;
+
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash - NEW.change_in_base
+                WHERE currency_id = 1;
+                {self.ledger_inserts("NEW.") if ledger else ""}
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE TRIGGER update_cash_after_exchange
+            AFTER INSERT ON exchange_transactions
+            FOR EACH ROW EXECUTE FUNCTION update_cash_after_exchange()
+            """,
+        ]
+
+    def drop_exchange_trigger(self):
+        return [
+            "DROP TRIGGER update_cash_after_exchange ON exchange_transactions",
+            "DROP FUNCTION update_cash_after_exchange()",
+        ]
+
+
+class SQLiteDialect(Dialect):
+    vendor = "sqlite"
+
+    identity_pk = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    integer = "INTEGER"
+    boolean = "INTEGER"
+    date = "date"
+    timestamp = "timestamp"
+
+    def decimal(self, precision, scale):
+        return f"fixed_decimal({precision}, {scale})"
+
+    def truncate_date(self, column, unit):
+        modifiers = {
+            "day": "",
+            # Ближайшее воскресенье не раньше даты минус шесть дней - понедельник
+            "week": ", 'weekday 0', '-6 days'",
+            "month": ", 'start of month'",
+        }[unit]
+        return f"date({column}{modifiers})"
+
+    def lock_rows(self, alias, column):
+        # SQLite блокирует базу целиком на время пишущей транзакции
+        return ""
+
+    def lock_table(self, table):
+        return ""
+
+    def exchange_trigger(self, ledger=False):
+        return [
+            f"""
+            CREATE TRIGGER update_cash_after_exchange
+            AFTER INSERT ON exchange_transactions
+            FOR EACH ROW
+            BEGIN
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash + NEW.amount
+                WHERE currency_id = NEW.currency_from_id;
+
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash - NEW.exchanged_amount
+                WHERE currency_id = NEW.currency_to_id;
+
+                UPDATE cash_reserves
+                SET amount_in_cash = amount_in_cash - NEW.change_in_base
+                WHERE currency_id = 1;
+                {self.ledger_inserts("NEW.") if ledger else ""}
+            END
+            """
+        ]
+
+
+# Параметр %s или экранированный знак процента %%
+PLACEHOLDERS = re.compile(r"%[s%]")
+
+DIALECTS = {
+    dialect.vendor: dialect()
+    for dialect in (OracleDialect, PostgresDialect, SQLiteDialect)
+}
+
+
+def get_dialect(connection=None):
+    """Диалект SQL для соединения (по умолчанию - основного)."""
+    vendor = (connection or default_connection).vendor
+    try:
+        return DIALECTS[vendor]
+    except KeyError:
+        raise NotImplementedError(f"СУБД {vendor} не поддерживается") from None
@@ -0,0 +1,384 @@
+# exchange/events.py
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .utils import CurrencyExchangeService
+
+logger = logging.getLogger(__name__)
+
+# Типы событий: rate - новый действующий курс, rate_removed - курса больше нет,
+# cash - остаток в кассе, currency - валюта добавлена, архивирована или восстановлена,
+# currency_removed - валюта удалена, reload - страница должна перечитать данные целиком
+RELOAD = "reload"
+# Поля, которые видит только администратор
+ADMIN_FIELDS = {"amount_in_cash"}
+ADMIN_EVENTS = {"cash"}
+
+
+class Subscription:
+    """
+    Очередь событий одного открытого потока. События приходят из любых
+    потоков и передаются в цикл событий подписчика. Переполненная очередь
+    (клиент не успевает читать) заменяется одним событием reload.
+    """
+
+    def __init__(self, loop, queue_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def push(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Цикл событий уже закрыт - поток завершился
+            pass
+
+    def _put(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((None, RELOAD, {}))
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class EventBroker:
+    """
+    Процессный брокер: рассылает события подписчикам этого воркера.
+    Недавние события хранятся, чтобы переподключившийся клиент
+    получил пропущенное по заголовку Last-Event-ID.
+    """
+
+    def __init__(self, history=500, queue_size=100):
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        # Идентификаторы событий действительны только внутри процесса
+        self.token = uuid.uuid4().hex[:8]
+
+    def is_active(self):
+        """Есть ли кому доставлять события (иначе дельты можно не собирать)."""
+        return bool(self._subscribers)
+
+    def publish(self, event_type, data):
+        self._dispatch(event_type, data)
+
+    def _dispatch(self, event_type, data):
+        with self._lock:
+            event = (f"{self.token}-{self._next_id}", event_type, data)
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Подписка из корутины. Пропущенные с last_event_id события сразу
+        ставятся в очередь; если их уже нет в истории - событие reload.
+        """
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if last_event_id:
+                for event in self._missed(last_event_id):
+                    subscription._put(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def _missed(self, last_event_id):
+        token, _, number = last_event_id.partition("-")
+        if token != self.token or not number.isdigit():
+            # Клиент переподключился к другому воркеру или после перезапуска
+            return [(None, RELOAD, {})]
+        number = int(number)
+        if self._history and number + 1 < self._event_number(self._history[0]):
+            return [(None, RELOAD, {})]
+        return [event for event in self._history if self._event_number(event) > number]
+
+    @staticmethod
+    def _event_number(event):
+        return int(event[0].rpartition("-")[2])
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+class SpoolEventBroker(EventBroker):
+    """
+    Замена общей шины для нескольких воркеров на одном сервере: события
+    дописываются строками в файл каталога, каждый воркер читает его хвост
+    и рассылает своим подписчикам. Публиковать могут и команды управления.
+    Воркер с открытыми потоками обновляет время файла подписчиков: пока оно
+    свежее, пишущие процессы собирают и публикуют дельты, иначе - нет.
+    """
+
+    file_name = "events.jsonl"
+    heartbeat_name = "subscribers"
+
+    def __init__(self, directory, poll_interval=0.5, max_bytes=1_000_000, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.path = os.path.join(directory, self.file_name)
+        self.heartbeat_path = os.path.join(directory, self.heartbeat_name)
+        self.poll_interval = poll_interval
+        # Отметка обновляется каждые poll_interval, запас - на задержки потока
+        self.heartbeat_ttl = max(poll_interval * 4, 2)
+        self.max_bytes = max_bytes
+        self._reader_pid = None
+        self._stopped = threading.Event()
+
+    def is_active(self):
+        if self._subscribers:
+            return True
+        # Подписчики могут быть в других процессах
+        try:
+            return time.time() - os.stat(self.heartbeat_path).st_mtime < self.heartbeat_ttl
+        except OSError:
+            return False
+
+    def _heartbeat(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.heartbeat_path, "a"):
+                pass
+            os.utime(self.heartbeat_path)
+        except OSError:
+            logger.warning("Не удалось обновить %s", self.heartbeat_path)
+
+    def publish(self, event_type, data):
+        line = json.dumps([event_type, data], cls=DjangoJSONEncoder, ensure_ascii=False)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Одна запись в файл с O_APPEND не перемешивается с записями других процессов
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (line + "\n").encode())
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if size > self.max_bytes:
+                # Читатели держат старый файл открытым и дочитывают его до конца
+                os.replace(self.path, f"{self.path}.1")
+        except OSError:
+            logger.warning("Не удалось записать событие в %s", self.path)
+
+    def subscribe(self, last_event_id=None):
+        self._start_reader()
+        subscription = super().subscribe(last_event_id)
+        # Записи сразу после подписки уже публикуются
+        self._heartbeat()
+        return subscription
+
+    def _start_reader(self):
+        with self._lock:
+            # После fork поток читателя нужно запустить заново
+            if self._reader_pid == os.getpid():
+                return
+            self._reader_pid = os.getpid()
+        # Позиция фиксируется до возврата подписки: события, записанные сразу
+        # после подписки, не теряются. Прошлые события уже отражены на страницах
+        f = self._open(at_end=True)
+        threading.Thread(
+            target=self._read_forever, args=(f,), name="exchange-events", daemon=True
+        ).start()
+
+    def _open(self, at_end):
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return None
+        if at_end:
+            f.seek(0, os.SEEK_END)
+        return f
+
+    def _read_forever(self, f):
+        buffer = b""
+        heartbeat_at = 0
+        while not self._stopped.is_set():
+            if self._subscribers and time.monotonic() - heartbeat_at >= self.poll_interval:
+                self._heartbeat()
+                heartbeat_at = time.monotonic()
+            if f is None:
+                self._stopped.wait(self.poll_interval)
+                f = self._open(at_end=False)
+                continue
+            chunk = f.read()
+            if chunk:
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    self._dispatch_line(line)
+                continue
+            try:
+                rotated = os.stat(self.path).st_ino != os.fstat(f.fileno()).st_ino
+            except OSError:
+                rotated = True
+            if rotated and not buffer:
+                f.close()
+                f = self._open(at_end=False)
+                continue
+            self._stopped.wait(self.poll_interval)
+        if f is not None:
+            f.close()
+
+    def close(self):
+        """Останавливает поток чтения файла событий."""
+        self._stopped.set()
+
+    def _dispatch_line(self, line):
+        try:
+            event_type, data = json.loads(line)
+        except ValueError:
+            logger.warning("Некорректная строка в %s", self.path)
+            return
+        self._dispatch(event_type, data)
+
+
+def create_broker():
+    options = getattr(settings, "EVENTS", {})
+    kwargs = {
+        "history": options.get("HISTORY", 500),
+        "queue_size": options.get("QUEUE_SIZE", 100),
+    }
+    if options.get("DIR"):
+        return SpoolEventBroker(
+            str(options["DIR"]),
+            poll_interval=options.get("POLL_INTERVAL", 0.5),
+            max_bytes=options.get("MAX_BYTES", 1_000_000),
+            **kwargs,
+        )
+    return EventBroker(**kwargs)
+
+
+broker = create_broker()
+
+
+def encode_event(event_id, event_type, data):
+    """Событие в формате text/event-stream."""
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def visible_event(event_type, data, is_admin):
+    """Данные события для пользователя: остатки кассы видит только администратор."""
+    if is_admin:
+        return data
+    if event_type in ADMIN_EVENTS:
+        return None
+    return {key: value for key, value in data.items() if key not in ADMIN_FIELDS}
+
+
+def receiver(func):
+    """
+    Обработчик сигнала после фиксации: без подписчиков дельты не собираются,
+    ошибка рассылки не должна ломать уже выполненную запись.
+    """
+
+    # Без functools.wraps: Signal.connect проверяет сигнатуру самой обёртки
+    def wrapper(sender, currency_ids, **kwargs):
+        if not broker.is_active():
+            return
+        try:
+            func(CurrencyExchangeService.get_currency_states(currency_ids), currency_ids)
+        except Exception:
+            logger.exception("Не удалось разослать изменения валют %s", currency_ids)
+
+    return wrapper
+
+
+def _rate_fields(state):
+    return {
+        key: state[key]
+        for key in (
+            "currency_id",
+            "currency_name",
+            "rate_id",
+            "rate_to_base",
+            "rate_date",
+            "amount_in_cash",
+        )
+    }
+
+
+@receiver
+def publish_rates(states, currency_ids):
+    """Обработчик rates_changed: новый действующий курс или его отсутствие."""
+    for currency_id in currency_ids:
+        state = states.get(currency_id)
+        if state and state["rate_id"] and not state["is_archived"]:
+            broker.publish("rate", _rate_fields(state))
+        else:
+            broker.publish("rate_removed", {"currency_id": currency_id})
+
+
+@receiver
+def publish_cash(states, currency_ids):
+    """Обработчик cash_changed: новые остатки в кассе."""
+    for currency_id, state in states.items():
+        broker.publish(
+            "cash", {"currency_id": currency_id, "amount_in_cash": state["amount_in_cash"]}
+        )
+
+
+@receiver
+def publish_currencies(states, currency_ids):
+    """Обработчик currencies_changed: состояние валюты целиком или её удаление."""
+    for currency_id in currency_ids:
+        state = states.get(currency_id)
+        if state is None:
+            broker.publish("currency_removed", {"currency_id": currency_id})
+        else:
+            broker.publish(
+                "currency",
+                {**_rate_fields(state), "is_archived": state["is_archived"]},
+            )
+
+
+async def stream_events(last_event_id, is_admin, keepalive=15):
+    """
+    Поток text/event-stream для одного клиента. Подписка снимается, когда
+    клиент отключается и сервер отменяет генератор.
+    """
+    subscription = broker.subscribe(last_event_id)
+    try:
+        # Через 3 секунды после обрыва браузер переподключится сам
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event_id, event_type, data = await asyncio.wait_for(
+                    subscription.get(), keepalive
+                )
+            except asyncio.TimeoutError:
+                # Комментарий не даёт прокси закрыть простаивающее соединение
+                yield ": keepalive\n\n"
+                continue
+            data = visible_event(event_type, data, is_admin)
+            if data is not None:
+                yield encode_event(event_id, event_type, data)
+            if event_type == RELOAD:
+                return
+    finally:
+        broker.unsubscribe(subscription)
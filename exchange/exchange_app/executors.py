@@ -0,0 +1,72 @@
+# exchange/executors.py
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_options = getattr(settings, "ASYNC_EXECUTORS", {})
+
+# Размер пула БД ограничивает и число соединений, открытых асинхронными представлениями.
+# DB_THREADS = 0 - работа идёт в потоке запроса, как у синхронных представлений
+# (так в тестах: данные TestCase видны только в соединении основного потока)
+db_executor = (
+    ThreadPoolExecutor(max_workers=_options.get("DB_THREADS", 8), thread_name_prefix="exchange-db")
+    if _options.get("DB_THREADS", 8)
+    else None
+)
+http_executor = ThreadPoolExecutor(
+    max_workers=_options.get("HTTP_THREADS", 4), thread_name_prefix="exchange-http"
+)
+
+
+def _call_with_connection(func, *args, **kwargs):
+    # Потоки пула живут дольше запроса: соединение закрывается по CONN_MAX_AGE
+    # и после ошибок так же, как в конце обычного запроса
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Блокирующая работа с БД (запросы, шаблоны с сессией) в ограниченном пуле.
+    Если клиент отключился и корутина отменена, ещё не начатая работа
+    снимается из очереди, начатая доводится до конца без ожидания результата.
+    """
+    if db_executor is None:
+        return await sync_to_async(func)(*args, **kwargs)
+    return await sync_to_async(
+        _call_with_connection, thread_sensitive=False, executor=db_executor
+    )(func, *args, **kwargs)
+
+
+async def run_http(func, *args, **kwargs):
+    """Блокирующий запрос к внешнему API в отдельном пуле, не занимающем потоки БД."""
+    return await sync_to_async(func, thread_sensitive=False, executor=http_executor)(
+        *args, **kwargs
+    )
+
+
+_done = object()
+
+
+async def iterate_db(iterable):
+    """
+    Асинхронный обход блокирующего итератора по БД - например, чтения серверным
+    курсором порциями. Курсор и его транзакция принадлежат соединению потока,
+    поэтому каждый следующий элемент читается в потоке запроса, как run_db без
+    пула, а не в потоках пула. Следующая порция читается, когда предыдущая отдана
+    клиенту; при отключении клиента обход прерывается и курсор закрывается.
+    """
+    iterator = iter(iterable)
+    step = sync_to_async(next)
+    try:
+        while (item := await step(iterator, _done)) is not _done:
+            yield item
+    finally:
+        if hasattr(iterator, "close"):
+            await sync_to_async(iterator.close)()
+
@@ -52,6 +52,30 @@ class AddExchangeRateForm(forms.Form):
     )
 
 
+class DeleteRatesForm(forms.Form):
+    currency = forms.ChoiceField(choices=[], required=False, label="Валюта")
+    date_from = forms.DateField(
+        required=False, label="С даты", widget=forms.DateInput(attrs={"type": "date"})
+    )
+    date_to = forms.DateField(
+        label="По дату", widget=forms.DateInput(attrs={"type": "date"})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get("date_from")
+        date_to = cleaned_data.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise ValidationError("Начало периода позже его конца.")
+        return cleaned_data
+
+
+class ImportRatesForm(forms.Form):
+    markup = forms.DecimalField(
+        label="Наценка (%)", required=False, max_digits=5, decimal_places=2, initial=0
+    )
+
+
 class AddCurrencyToCashForm(forms.Form):
     # Получаем список валют из таблицы cash_reserves
     currency_name = forms.ChoiceField(choices=[], label="Выберите валюту")
@@ -63,6 +87,45 @@ class AddCurrencyToCashForm(forms.Form):
     )
 
 
+class ExportTransactionsForm(forms.Form):
+    date_from = forms.DateField(required=False, label="С даты")
+    date_to = forms.DateField(required=False, label="По дату")
+    operator = forms.IntegerField(required=False, min_value=1, label="Оператор")
+    format = forms.ChoiceField(
+        choices=[("csv", "CSV"), ("ndjson", "NDJSON")],
+        required=False,
+        label="Формат",
+    )
+
+
+class TurnoverReportForm(forms.Form):
+    date_from = forms.DateField(
+        required=False, label="С даты", widget=forms.DateInput(attrs={"type": "date"})
+    )
+    date_to = forms.DateField(
+        required=False, label="По дату", widget=forms.DateInput(attrs={"type": "date"})
+    )
+
+
+class RateHistoryForm(forms.Form):
+    currency = forms.IntegerField(min_value=1, label="Валюта")
+    date_from = forms.DateField(required=False, label="С даты")
+    date_to = forms.DateField(required=False, label="По дату")
+    interval = forms.ChoiceField(
+        choices=[("day", "День"), ("week", "Неделя"), ("month", "Месяц")],
+        required=False,
+        label="Интервал",
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get("date_from")
+        date_to = cleaned_data.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise ValidationError("Начало периода позже его конца.")
+        return cleaned_data
+
+
 class UserRegisterForm(UserCreationForm):
     class Meta:
         model = User
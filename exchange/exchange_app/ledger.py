@@ -0,0 +1,116 @@
+# exchange/ledger.py
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .dialects import get_dialect
+from .statements import statements
+
+# Виды движений кассы. Обмен (exchange_in, exchange_out, change) пишет триггер
+# exchange_transactions, остальные - код, меняющий остатки напрямую
+OPENING = "opening"
+TOPUP = "topup"
+ADJUSTMENT = "adjustment"
+
+INSERT_MOVEMENT = statements.register(
+    "insert_cash_movement",
+    """
+    INSERT INTO cash_ledger (currency_id, amount, kind, created_at)
+    VALUES (%s, %s, %s, %s)
+    """,
+)
+
+
+def record_cash_movements(cursor, movements):
+    """
+    Движения (currency_id, сумма со знаком, вид) в транзакции, изменившей остатки.
+    Пишутся после изменения остатков, под блокировкой строк кассы.
+    """
+    created_at = get_dialect().datetime_param(timezone.now())
+    statements.executemany(
+        cursor,
+        INSERT_MOVEMENT,
+        [[currency_id, amount, kind, created_at] for currency_id, amount, kind in movements],
+    )
+
+
+def reconcile_cash(checkpoint=False):
+    """
+    Сверка остатков кассы с последней контрольной точкой плюс движения после неё:
+    читается только журнал с последней точки. Таблица кассы блокируется на время
+    сверки: новые движения и новые валюты ждут её окончания, иначе движение
+    валюты, добавленной во время сверки, попало бы в точку без её остатка.
+    С checkpoint=True при совпадении всех остатков записывается новая точка.
+    """
+    dialect = get_dialect()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if lock := dialect.lock_table("cash_reserves"):
+            cursor.execute(lock)
+        cursor.execute(
+            """
+            SELECT cr.currency_id, cr.currency_name, cr.amount_in_cash
+            FROM cash_reserves cr
+            ORDER BY cr.currency_id
+            """
+        )
+        live = cursor.fetchall()
+        cursor.execute("SELECT MAX(checkpoint_id) FROM cash_checkpoints")
+        checkpoint_id = cursor.fetchone()[0] or 0
+        cursor.execute(
+            "SELECT currency_id, balance, last_entry_id FROM cash_checkpoints "
+            "WHERE checkpoint_id = %s",
+            [checkpoint_id],
+        )
+        rows = cursor.fetchall()
+        balances = {int(row[0]): row[1] for row in rows}
+        last_entry_id = int(rows[0][2]) if rows else 0
+        cursor.execute(
+            """
+            SELECT currency_id, SUM(amount), COUNT(1), MAX(entry_id)
+            FROM cash_ledger
+            WHERE entry_id > %s
+            GROUP BY currency_id
+            """,
+            [last_entry_id],
+        )
+        movements, head = {}, last_entry_id
+        for currency_id, total, count, max_entry_id in cursor.fetchall():
+            # Агрегаты SQLite теряют тип столбца и приходят числами
+            movements[int(currency_id)] = (Decimal(str(total)).quantize(Decimal("0.01")), int(count))
+            head = max(head, int(max_entry_id))
+
+        currencies = []
+        for currency_id, currency_name, actual in live:
+            opening = balances.get(int(currency_id), Decimal(0))
+            change, count = movements.get(int(currency_id), (Decimal(0), 0))
+            currencies.append(
+                {
+                    "currency_id": int(currency_id),
+                    "currency_name": currency_name,
+                    "checkpoint_balance": opening,
+                    "movements": count,
+                    "expected": opening + change,
+                    "actual": actual,
+                }
+            )
+        mismatches = [row for row in currencies if row["expected"] != row["actual"]]
+
+        new_checkpoint_id = None
+        if checkpoint and not mismatches:
+            new_checkpoint_id = checkpoint_id + 1
+            cursor.executemany(
+                f"""
+                INSERT INTO cash_checkpoints (checkpoint_id, currency_id, balance, last_entry_id, created_at)
+                VALUES (%s, %s, %s, %s, {dialect.current_timestamp})
+                """,
+                [[new_checkpoint_id, row["currency_id"], row["actual"], head] for row in currencies],
+            )
+    return {
+        "checkpoint_id": checkpoint_id,
+        "last_entry_id": last_entry_id,
+        "movements": sum(count for _, count in movements.values()),
+        "currencies": currencies,
+        "mismatches": mismatches,
+        "new_checkpoint_id": new_checkpoint_id,
+    }
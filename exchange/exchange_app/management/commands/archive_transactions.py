@@ -0,0 +1,36 @@
+# exchange/management/commands/archive_transactions.py
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from exchange_app.archive import add_months, month_start
+from exchange_app.utils import CurrencyExchangeService
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит транзакции закрытых месяцев (UTC) в сжатые файлы архива "
+        "и создаёт секции таблицы на следующие месяцы."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-months",
+            type=int,
+            default=0,
+            help="Сколько закрытых месяцев оставить в таблице помимо текущего.",
+        )
+        parser.add_argument(
+            "--months-ahead", type=int, default=3, help="На сколько месяцев вперёд создать секции."
+        )
+
+    def handle(self, *args, **options):
+        if options["keep_months"] < 0:
+            raise CommandError("--keep-months не может быть отрицательным: текущий месяц не архивируется.")
+        service = CurrencyExchangeService()
+        service.ensure_transaction_partitions(options["months_ahead"])
+
+        # Архивируются месяцы строго раньше первого оставляемого
+        first_live_month = add_months(month_start(timezone.now()), -options["keep_months"])
+        for month, count in service.archive_transactions_before(first_live_month):
+            self.stdout.write(f"{month:%Y-%m}: перенесено транзакций {count}")
+        self.stdout.write(self.style.SUCCESS("Архивация завершена"))
@@ -0,0 +1,122 @@
+# exchange/management/commands/backfill_rates.py
+import hashlib
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from exchange_app.checkpoints import clear_checkpoint
+from exchange_app.utils import BASE_CURRENCY_ID, MAX_IN_LIST, CurrencyExchangeService
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает историю курсов валют кассы за период из API Нацбанка "
+        "(rates/dynamics) параллельными запросами по окнам дат. Существующие "
+        "курсы не дублируются, прерванная загрузка продолжается с места остановки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date-from", type=parse_date, required=True, help="С даты, YYYY-MM-DD."
+        )
+        parser.add_argument(
+            "--date-to", type=parse_date, help="По дату включительно (по умолчанию сегодня)."
+        )
+        parser.add_argument(
+            "--currency",
+            type=int,
+            nargs="+",
+            help="Валюты кассы (по умолчанию все неархивные, кроме базовой).",
+        )
+        parser.add_argument("--markup", type=Decimal, default=None, help="Наценка в процентах.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=min(4, settings.NBRB_CLIENT["pool_size"]),
+            help="Одновременных запросов к API.",
+        )
+        parser.add_argument(
+            "--window-days", type=int, default=365, help="Дней в одном запросе, не больше 365."
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=MAX_IN_LIST,
+            help="Курсов в одной пакетной вставке.",
+        )
+        parser.add_argument(
+            "--restart", action="store_true", help="Начать заново, не продолжая прерванное."
+        )
+
+    def handle(self, *args, **options):
+        service = CurrencyExchangeService()
+        date_from = options["date_from"]
+        date_to = options["date_to"] or timezone.localdate()
+        if date_from > date_to:
+            raise CommandError("Начало периода позже его конца.")
+        if not 1 <= options["window_days"] <= 365:
+            raise CommandError("Окно запроса - от 1 до 365 дней.")
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("Число потоков и размер пакета должны быть положительными.")
+
+        catalog = {
+            currency_id: is_archived
+            for currency_id, _, is_archived in service.get_currency_catalog()
+        }
+        currency_ids = options["currency"] or [
+            currency_id
+            for currency_id, is_archived in catalog.items()
+            if not is_archived and currency_id != BASE_CURRENCY_ID
+        ]
+        unknown = [
+            currency_id
+            for currency_id in currency_ids
+            if currency_id not in catalog or currency_id == BASE_CURRENCY_ID
+        ]
+        if unknown:
+            raise CommandError(f"Нет таких валют кассы: {', '.join(map(str, unknown))}")
+        currency_ids = sorted(set(currency_ids))
+
+        currencies = ",".join(map(str, currency_ids))
+        if len(currencies) > 100:
+            # Имя задания ограничено 200 символами
+            currencies = hashlib.sha1(currencies.encode()).hexdigest()
+        job = f"backfill:{currencies}:{date_from}:{date_to}:{options['markup']}"
+        if options["restart"]:
+            clear_checkpoint(job)
+        try:
+            result = service.backfill_rates(
+                currency_ids,
+                date_from,
+                date_to,
+                markup=options["markup"],
+                window_days=options["window_days"],
+                workers=options["workers"],
+                batch_size=options["batch_size"],
+                job=job,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Загружено курсов: {result['inserted']}, уже были: {result['skipped']}"
+            )
+        )
+        for currency_id in result["missing"]:
+            self.stdout.write(
+                self.style.WARNING(f"Нет истории в API: {service.get_currency_name(currency_id)}")
+            )
+        if result["failed"]:
+            for currency_id, start, end in result["failed"]:
+                self.stderr.write(
+                    f"Не загружено: {service.get_currency_name(currency_id)} {start} - {end}"
+                )
+            raise CommandError("Часть запросов не выполнена, повторите команду для продолжения.")
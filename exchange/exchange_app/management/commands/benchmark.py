@@ -0,0 +1,130 @@
+# exchange/management/commands/benchmark.py
+import json
+import logging
+import platform
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from exchange_app.benchmarks import build_cases, measure, measure_rolled_back
+from exchange_app.statements import statements
+from exchange_app.utils import BASE_CURRENCY_ID, CurrencyExchangeService
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет задержки (p50/p95/p99) и число SQL-запросов на вызов "
+        "для основных операций сервиса и страниц, результат пишет в JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument(
+            "--operator", default=None, help="Оператор, от имени которого идут обмены."
+        )
+        parser.add_argument(
+            "--only", nargs="*", default=None, help="Выполнить только указанные замеры."
+        )
+        parser.add_argument(
+            "--output", default=None, help="Файл для JSON-результатов (по умолчанию stdout)."
+        )
+
+    def handle(self, *args, **options):
+        service = CurrencyExchangeService()
+        operator = self.get_operator(options["operator"])
+        currency_to_id = self.get_exchange_currency()
+        client = Client(HTTP_HOST="127.0.0.1")
+        # Страницы смотрим глазами администратора: история без фильтра по оператору
+        client.force_login(
+            User.objects.filter(is_superuser=True).order_by("id").first() or operator
+        )
+
+        cases = build_cases(service, client, operator.id, BASE_CURRENCY_ID, currency_to_id)
+        unknown = set(options["only"] or []) - set(cases)
+        if unknown:
+            raise CommandError(f"Неизвестные замеры: {', '.join(sorted(unknown))}")
+
+        # Журнал SQL на уровне DEBUG искажает замеры
+        sql_logger = logging.getLogger("django.db.backends")
+        level = sql_logger.level
+        sql_logger.setLevel(logging.WARNING)
+        results = {}
+        try:
+            for name, (func, writes) in cases.items():
+                if options["only"] and name not in options["only"]:
+                    continue
+                run = measure_rolled_back if writes else measure
+                results[name] = run(func, options["iterations"])
+                self.stderr.write(
+                    f"{name}: p50={results[name]['p50_ms']} мс, "
+                    f"p95={results[name]['p95_ms']} мс, "
+                    f"запросов={results[name]['queries_per_call']}"
+                )
+        finally:
+            sql_logger.setLevel(level)
+
+        report = {
+            "started_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "connections": {
+                "conn_max_age": connection.settings_dict["CONN_MAX_AGE"],
+                "health_checks": connection.settings_dict["CONN_HEALTH_CHECKS"],
+                "pool": bool(connection.settings_dict.get("OPTIONS", {}).get("pool")),
+                "prepared_statements": statements.prepare and connection.vendor == "postgresql",
+                "registered_statements": len(statements),
+            },
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "data": self.get_data_size(),
+            "results": results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    @staticmethod
+    def get_operator(username):
+        users = User.objects.order_by("id")
+        operator = (
+            users.filter(username=username).first()
+            if username
+            else users.filter(is_superuser=False).first()
+        )
+        if operator is None:
+            raise CommandError("Оператор не найден, сначала выполните generate_data.")
+        return operator
+
+    @staticmethod
+    def get_exchange_currency():
+        """Самая наполненная активная валюта с курсом - её кассы хватит на все обмены."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT c.currency_id
+                FROM cash_reserves c
+                JOIN current_rates r ON r.currency_id = c.currency_id
+                WHERE c.is_archived = 0 AND c.currency_id <> %s
+                ORDER BY c.amount_in_cash DESC
+                """,
+                [BASE_CURRENCY_ID],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise CommandError("Нет валют с курсами, сначала выполните generate_data.")
+        return row[0]
+
+    @staticmethod
+    def get_data_size():
+        sizes = {}
+        with connection.cursor() as cursor:
+            for table in ("cash_reserves", "exchange_rates", "exchange_transactions"):
+                cursor.execute(f"SELECT COUNT(1) FROM {table}")
+                sizes[table] = cursor.fetchone()[0]
+        return sizes
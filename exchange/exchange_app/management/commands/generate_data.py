@@ -0,0 +1,189 @@
+# exchange/management/commands/generate_data.py
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from exchange_app.dialects import get_dialect
+from exchange_app.ledger import ADJUSTMENT, OPENING, record_cash_movements
+from exchange_app.utils import BASE_CURRENCY_ID, CurrencyExchangeService
+from exchange_app.versions import CASH, CURRENCIES, bump_data_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует синтетические данные для нагрузочных замеров: валюты, "
+        "ежедневные курсы за несколько лет и транзакции операторов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--currencies", type=int, default=30)
+        parser.add_argument("--years", type=int, default=2)
+        parser.add_argument("--transactions", type=int, default=100_000)
+        parser.add_argument("--operators", type=int, default=10)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options["seed"])
+        service = CurrencyExchangeService()
+        batch_size = options["batch_size"]
+        today = timezone.localdate()
+        first_day = today - timedelta(days=365 * options["years"])
+
+        operator_ids = self.create_operators(options["operators"])
+        currency_ids = self.create_currencies(options["currencies"])
+        self.stdout.write(
+            f"Операторов: {len(operator_ids)}, валют: {len(currency_ids)}"
+        )
+
+        # Базовый курс валюты и его ежедневные колебания
+        base_rates = {
+            currency_id: Decimal(rnd.uniform(0.01, 10)).quantize(Decimal("0.0001"))
+            for currency_id in currency_ids
+        }
+        rates, days = [], (today - first_day).days + 1
+        with connection.cursor() as cursor:
+            for currency_id, base_rate in base_rates.items():
+                for offset in range(days):
+                    drift = Decimal(1 + rnd.uniform(-0.05, 0.05))
+                    rates.append(
+                        [
+                            currency_id,
+                            (base_rate * drift).quantize(Decimal("0.0001")),
+                            first_day + timedelta(days=offset),
+                        ]
+                    )
+                    if len(rates) >= batch_size:
+                        self.insert_rates(cursor, rates)
+                        rates = []
+            self.insert_rates(cursor, rates)
+            service.refresh_current_rates(cursor, currency_ids)
+        self.stdout.write(f"Курсов: {len(currency_ids) * days}")
+
+        dialect = get_dialect()
+        all_currency_ids = [BASE_CURRENCY_ID, *currency_ids]
+        seconds = days * 24 * 60 * 60
+        start = timezone.now() - timedelta(seconds=seconds)
+        transactions, total = [], options["transactions"]
+        with connection.cursor() as cursor:
+            for _ in range(total):
+                currency_from_id, currency_to_id = rnd.sample(all_currency_ids, 2)
+                rate_from = base_rates.get(currency_from_id, Decimal(1))
+                rate_to = base_rates.get(currency_to_id, Decimal(1))
+                amount = Decimal(rnd.randint(1, 1000))
+                amount_in_base = (amount * rate_from).quantize(Decimal("0.01"))
+                exchanged_amount = int(amount_in_base / rate_to)
+                change_in_base = (
+                    0
+                    if currency_to_id == BASE_CURRENCY_ID
+                    else (amount_in_base - exchanged_amount * rate_to).quantize(Decimal("0.01"))
+                )
+                transactions.append(
+                    [
+                        rnd.choice(operator_ids),
+                        currency_from_id,
+                        currency_to_id,
+                        amount,
+                        exchanged_amount,
+                        change_in_base,
+                        amount_in_base,
+                        dialect.datetime_param(
+                            start + timedelta(seconds=rnd.randrange(seconds))
+                        ),
+                    ]
+                )
+                if len(transactions) >= batch_size:
+                    self.insert_transactions(cursor, transactions)
+                    transactions = []
+            self.insert_transactions(cursor, transactions)
+        service.rebuild_turnover(first_day, today)
+        self.stdout.write(self.style.SUCCESS(f"Транзакций: {total}"))
+
+    @staticmethod
+    def create_operators(count):
+        password = make_password(None)
+        existing = User.objects.filter(username__startswith="bench_operator_").count()
+        User.objects.bulk_create(
+            User(username=f"bench_operator_{existing + index}", password=password)
+            for index in range(count)
+        )
+        return list(
+            User.objects.filter(username__startswith="bench_operator_").values_list(
+                "id", flat=True
+            )
+        )
+
+    @staticmethod
+    def create_currencies(count):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(1) FROM cash_reserves WHERE currency_name LIKE %s",
+                ["Тестовая валюта %"],
+            )
+            existing = cursor.fetchone()[0]
+            new_names = [f"Тестовая валюта {existing + index}" for index in range(count)]
+            # Запас кассы, чтобы триггер не упирался в CHECK(amount_in_cash >= 0)
+            cursor.executemany(
+                "INSERT INTO cash_reserves (currency_name, amount_in_cash) VALUES (%s, %s)",
+                [[name, 10 ** 11] for name in new_names],
+            )
+            cursor.execute(
+                "SELECT amount_in_cash FROM cash_reserves WHERE currency_id = %s",
+                [BASE_CURRENCY_ID],
+            )
+            base_cash = cursor.fetchone()[0]
+            cursor.execute(
+                "UPDATE cash_reserves SET amount_in_cash = %s WHERE currency_id = %s",
+                [10 ** 11, BASE_CURRENCY_ID],
+            )
+            bump_data_version(cursor, CURRENCIES, CASH)
+            cursor.execute(
+                "SELECT currency_id, currency_name FROM cash_reserves WHERE currency_name LIKE %s",
+                ["Тестовая валюта %"],
+            )
+            currencies = cursor.fetchall()
+            # Остатки меняются в обход сервиса - движения пишутся в журнал кассы здесь
+            record_cash_movements(
+                cursor,
+                [
+                    *(
+                        (currency_id, 10 ** 11, OPENING)
+                        for currency_id, name in currencies
+                        if name in new_names
+                    ),
+                    (BASE_CURRENCY_ID, 10 ** 11 - base_cash, ADJUSTMENT),
+                ],
+            )
+            return [int(row[0]) for row in currencies]
+
+    @staticmethod
+    def insert_rates(cursor, rates):
+        if rates:
+            with transaction.atomic():
+                cursor.executemany(
+                    "INSERT INTO exchange_rates (currency_id, rate_to_base, rate_date) "
+                    "VALUES (%s, %s, %s)",
+                    rates,
+                )
+
+    @staticmethod
+    def insert_transactions(cursor, transactions):
+        if transactions:
+            with transaction.atomic():
+                cursor.executemany(
+                    """
+                    INSERT INTO exchange_transactions (
+                        operator_id, currency_from_id, currency_to_id, amount, exchanged_amount,
+                        change_in_base, amount_in_base, transaction_date
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    transactions,
+                )
+                # Остатки кассы меняет триггер - кэш страниц курсов и кассы устаревает
+                bump_data_version(cursor, CASH)
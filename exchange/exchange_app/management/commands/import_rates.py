@@ -0,0 +1,34 @@
+# exchange/management/commands/import_rates.py
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from exchange_app.utils import CurrencyExchangeService
+
+
+class Command(BaseCommand):
+    help = "Загружает курсы всех активных валют кассы из API Нацбанка одним запросом."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--markup", type=Decimal, default=None, help="Наценка в процентах."
+        )
+        parser.add_argument(
+            "--date",
+            type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+            default=None,
+            help="Дата курсов в формате YYYY-MM-DD (по умолчанию сегодня).",
+        )
+
+    def handle(self, *args, **options):
+        imported, missing, error = CurrencyExchangeService().import_rates_from_api(
+            markup=options["markup"], rate_date=options["date"]
+        )
+        if error:
+            raise CommandError(error)
+        self.stdout.write(
+            self.style.SUCCESS(f"Загружено курсов: {len(imported)}")
+        )
+        for currency_name in missing:
+            self.stdout.write(self.style.WARNING(f"Нет курса в API: {currency_name}"))
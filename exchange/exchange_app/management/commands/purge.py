@@ -0,0 +1,110 @@
+# exchange/management/commands/purge.py
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from exchange_app.archive import add_months, month_start
+from exchange_app.checkpoints import clear_checkpoint, get_checkpoint
+from exchange_app.utils import MAX_IN_LIST, CurrencyExchangeService, purge_job
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет курсы или транзакции по фильтру порциями с фиксацией каждой порции, "
+        "либо применяет политику хранения из настроек RETENTION (policy). "
+        "Прерванное удаление с теми же параметрами продолжается с места остановки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", choices=["rates", "transactions", "policy"])
+        parser.add_argument("--date-from", type=parse_date, help="С даты, YYYY-MM-DD.")
+        parser.add_argument("--date-to", type=parse_date, help="По дату включительно, YYYY-MM-DD.")
+        parser.add_argument(
+            "--older-than-days", type=int, help="Всё старше указанного числа дней."
+        )
+        parser.add_argument("--currency", type=int, help="Только по этой валюте.")
+        parser.add_argument(
+            "--include-current",
+            action="store_true",
+            help="Удалять и действующие курсы (по умолчанию они сохраняются).",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=settings.RETENTION["CHUNK_SIZE"],
+            help=f"Строк в одной транзакции, не больше {MAX_IN_LIST}.",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=settings.RETENTION["PAUSE"],
+            help="Пауза между порциями в секундах.",
+        )
+        parser.add_argument(
+            "--restart", action="store_true", help="Начать заново, не продолжая прерванное."
+        )
+
+    def handle(self, *args, **options):
+        self.service = CurrencyExchangeService()
+        if options["target"] == "policy":
+            self.apply_policy(options)
+            return
+        date_to = options["date_to"]
+        if options["older_than_days"] is not None:
+            date_to = timezone.localdate() - timedelta(days=options["older_than_days"] + 1)
+        if not (options["date_from"] or date_to or options["currency"]):
+            raise CommandError("Укажите период или валюту: удаление всего не поддерживается.")
+        if options["date_from"] and date_to and options["date_from"] > date_to:
+            raise CommandError("Начало периода позже его конца.")
+        if options["target"] == "rates":
+            self.purge_rates(options["date_from"], date_to, options)
+        else:
+            self.purge_transactions(options["date_from"], date_to, options)
+
+    def apply_policy(self, options):
+        policy = settings.RETENTION
+        if policy["RATES_DAYS"]:
+            self.purge_rates(
+                None,
+                timezone.localdate() - timedelta(days=policy["RATES_DAYS"] + 1),
+                {**options, "currency": None, "include_current": False},
+            )
+        if policy["TRANSACTIONS_KEEP_MONTHS"] is not None:
+            # Старые транзакции не удаляются, а переносятся в архив
+            first_live_month = add_months(
+                month_start(timezone.now()), -policy["TRANSACTIONS_KEEP_MONTHS"]
+            )
+            for month, count in self.service.archive_transactions_before(first_live_month):
+                self.stdout.write(f"{month:%Y-%m}: перенесено в архив транзакций {count}")
+
+    def chunk_options(self, job, options):
+        if options["restart"]:
+            clear_checkpoint(job)
+        elif (position := get_checkpoint(job)) is not None:
+            self.stdout.write(f"Продолжение прерванного удаления после id {position}")
+        return {"chunk_size": options["chunk_size"], "pause": options["pause"], "job": job}
+
+    def purge_rates(self, date_from, date_to, options):
+        keep_current = not options["include_current"]
+        job = purge_job("rates", date_from, date_to, options["currency"], keep_current)
+        count = self.service.purge_rates(
+            date_from,
+            date_to,
+            options["currency"],
+            keep_current=keep_current,
+            **self.chunk_options(job, options),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Удалено курсов: {count}"))
+
+    def purge_transactions(self, date_from, date_to, options):
+        job = purge_job("transactions", date_from, date_to, options["currency"])
+        count = self.service.purge_transactions(
+            date_from, date_to, options["currency"], **self.chunk_options(job, options)
+        )
+        self.stdout.write(self.style.SUCCESS(f"Удалено транзакций: {count}"))
@@ -0,0 +1,41 @@
+# exchange/management/commands/rebuild_turnover.py
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from exchange_app.archive import add_months, month_start
+from exchange_app.utils import CurrencyExchangeService
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает дневные обороты за период по истории обменов."
+
+    def add_arguments(self, parser):
+        parser.add_argument("date_from", type=parse_date, help="Начало периода, YYYY-MM-DD.")
+        parser.add_argument("date_to", type=parse_date, help="Конец периода, YYYY-MM-DD.")
+
+    def handle(self, *args, **options):
+        if options["date_from"] > options["date_to"]:
+            raise CommandError("Начало периода позже его конца.")
+        service = CurrencyExchangeService()
+        # Транзакций архивных месяцев в таблице нет, пересчёт обнулил бы их обороты
+        archived = set(service.get_archived_months())
+        tz = timezone.get_current_timezone()
+        month = month_start(datetime.combine(options["date_from"], time.min, tz))
+        last_month = month_start(
+            datetime.combine(options["date_to"] + timedelta(days=1), time.min, tz)
+            - timedelta(microseconds=1)
+        )
+        while month <= last_month:
+            if month in archived:
+                raise CommandError(f"Период затрагивает архивный месяц {month:%Y-%m}.")
+            month = add_months(month, 1)
+        count = service.rebuild_turnover(
+            options["date_from"], options["date_to"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано транзакций: {count}"))
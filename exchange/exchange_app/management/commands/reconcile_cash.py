@@ -0,0 +1,40 @@
+# exchange/management/commands/reconcile_cash.py
+from django.core.management.base import BaseCommand, CommandError
+
+from exchange_app.ledger import reconcile_cash
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет остатки кассы с последней контрольной точкой и журналом движений "
+        "после неё; с --checkpoint при совпадении записывает новую точку."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--checkpoint",
+            action="store_true",
+            help="Записать контрольную точку, если остатки сошлись (ежедневная сверка).",
+        )
+
+    def handle(self, *args, **options):
+        result = reconcile_cash(checkpoint=options["checkpoint"])
+        self.stdout.write(
+            f"Контрольная точка {result['checkpoint_id']}, "
+            f"движений после неё: {result['movements']}"
+        )
+        for row in result["currencies"]:
+            status = "OK" if row["expected"] == row["actual"] else "РАСХОЖДЕНИЕ"
+            self.stdout.write(
+                f"{row['currency_name']}: ожидается {row['expected']}, "
+                f"в кассе {row['actual']} ({row['movements']} движ.) {status}"
+            )
+        if result["mismatches"]:
+            raise CommandError(
+                "Остатки не сходятся: "
+                + ", ".join(row["currency_name"] for row in result["mismatches"])
+            )
+        if result["new_checkpoint_id"]:
+            self.stdout.write(
+                self.style.SUCCESS(f"Записана контрольная точка {result['new_checkpoint_id']}")
+            )
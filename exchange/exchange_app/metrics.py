@@ -0,0 +1,414 @@
+# exchange/metrics.py
+import atexit
+import contextvars
+import inspect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: файлы завершившихся процессов не сворачиваются
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+# Имя -> (тип, описание, границы корзин гистограммы)
+METRICS = {
+    "exchange_http_request_duration_seconds": (
+        "histogram", "Время обработки HTTP-запроса", LATENCY_BUCKETS
+    ),
+    "exchange_http_request_queries": (
+        "histogram", "Число SQL-запросов за HTTP-запрос", QUERY_BUCKETS
+    ),
+    "exchange_db_statement_duration_seconds": (
+        "summary", "Время выполнения SQL по нормализованному тексту запроса", ()
+    ),
+    "exchange_service_call_duration_seconds": (
+        "histogram", "Время выполнения методов CurrencyExchangeService", LATENCY_BUCKETS
+    ),
+    "exchange_nbrb_request_duration_seconds": (
+        "histogram", "Время запросов к API Нацбанка", LATENCY_BUCKETS
+    ),
+}
+
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+# Файл с суммой рядов завершившихся процессов
+TOTALS_FILE = "totals.json"
+
+
+def _pid_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Процесс есть, но принадлежит другому пользователю
+        return True
+    return True
+
+
+def _merge(merged, data):
+    for name, labels, values in data:
+        if name not in METRICS:
+            continue
+        key = (name, tuple(sorted(labels.items())))
+        series = merged.get(key)
+        if series is None or len(series) != len(values):
+            merged[key] = list(values)
+        else:
+            merged[key] = [a + b for a, b in zip(series, values)]
+
+
+def _dump(path, series):
+    """Атомарная запись рядов в файл через временный."""
+    data = [[name, dict(labels), values] for (name, labels), values in series.items()]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса. Значение ряда - счётчики корзин (для гистограмм),
+    затем число наблюдений и их сумма. Процесс периодически сбрасывает
+    свои ряды в отдельный файл, /metrics суммирует файлы всех воркеров.
+    """
+
+    def __init__(self, directory=None, flush_interval=5, max_series=2000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_series = max_series
+        self._reset()
+
+    def _reset(self):
+        self._series = {}
+        self._lock = threading.Lock()
+        self._path = None
+        self._active = False
+        self._flushed_at = time.monotonic()
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                if len(self._series) >= self.max_series:
+                    # Ограничение числа рядов: новые метки сливаются в один ряд
+                    key = (name, tuple((label, "other") for label, _ in key[1]))
+                    series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = [0] * (len(buckets) + 3)
+            if buckets:
+                series[bisect_left(buckets, value)] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(values) for key, values in self._series.items()}
+
+    def maybe_flush(self):
+        # Файл заводят только процессы, обслуживающие запросы
+        self._active = True
+        if self.directory and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Атомарная запись рядов процесса в его файл."""
+        if not self.directory:
+            return
+        self._flushed_at = time.monotonic()
+        if self._path is None:
+            # Метка времени отличает процесс от прежнего владельца того же pid
+            self._path = os.path.join(
+                self.directory, f"{os.getpid()}-{time.time_ns()}.json"
+            )
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            _dump(self._path, self.snapshot())
+        except OSError:
+            logger.warning("Не удалось сохранить метрики: %s", self._path)
+
+    def flush_on_exit(self):
+        if self._active:
+            self.flush()
+
+    def collect(self):
+        """
+        Ряды всех воркеров: файлы каталога плюс текущее состояние процесса.
+        Файлы завершившихся процессов сначала сворачиваются в TOTALS_FILE.
+        """
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        with self._directory_lock() as locked:
+            if locked:
+                self.fold_dead()
+            for file_name in self._file_names():
+                if (data := self._read(file_name)) is not None:
+                    _merge(merged, data)
+        return merged
+
+    def fold_dead(self):
+        """
+        Файлы завершившихся процессов прибавляются к TOTALS_FILE и удаляются:
+        суммы не теряются, а каталог не растёт с каждым перезапуском воркеров.
+        Вызывается под блокировкой каталога - /metrics собирают и другие воркеры.
+        """
+        dead = [
+            file_name
+            for file_name in self._file_names()
+            if (pid := file_name.split("-")[0]).isdigit()
+            and int(pid) != os.getpid()
+            and not _pid_is_alive(int(pid))
+        ]
+        if not dead:
+            return
+        totals = {}
+        _merge(totals, self._read(TOTALS_FILE) or [])
+        for file_name in dead:
+            _merge(totals, self._read(file_name) or [])
+        try:
+            _dump(os.path.join(self.directory, TOTALS_FILE), totals)
+            for file_name in dead:
+                os.remove(os.path.join(self.directory, file_name))
+        except OSError:
+            logger.warning("Не удалось свернуть метрики завершившихся процессов")
+
+    @contextmanager
+    def _directory_lock(self):
+        """Исключительная блокировка каталога; False - блокировка недоступна."""
+        try:
+            lock = open(os.path.join(self.directory, ".lock"), "a") if fcntl else None
+        except OSError:
+            lock = None
+        if lock is None:
+            yield False
+            return
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield True
+
+    def _file_names(self):
+        try:
+            return [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        except OSError:
+            return []
+
+    def _read(self, file_name):
+        try:
+            with open(os.path.join(self.directory, file_name), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{label}="{_label_value(value)}"' for label, value in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_text(series):
+    """Текстовый формат экспозиции Prometheus."""
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        rows = sorted((key[1], values) for key, values in series.items() if key[0] == name)
+        if not rows:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, values in rows:
+            if buckets:
+                cumulative = 0
+                for bound, count in zip([*buckets, "+Inf"], values):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}"
+                    )
+            lines.append(f"{name}_count{_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+    return "\n".join(lines) + "\n"
+
+
+_options = getattr(settings, "METRICS", {})
+registry = MetricsRegistry(
+    directory=_options.get("DIR"),
+    flush_interval=_options.get("FLUSH_INTERVAL", 5),
+    max_series=_options.get("MAX_SERIES", 2000),
+)
+# Дочерний процесс gunicorn начинает с пустых рядов и своего файла
+os.register_at_fork(after_in_child=registry._reset)
+atexit.register(registry.flush_on_exit)
+
+
+def is_enabled():
+    return _options.get("ENABLED", True)
+
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_lists = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Текст запроса без литералов, списков параметров и лишних пробелов."""
+    sql = " ".join(sql.split())
+    sql = _literals.sub("?", sql)
+    sql = _in_lists.sub("(...)", sql)
+    return sql[:300]
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Обёртка курсора: время запроса и счётчик запросов текущего HTTP-запроса."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        registry.observe(
+            "exchange_db_statement_duration_seconds",
+            time.perf_counter() - started,
+            statement=normalize_sql(sql),
+        )
+        counter = _request_queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    """Обработчик connection_created: обёртка ставится на каждое соединение."""
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+class MetricsMiddleware:
+    """
+    Время обработки и число SQL-запросов по каждому представлению.
+    Работает и в синхронной, и в асинхронной цепочке, чтобы под ASGI
+    асинхронные представления не переводились в синхронный поток.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not is_enabled():
+            return self.get_response(request)
+        counter, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        return self.finish(request, response, counter, started)
+
+    async def __acall__(self, request):
+        if not is_enabled():
+            return await self.get_response(request)
+        counter, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        return self.finish(request, response, counter, started)
+
+    @staticmethod
+    def start():
+        counter = [0]
+        return counter, _request_queries.set(counter), time.perf_counter()
+
+    @staticmethod
+    def finish(request, response, counter, started):
+        view = getattr(request.resolver_match, "view_name", None) or "unmatched"
+        registry.observe(
+            "exchange_http_request_duration_seconds",
+            time.perf_counter() - started,
+            view=view,
+            method=request.method,
+            status=f"{response.status_code // 100}xx",
+        )
+        registry.observe("exchange_http_request_queries", counter[0], view=view)
+        registry.maybe_flush()
+        return response
+
+
+def timed(name):
+    """Декоратор: время выполнения функции в гистограмме методов сервиса."""
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    registry.observe(
+                        "exchange_service_call_duration_seconds",
+                        time.perf_counter() - started,
+                        method=name,
+                    )
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(
+                    "exchange_service_call_duration_seconds",
+                    time.perf_counter() - started,
+                    method=name,
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_methods(cls):
+    """Декоратор класса: замер всех публичных методов, кроме генераторов."""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("_"):
+            continue
+        if isinstance(value, (staticmethod, classmethod)):
+            func = value.__func__
+            if not inspect.isgeneratorfunction(func):
+                setattr(cls, attr, type(value)(timed(attr)(func)))
+        elif inspect.isfunction(value) and not inspect.isgeneratorfunction(value):
+            setattr(cls, attr, timed(attr)(value))
+    return cls
@@ -1,17 +1,21 @@
 # exchange/migrations/0001_initial.py
 
-from django.db import migrations, connection
+from django.conf import settings
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
 
 
 def create_exchange_tables(apps, schema_editor):
-    with connection.cursor() as cursor:
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
         cursor.execute(
-            """
+            f"""
             CREATE TABLE cash_reserves (
-                currency_id NUMBER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-                currency_name VARCHAR2(40) UNIQUE NOT NULL,
-                amount_in_cash NUMBER(15, 2) DEFAULT 0 CHECK(amount_in_cash >= 0),
-                is_archived NUMBER(1) DEFAULT 0
+                currency_id {dialect.identity_pk},
+                currency_name {dialect.varchar(40)} UNIQUE NOT NULL,
+                amount_in_cash {dialect.decimal(15, 2)} DEFAULT 0 CHECK(amount_in_cash >= 0),
+                is_archived {dialect.boolean} DEFAULT 0
             )
             """
         )
@@ -23,28 +27,28 @@ def create_exchange_tables(apps, schema_editor):
             ["Белорусский рубль", 1000000],
         )
         cursor.execute(
-            """
+            f"""
             CREATE TABLE exchange_rates (
-                rate_id NUMBER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-                currency_id NUMBER,
-                rate_to_base NUMBER(10, 4) NOT NULL,
-                rate_date DATE DEFAULT SYSDATE,
+                rate_id {dialect.identity_pk},
+                currency_id {dialect.integer},
+                rate_to_base {dialect.decimal(10, 4)} NOT NULL,
+                rate_date {dialect.date} DEFAULT {dialect.current_date},
                 FOREIGN KEY (currency_id) REFERENCES cash_reserves(currency_id) ON DELETE CASCADE
             )
         """
         )
 
         cursor.execute(
-            """
+            f"""
             CREATE TABLE exchange_transactions (
-                transaction_id NUMBER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-                operator_id NUMBER NOT NULL,
-                currency_from_id NUMBER,
-                currency_to_id NUMBER,
-                amount NUMBER(15, 2) NOT NULL,
-                exchanged_amount NUMBER(15, 2) NOT NULL,
-                change_in_base NUMBER(15, 2) NOT NULL,
-                transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                transaction_id {dialect.identity_pk},
+                operator_id {dialect.integer} NOT NULL,
+                currency_from_id {dialect.integer},
+                currency_to_id {dialect.integer},
+                amount {dialect.decimal(15, 2)} NOT NULL,
+                exchanged_amount {dialect.decimal(15, 2)} NOT NULL,
+                change_in_base {dialect.decimal(15, 2)} NOT NULL,
+                transaction_date {dialect.timestamp} DEFAULT {dialect.current_timestamp},
                 FOREIGN KEY (operator_id) REFERENCES auth_user(id),
                 FOREIGN KEY (currency_from_id) REFERENCES cash_reserves(currency_id),
                 FOREIGN KEY (currency_to_id) REFERENCES cash_reserves(currency_id)
@@ -52,38 +56,21 @@ def create_exchange_tables(apps, schema_editor):
         """
         )
 
-        cursor.execute(
-            """
-            CREATE OR REPLACE TRIGGER update_cash_after_exchange
-            AFTER INSERT ON exchange_transactions
-            FOR EACH ROW
-            BEGIN
-        
-                UPDATE cash_reserves
-                SET amount_in_cash = amount_in_cash + :NEW.amount
-                WHERE currency_id = :NEW.currency_from_id;
-            
-                UPDATE cash_reserves
-                SET amount_in_cash = amount_in_cash - :NEW.exchanged_amount
-                WHERE currency_id = :NEW.currency_to_id; 
-                
-                UPDATE cash_reserves
-                SET amount_in_cash = amount_in_cash - :NEW.change_in_base
-                WHERE currency_id = 1;
-            END;
-        """
-        )
+        for statement in dialect.exchange_trigger():
+            cursor.execute(statement)
 
 
 def reverse_create_exchange_tables(apps, schema_editor):
-    with connection.cursor() as cursor:
-        cursor.execute("DROP TRIGGER update_cash_after_exchange")
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        for statement in dialect.drop_exchange_trigger():
+            cursor.execute(statement)
         cursor.execute("DROP TABLE exchange_transactions")
         cursor.execute("DROP TABLE exchange_rates")
 
 
 class Migration(migrations.Migration):
-    dependencies = []
+    dependencies = [migrations.swappable_dependency(settings.AUTH_USER_MODEL)]
 
     operations = [
         migrations.RunPython(create_exchange_tables, reverse_create_exchange_tables),
@@ -0,0 +1,56 @@
+# exchange/migrations/0002_current_rates.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def create_current_rates(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE INDEX exchange_rates_currency_date_idx
+            ON exchange_rates (currency_id, rate_date DESC, rate_id DESC)
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE TABLE current_rates (
+                currency_id {dialect.integer} PRIMARY KEY,
+                rate_id {dialect.integer} NOT NULL,
+                rate_to_base {dialect.decimal(10, 4)} NOT NULL,
+                rate_date {dialect.date} NOT NULL,
+                FOREIGN KEY (currency_id) REFERENCES cash_reserves(currency_id) ON DELETE CASCADE
+            )
+            """
+        )
+        # Заполняем последними курсами из истории
+        cursor.execute(
+            """
+            INSERT INTO current_rates (currency_id, rate_id, rate_to_base, rate_date)
+            SELECT currency_id, rate_id, rate_to_base, rate_date
+            FROM (
+                SELECT currency_id, rate_id, rate_to_base, rate_date,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY currency_id ORDER BY rate_date DESC, rate_id DESC
+                       ) rn
+                FROM exchange_rates
+            ) latest
+            WHERE rn = 1
+            """
+        )
+
+
+def reverse_create_current_rates(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE current_rates")
+        cursor.execute("DROP INDEX exchange_rates_currency_date_idx")
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0001_initial")]
+
+    operations = [
+        migrations.RunPython(create_current_rates, reverse_create_current_rates),
+    ]
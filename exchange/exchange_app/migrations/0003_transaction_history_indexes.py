@@ -0,0 +1,33 @@
+# exchange/migrations/0003_transaction_history_indexes.py
+
+from django.db import migrations
+
+
+def create_history_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE INDEX exchange_tx_operator_date_idx
+            ON exchange_transactions (operator_id, transaction_date, transaction_id)
+            """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX exchange_tx_date_id_idx
+            ON exchange_transactions (transaction_date, transaction_id)
+            """
+        )
+
+
+def reverse_create_history_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX exchange_tx_operator_date_idx")
+        cursor.execute("DROP INDEX exchange_tx_date_id_idx")
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0002_current_rates")]
+
+    operations = [
+        migrations.RunPython(create_history_indexes, reverse_create_history_indexes),
+    ]
@@ -0,0 +1,30 @@
+# exchange/migrations/0004_transaction_amount_in_base.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def add_amount_in_base(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        # Сумма в базовой валюте: для кросс-обмена это подразумеваемая вторая нога
+        cursor.execute(
+            dialect.add_column(
+                "exchange_transactions", "amount_in_base", dialect.decimal(15, 2)
+            )
+        )
+
+
+def reverse_add_amount_in_base(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(dialect.drop_column("exchange_transactions", "amount_in_base"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0003_transaction_history_indexes")]
+
+    operations = [
+        migrations.RunPython(add_amount_in_base, reverse_add_amount_in_base),
+    ]
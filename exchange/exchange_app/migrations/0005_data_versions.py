@@ -0,0 +1,36 @@
+# exchange/migrations/0005_data_versions.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def create_data_versions(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        # Счётчики версий для сброса процессных кэшей во всех воркерах
+        cursor.execute(
+            f"""
+            CREATE TABLE data_versions (
+                name {dialect.varchar(40)} PRIMARY KEY,
+                version {dialect.integer} DEFAULT 0 NOT NULL
+            )
+            """
+        )
+        cursor.execute(
+            "INSERT INTO data_versions (name, version) VALUES (%s, %s)",
+            ["currencies", 0],
+        )
+
+
+def reverse_create_data_versions(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE data_versions")
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0004_transaction_amount_in_base")]
+
+    operations = [
+        migrations.RunPython(create_data_versions, reverse_create_data_versions),
+    ]
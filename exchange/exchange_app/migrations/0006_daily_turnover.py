@@ -0,0 +1,40 @@
+# exchange/migrations/0006_daily_turnover.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def create_daily_turnover(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        # Дневные обороты по оператору и валютной паре, ведутся вместе с транзакциями
+        cursor.execute(
+            f"""
+            CREATE TABLE daily_turnover (
+                turnover_date {dialect.date} NOT NULL,
+                operator_id {dialect.integer} NOT NULL,
+                currency_from_id {dialect.integer} NOT NULL,
+                currency_to_id {dialect.integer} NOT NULL,
+                volume {dialect.decimal(18, 2)} DEFAULT 0 NOT NULL,
+                exchanged_volume {dialect.decimal(18, 2)} DEFAULT 0 NOT NULL,
+                transactions_count {dialect.integer} DEFAULT 0 NOT NULL,
+                base_equivalent {dialect.decimal(18, 2)} DEFAULT 0 NOT NULL,
+                change_paid {dialect.decimal(18, 2)} DEFAULT 0 NOT NULL,
+                PRIMARY KEY (turnover_date, operator_id, currency_from_id, currency_to_id)
+            )
+            """
+        )
+
+
+def reverse_create_daily_turnover(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE daily_turnover")
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0005_data_versions")]
+
+    operations = [
+        migrations.RunPython(create_daily_turnover, reverse_create_daily_turnover),
+    ]
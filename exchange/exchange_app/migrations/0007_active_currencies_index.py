@@ -0,0 +1,36 @@
+# exchange/migrations/0007_active_currencies_index.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def create_active_currencies_index(apps, schema_editor):
+    # Частичный индекс по неархивным валютам там, где СУБД их поддерживает
+    if not get_dialect(schema_editor.connection).supports_partial_indexes:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE INDEX cash_reserves_active_idx
+            ON cash_reserves (currency_id, currency_name)
+            WHERE is_archived = 0
+            """
+        )
+
+
+def reverse_create_active_currencies_index(apps, schema_editor):
+    if not get_dialect(schema_editor.connection).supports_partial_indexes:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX cash_reserves_active_idx")
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0006_daily_turnover")]
+
+    operations = [
+        migrations.RunPython(
+            create_active_currencies_index, reverse_create_active_currencies_index
+        ),
+    ]
@@ -0,0 +1,40 @@
+# exchange/migrations/0008_partition_transactions.py
+
+from django.db import migrations
+from django.utils import timezone
+
+from exchange_app.archive import add_months, ensure_month_partitions, month_start
+from exchange_app.dialects import get_dialect
+
+# Секции создаются заранее на столько месяцев вперёд
+MONTHS_AHEAD = 3
+
+
+def partition_transactions(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    if not dialect.supports_partitioning:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in dialect.partition_transactions_by_month():
+            cursor.execute(statement)
+
+        cursor.execute(
+            "SELECT transaction_date FROM exchange_transactions "
+            f"ORDER BY transaction_date {dialect.limit(1)}"
+        )
+        row = cursor.fetchone()
+        current_month = month_start(timezone.now())
+        first_month = month_start(row[0]) if row and row[0] else current_month
+        ensure_month_partitions(
+            cursor, dialect, first_month, add_months(current_month, MONTHS_AHEAD)
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0007_active_currencies_index")]
+
+    operations = [
+        # Секционированная таблица совместима со всеми запросами приложения,
+        # обратная миграция её не пересобирает
+        migrations.RunPython(partition_transactions, migrations.RunPython.noop),
+    ]
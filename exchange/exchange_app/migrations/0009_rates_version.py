@@ -0,0 +1,33 @@
+# exchange/migrations/0009_rates_version.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def add_rates_version(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        # Момент последнего изменения - для заголовка Last-Modified.
+        # SQLite не добавляет столбец с непостоянным DEFAULT, момент пишет bump_data_version
+        cursor.execute(dialect.add_column("data_versions", "updated_at", dialect.timestamp))
+        cursor.execute(
+            "INSERT INTO data_versions (name, version) VALUES (%s, %s)",
+            ["rates", 0],
+        )
+        cursor.execute(f"UPDATE data_versions SET updated_at = {dialect.current_timestamp}")
+
+
+def reverse_add_rates_version(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DELETE FROM data_versions WHERE name = %s", ["rates"])
+        cursor.execute(dialect.drop_column("data_versions", "updated_at"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0008_partition_transactions")]
+
+    operations = [
+        migrations.RunPython(add_rates_version, reverse_add_rates_version),
+    ]
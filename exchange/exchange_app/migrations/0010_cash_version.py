@@ -0,0 +1,29 @@
+# exchange/migrations/0010_cash_version.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def add_cash_version(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        # Остатки в кассе: ключ кэша фрагментов страниц курсов и кассы
+        cursor.execute(
+            f"INSERT INTO data_versions (name, version, updated_at) "
+            f"VALUES (%s, %s, {dialect.current_timestamp})",
+            ["cash", 0],
+        )
+
+
+def reverse_add_cash_version(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DELETE FROM data_versions WHERE name = %s", ["cash"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0009_rates_version")]
+
+    operations = [
+        migrations.RunPython(add_cash_version, reverse_add_cash_version),
+    ]
@@ -0,0 +1,33 @@
+# exchange/migrations/0011_job_checkpoints.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def create_job_checkpoints(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        # Позиции долгих заданий (очистка, загрузка истории) для продолжения после сбоя
+        cursor.execute(
+            f"""
+            CREATE TABLE job_checkpoints (
+                name {dialect.varchar(200)} PRIMARY KEY,
+                position {dialect.varchar(200)} NOT NULL,
+                updated_at {dialect.timestamp}
+            )
+            """
+        )
+
+
+def reverse_create_job_checkpoints(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE job_checkpoints")
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0010_cash_version")]
+
+    operations = [
+        migrations.RunPython(create_job_checkpoints, reverse_create_job_checkpoints),
+    ]
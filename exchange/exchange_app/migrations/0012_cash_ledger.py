@@ -0,0 +1,67 @@
+# exchange/migrations/0012_cash_ledger.py
+
+from django.db import migrations
+
+from exchange_app.dialects import get_dialect
+
+
+def create_cash_ledger(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        # Журнал движений кассы: только добавление строк
+        cursor.execute(
+            f"""
+            CREATE TABLE cash_ledger (
+                entry_id {dialect.identity_pk},
+                currency_id {dialect.integer} NOT NULL,
+                amount {dialect.decimal(15, 2)} NOT NULL,
+                kind {dialect.varchar(20)} NOT NULL,
+                transaction_id {dialect.integer},
+                created_at {dialect.timestamp} DEFAULT {dialect.current_timestamp}
+            )
+            """
+        )
+        # Остатки кассы на момент контрольной точки: все движения с entry_id
+        # не больше last_entry_id в них уже учтены
+        cursor.execute(
+            f"""
+            CREATE TABLE cash_checkpoints (
+                checkpoint_id {dialect.integer} NOT NULL,
+                currency_id {dialect.integer} NOT NULL,
+                balance {dialect.decimal(15, 2)} NOT NULL,
+                last_entry_id {dialect.integer} NOT NULL,
+                created_at {dialect.timestamp} DEFAULT {dialect.current_timestamp},
+                PRIMARY KEY (checkpoint_id, currency_id)
+            )
+            """
+        )
+        # Первая точка - текущие остатки: журнал начинается с этой миграции
+        cursor.execute(
+            f"""
+            INSERT INTO cash_checkpoints (checkpoint_id, currency_id, balance, last_entry_id, created_at)
+            SELECT 1, currency_id, amount_in_cash, 0, {dialect.current_timestamp} FROM cash_reserves
+            """
+        )
+        for statement in dialect.drop_exchange_trigger():
+            cursor.execute(statement)
+        for statement in dialect.exchange_trigger(ledger=True):
+            cursor.execute(statement)
+
+
+def reverse_create_cash_ledger(apps, schema_editor):
+    dialect = get_dialect(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        for statement in dialect.drop_exchange_trigger():
+            cursor.execute(statement)
+        for statement in dialect.exchange_trigger():
+            cursor.execute(statement)
+        cursor.execute("DROP TABLE cash_checkpoints")
+        cursor.execute("DROP TABLE cash_ledger")
+
+
+class Migration(migrations.Migration):
+    dependencies = [("exchange_app", "0011_job_checkpoints")]
+
+    operations = [
+        migrations.RunPython(create_cash_ledger, reverse_create_cash_ledger),
+    ]
@@ -0,0 +1,394 @@
+# exchange/nbrb.py
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from django.utils import timezone
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.nbrb.by/exrates"
+API_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class CurrencyDirectory:
+    """
+    Снимок справочника валют Нацбанка.
+    Даты окончания действия разбираются один раз при создании снимка,
+    выборки действующих на дату валют хранятся вместе со снимком.
+    """
+
+    max_dates = 4
+
+    def __init__(self, currencies, fetched_at):
+        self.currencies = currencies
+        self.fetched_at = fetched_at
+        self._date_starts = [
+            datetime.strptime(cur["Cur_DateStart"], API_DATE_FORMAT).date()
+            for cur in currencies
+        ]
+        self._date_ends = [
+            datetime.strptime(cur["Cur_DateEnd"], API_DATE_FORMAT).date()
+            for cur in currencies
+        ]
+        self._valid = OrderedDict()
+        # Снимок общий для потоков запросов и фонового обновления кэша
+        self._lock = threading.Lock()
+        self.valid_on(timezone.localdate())
+
+    def valid_on(self, date):
+        """Валюты, действующие на указанную дату."""
+        with self._lock:
+            valid = self._valid.get(date)
+        if valid is None:
+            valid = [
+                cur
+                for cur, date_end in zip(self.currencies, self._date_ends)
+                if date_end >= date
+            ]
+            with self._lock:
+                self._valid[date] = valid
+                while len(self._valid) > self.max_dates:
+                    self._valid.popitem(last=False)
+        return valid
+
+    def find_id_by_name(self, currency_name, date=None):
+        """Идентификатор валюты в API по полному названию."""
+        for cur in self.valid_on(date or timezone.localdate()):
+            if cur.get("Cur_Name") == currency_name:
+                return cur["Cur_ID"]
+        return None
+
+    def periods(self, currency_name):
+        """
+        Записи справочника с этим названием за всё время: (Cur_ID, масштаб,
+        начало и конец действия). После деноминации у валюты новый Cur_ID.
+        """
+        return [
+            (cur["Cur_ID"], cur["Cur_Scale"], date_start, date_end)
+            for cur, date_start, date_end in zip(
+                self.currencies, self._date_starts, self._date_ends
+            )
+            if cur.get("Cur_Name") == currency_name
+        ]
+
+    def choices(self, date=None):
+        """
+        Возвращает:
+        - currency_choices: Полные названия валют.
+        - short_currencies: Словарь аббревиатур и полных названий.
+        """
+        valid = self.valid_on(date or timezone.localdate())
+        currency_choices = {cur["Cur_Name"] for cur in valid}
+        short_currencies = {cur["Cur_Abbreviation"]: cur["Cur_Name"] for cur in valid}
+        return currency_choices, short_currencies
+
+
+class StaleWhileRevalidateCache:
+    """
+    Процессный кэш ответов API с TTL и ограниченным размером.
+    Устаревшее значение отдаётся сразу, пока единственный фоновый поток
+    запрашивает свежие данные. Сырые ответы сохраняются на диск, чтобы
+    новый воркер стартовал с тёплым кэшем.
+    """
+
+    def __init__(self, ttl, max_entries=8, snapshot_dir=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.snapshot_dir = snapshot_dir
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    def get(self, key, fetch, build):
+        """
+        fetch() возвращает сырые данные (или None при ошибке),
+        build(raw, fetched_at) строит из них значение для кэша.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            with self._fetch_lock:
+                entry = self._entries.get(key) or self._load_snapshot(key, build)
+                if entry is None:
+                    return self._refresh(key, fetch, build)
+
+        value, fetched_at = entry
+        if time.time() - fetched_at > self.ttl:
+            self._refresh_in_background(key, fetch, build)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _store(self, key, value, fetched_at):
+        with self._lock:
+            self._entries[key] = (value, fetched_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, key, fetch, build):
+        raw = fetch()
+        if raw is None:
+            return None
+        fetched_at = time.time()
+        value = build(raw, fetched_at)
+        self._store(key, value, fetched_at)
+        self._save_snapshot(key, raw, fetched_at)
+        return value
+
+    def _refresh_in_background(self, key, fetch, build):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._refresh(key, fetch, build)
+            except Exception:
+                logger.exception("Не удалось обновить кэш НБРБ: %s", key)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name=f"nbrb-refresh-{key}", daemon=True).start()
+
+    def _snapshot_path(self, key):
+        return os.path.join(self.snapshot_dir, f"{key}.json")
+
+    def _load_snapshot(self, key, build):
+        if not self.snapshot_dir:
+            return None
+        try:
+            with open(self._snapshot_path(key), encoding="utf-8") as f:
+                snapshot = json.load(f)
+            value = build(snapshot["data"], snapshot["fetched_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        self._store(key, value, snapshot["fetched_at"])
+        return value, snapshot["fetched_at"]
+
+    def _save_snapshot(self, key, raw, fetched_at):
+        if not self.snapshot_dir:
+            return
+        path = self._snapshot_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": fetched_at, "data": raw}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning("Не удалось сохранить снимок кэша НБРБ: %s", path)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                options = settings.NBRB_CACHE
+                _cache = StaleWhileRevalidateCache(
+                    ttl=options.get("TTL", 6 * 60 * 60),
+                    max_entries=options.get("MAX_ENTRIES", 8),
+                    snapshot_dir=options.get("SNAPSHOT_DIR"),
+                )
+    return _cache
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold неудачных запросов подряд API считается
+    недоступным на reset_timeout секунд, затем пропускается пробный запрос.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            if self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class NBRBClient:
+    """
+    HTTP-клиент API Нацбанка: пул keep-alive соединений, таймауты,
+    ограниченные повторы с джиттером и предохранитель. Пока API недоступно,
+    возвращаются последние успешно полученные данные.
+    """
+
+    retry_statuses = {429, 500, 502, 503, 504}
+    max_last_known = 256
+
+    def __init__(
+            self,
+            base_url=API_URL,
+            connect_timeout=3.05,
+            read_timeout=10,
+            retries=2,
+            backoff=0.5,
+            pool_size=10,
+            failure_threshold=5,
+            reset_timeout=30,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._last_known = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_json(self, path, params=None):
+        """JSON-ответ API или последние известные данные, None если их нет."""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        key = (url, tuple(sorted((params or {}).items())))
+        if not self.breaker.allow():
+            return self._fallback(key)
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                self.observe(path, started, "error")
+                logger.warning("Ошибка запроса к НБРБ %s: %s", url, e)
+                continue
+            self.observe(path, started, response.status_code)
+            if response.status_code in self.retry_statuses:
+                logger.warning("НБРБ ответил %s на %s", response.status_code, url)
+                continue
+            # API отвечает - даже на некорректный запрос
+            self.breaker.record_success()
+            if response.status_code != 200:
+                return None
+            try:
+                data = response.json()
+            except ValueError:
+                return None
+            with self._lock:
+                self._last_known[key] = data
+                self._last_known.move_to_end(key)
+                while len(self._last_known) > self.max_last_known:
+                    self._last_known.popitem(last=False)
+            return data
+
+        self.breaker.record_failure()
+        return self._fallback(key)
+
+    @staticmethod
+    def observe(path, started, outcome):
+        registry.observe(
+            "exchange_nbrb_request_duration_seconds",
+            time.perf_counter() - started,
+            # /rates/431 -> /rates/{id}: один ряд на вид запроса
+            path=re.sub(r"/\d+", "/{id}", f"/{path.strip('/')}"),
+            outcome=str(outcome),
+        )
+
+    def _fallback(self, key):
+        with self._lock:
+            return self._last_known.get(key)
+
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _cache_lock:
+            if _client is None:
+                _client = NBRBClient(**settings.NBRB_CLIENT)
+    return _client
+
+
+def fetch_currencies():
+    """Загрузка полного справочника валют из API."""
+    return get_client().get_json("currencies")
+
+
+def fetch_rate(currency_id):
+    """Официальный курс валюты по её идентификатору в API."""
+    return get_client().get_json(f"rates/{currency_id}")
+
+
+def fetch_daily_rates(on_date=None):
+    """Таблица официальных курсов на дату одним запросом."""
+    params = {"periodicity": 0}
+    if on_date:
+        params["ondate"] = on_date.strftime("%Y-%m-%d")
+    return get_client().get_json("rates", params)
+
+
+def fetch_rate_dynamics(currency_id, date_from, date_to):
+    """Курсы валюты за даты [date_from, date_to], не больше 365 дней за запрос."""
+    return get_client().get_json(
+        f"rates/dynamics/{currency_id}",
+        {"startdate": date_from.strftime("%Y-%m-%d"), "enddate": date_to.strftime("%Y-%m-%d")},
+    )
+
+
+def get_currency_directory():
+    """Справочник валют из кэша, None если API недоступен и кэш пуст."""
+    return get_cache().get("currencies", fetch_currencies, CurrencyDirectory)
@@ -0,0 +1,114 @@
+# exchange/quotes.py
+import json
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .statements import statements
+from .utils import BASE_CURRENCY_ID
+from .versions import CURRENCIES, RATES, get_data_versions
+
+logger = logging.getLogger(__name__)
+
+QUOTE_PRECISION = Decimal("0.000001")
+
+QUOTE_RATES = statements.register(
+    "quote_rates",
+    """
+    SELECT cr.currency_id, cr.currency_name, r.rate_to_base
+    FROM cash_reserves cr
+    LEFT JOIN current_rates r ON r.currency_id = cr.currency_id
+    WHERE cr.is_archived = 0
+    ORDER BY cr.currency_id
+    """,
+)
+
+
+def get_markup():
+    return Decimal(str(settings.QUOTES.get("MARKUP", 0)))
+
+
+def load_quote_rates():
+    """Действующие курсы неархивных валют: (id, название, курс к базовой)."""
+    with connection.cursor() as cursor:
+        statements.execute(cursor, QUOTE_RATES)
+        rows = cursor.fetchall()
+    return [
+        (int(currency_id), currency_name, Decimal(1) if currency_id == BASE_CURRENCY_ID else rate)
+        for currency_id, currency_name, rate in rows
+        if currency_id == BASE_CURRENCY_ID or rate
+    ]
+
+
+def build_quote_matrix(currencies, markup):
+    """
+    Котировки всех пар за один проход по вектору курсов:
+    mid - сколько единиц to за единицу from, buy/sell - с наценкой кассы.
+    """
+    ids = [currency[0] for currency in currencies]
+    inverse = [1 / currency[2] for currency in currencies]
+    buy_factor = 1 - markup / 100
+    sell_factor = 1 + markup / 100
+    quotes = []
+    for from_id, _, from_rate in currencies:
+        for to_id, to_inverse in zip(ids, inverse):
+            if to_id == from_id:
+                continue
+            mid = from_rate * to_inverse
+            quotes.append(
+                {
+                    "from": from_id,
+                    "to": to_id,
+                    "mid": str(mid.quantize(QUOTE_PRECISION)),
+                    "buy": str((mid * buy_factor).quantize(QUOTE_PRECISION)),
+                    "sell": str((mid * sell_factor).quantize(QUOTE_PRECISION)),
+                }
+            )
+    return quotes
+
+
+def get_quote_state():
+    """ETag и момент последнего изменения матрицы - по счётчикам версий, одним запросом."""
+    versions = get_data_versions(RATES, CURRENCIES)
+    markup = get_markup()
+    etag = f"{versions[RATES][0]}-{versions[CURRENCIES][0]}-{markup}"
+    updated = [updated_at for _, updated_at in versions.values() if updated_at]
+    return etag, max(updated) if updated else None
+
+
+def get_quotes_body(etag, last_modified):
+    """
+    Готовый JSON матрицы из общего кэша. Первый воркер, заметивший новую
+    версию, строит матрицу и кладёт её в кэш для остальных.
+    """
+    key = f"quotes:{etag}"
+    body = cache.get(key)
+    if body is None:
+        currencies = load_quote_rates()
+        markup = get_markup()
+        body = json.dumps(
+            {
+                "base_currency_id": BASE_CURRENCY_ID,
+                "markup": str(markup),
+                "updated_at": last_modified.isoformat() if last_modified else None,
+                "currencies": [
+                    {"id": currency_id, "name": name, "rate_to_base": str(rate)}
+                    for currency_id, name, rate in currencies
+                ],
+                "quotes": build_quote_matrix(currencies, markup),
+            },
+            ensure_ascii=False,
+        ).encode()
+        cache.set(key, body, settings.QUOTES.get("CACHE_TIMEOUT"))
+    return body
+
+
+def warm_quotes(sender, **kwargs):
+    """Обработчик rates_changed: матрица пересчитывается сразу после смены курсов."""
+    try:
+        get_quotes_body(*get_quote_state())
+    except Exception:
+        logger.exception("Не удалось пересчитать матрицу котировок")
@@ -0,0 +1,11 @@
+# exchange/signals.py
+from django.dispatch import Signal
+
+# Отправляются после фиксации транзакции записи.
+# rates_changed: currency_ids - валюты, у которых сменился действующий курс
+rates_changed = Signal()
+# cash_changed: currency_ids - валюты, у которых изменился остаток в кассе
+cash_changed = Signal()
+# currencies_changed: currency_ids - добавленные, удалённые, архивированные
+# и восстановленные валюты
+currencies_changed = Signal()
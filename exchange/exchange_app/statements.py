@@ -0,0 +1,81 @@
+# exchange/statements.py
+import threading
+import weakref
+
+from django.conf import settings
+
+from .dialects import PLACEHOLDERS, get_dialect
+
+
+class Statement:
+    """
+    Запрос с неизменным текстом. sql - строка или функция от диалекта,
+    если текст зависит от СУБД; тогда он строится один раз для каждой СУБД.
+    prepare=False - запрос не подготавливается на сервере (например, если
+    тип параметра нельзя вывести из текста: %s IS NULL).
+    """
+
+    def __init__(self, name, sql, prepare=True):
+        self.name = name
+        self.sql = sql
+        self.prepare = prepare
+        self._compiled = {}
+
+    def compile(self, dialect):
+        """(текст, число параметров) для диалекта."""
+        compiled = self._compiled.get(dialect.vendor)
+        if compiled is None:
+            text = self.sql(dialect) if callable(self.sql) else self.sql
+            param_count = sum(1 for match in PLACEHOLDERS.findall(text) if match == "%s")
+            compiled = self._compiled[dialect.vendor] = (text, param_count)
+        return compiled
+
+
+class StatementRegistry:
+    """
+    Именованные запросы сервиса. Неизменный текст запроса позволяет разбирать
+    его один раз на соединение: в PostgreSQL запрос подготавливается на сервере
+    при первом выполнении в соединении (PREPARE, затем EXECUTE), в Oracle
+    и SQLite разобранные запросы держит кэш драйвера (DATABASE_STATEMENTS).
+    """
+
+    def __init__(self, prepare=True):
+        self.prepare = prepare
+        self._statements = {}
+        # Подготовленные запросы по соединениям драйвера: соединение, открытое
+        # заново после обрыва, или другое соединение пула начинает с пустого набора
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, name, sql, prepare=True):
+        if name in self._statements:
+            raise ValueError(f"Запрос {name} уже зарегистрирован")
+        statement = self._statements[name] = Statement(name, sql, prepare)
+        return statement
+
+    def __len__(self):
+        return len(self._statements)
+
+    def execute(self, cursor, statement, params=None):
+        cursor.execute(self._sql(cursor, statement), params)
+
+    def executemany(self, cursor, statement, param_list):
+        cursor.executemany(self._sql(cursor, statement), param_list)
+
+    def _sql(self, cursor, statement):
+        dialect = get_dialect(cursor.db)
+        text, param_count = statement.compile(dialect)
+        if not (self.prepare and statement.prepare and dialect.supports_prepare):
+            return text
+        name = f"exchange_{statement.name}"
+        with self._lock:
+            prepared = self._prepared.setdefault(cursor.db.connection, set())
+        if name not in prepared:
+            cursor.execute(dialect.prepare(name, text))
+            prepared.add(name)
+        return dialect.execute_prepared(name, param_count)
+
+
+statements = StatementRegistry(
+    prepare=getattr(settings, "DATABASE_STATEMENTS", {}).get("PREPARE", True)
+)
@@ -0,0 +1,115 @@
+// static/exchange/live.js
+// Изменения курсов, кассы и валют из потока /exchange/events/ применяются
+// к таблице страницы на месте, без перезагрузки.
+(function () {
+    var table = document.querySelector("[data-live-table]");
+    if (!table || !window.EventSource) {
+        return;
+    }
+    var page = table.dataset.liveTable;
+
+    function findRow(currencyId) {
+        return table.querySelector('tr[data-currency-id="' + currencyId + '"]');
+    }
+
+    function setField(row, field, value) {
+        var cell = row && row.querySelector('[data-field="' + field + '"]');
+        if (cell && value !== undefined) {
+            cell.textContent = value;
+        }
+    }
+
+    function formatDate(value) {
+        // 2024-01-31 -> 31.01.2024, как фильтр date:"d.m.Y"
+        var parts = String(value).slice(0, 10).split("-");
+        return parts[2] + "." + parts[1] + "." + parts[0];
+    }
+
+    function removeRow(data) {
+        var row = findRow(data.currency_id);
+        if (row) {
+            row.remove();
+        }
+    }
+
+    function insertRateRow(data) {
+        var template = document.getElementById("rate-row");
+        var row = template.content.firstElementChild.cloneNode(true);
+        row.dataset.currencyId = data.currency_id;
+        var link = row.querySelector("[data-history-url]");
+        link.href = link.dataset.historyUrl + data.currency_id;
+        // Строки упорядочены по названию валюты
+        var rows = table.querySelectorAll("tr[data-currency-id]");
+        for (var i = 0; i < rows.length; i++) {
+            var name = rows[i].querySelector('[data-field="currency_name"]').textContent;
+            if (name.localeCompare(data.currency_name) > 0) {
+                rows[i].parentNode.insertBefore(row, rows[i]);
+                return row;
+            }
+        }
+        table.querySelector("tr").parentNode.appendChild(row);
+        return row;
+    }
+
+    function applyRate(data) {
+        var row = findRow(data.currency_id) || insertRateRow(data);
+        setField(row, "currency_name", data.currency_name);
+        setField(row, "rate_to_base", data.rate_to_base);
+        setField(row, "rate_date", formatDate(data.rate_date));
+        setField(row, "amount_in_cash", data.amount_in_cash);
+        var checkbox = row.querySelector('input[name="rates_ids"]');
+        if (checkbox) {
+            checkbox.value = data.rate_id;
+        }
+    }
+
+    var handlers = {
+        rates: {
+            rate: applyRate,
+            rate_removed: removeRow,
+            currency_removed: removeRow,
+            cash: function (data) {
+                setField(findRow(data.currency_id), "amount_in_cash", data.amount_in_cash);
+            },
+            currency: function (data) {
+                if (data.is_archived || !data.rate_id) {
+                    removeRow(data);
+                } else {
+                    applyRate(data);
+                }
+            }
+        },
+        cash: {
+            currency_removed: removeRow,
+            cash: function (data) {
+                setField(findRow(data.currency_id), "amount_in_cash", data.amount_in_cash);
+            },
+            currency: function (data) {
+                var row = findRow(data.currency_id);
+                if (!row) {
+                    // Кнопки действий новой валюты рендерит сервер
+                    window.location.reload();
+                    return;
+                }
+                setField(row, "currency_name", data.currency_name);
+                setField(row, "amount_in_cash", data.amount_in_cash);
+                setField(row, "is_archived", data.is_archived ? "Да" : "Нет");
+                row.querySelectorAll("[data-archived]").forEach(function (button) {
+                    button.hidden = (button.dataset.archived === "1") !== data.is_archived;
+                });
+            }
+        }
+    }[page];
+
+    var source = new EventSource(table.dataset.eventsUrl);
+    Object.keys(handlers).forEach(function (eventType) {
+        source.addEventListener(eventType, function (event) {
+            handlers[eventType](JSON.parse(event.data));
+        });
+    });
+    // Пропущенные изменения уже недоступны - страница перечитывается целиком
+    source.addEventListener("reload", function () {
+        source.close();
+        window.location.reload();
+    });
+})();
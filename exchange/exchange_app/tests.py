@@ -1,3 +1,1287 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gc
+from io import StringIO
+import json
+import os
+import subprocess
+import sys
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user, login, logout
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .archive import TransactionArchive, add_months, month_start
+from .benchmarks import measure_rolled_back
+from .checkpoints import get_checkpoint, save_checkpoint
+from .dialects import PostgresDialect, SQLiteDialect
+from .ledger import reconcile_cash
+from . import events as events_module
+from .events import EventBroker, SpoolEventBroker, broker, stream_events
+from .views import (
+    cash_reserves_view,
+    delete_rate,
+    events_view,
+    exchange_view,
+    EXPORT_HEADER,
+    export_transactions_view,
+    metrics_view,
+    quotes_view,
+    rates_view,
+)
+from .metrics import MetricsMiddleware, MetricsRegistry, registry, render_text
+from . import nbrb
+from .nbrb import CurrencyDirectory, NBRBClient, StaleWhileRevalidateCache
+from .statements import StatementRegistry, statements
+from .utils import BASE_CURRENCY_ID, CurrencyExchangeService, currency_catalog
+
+
+class ExchangeTestCase(TestCase):
+    """Общие данные: оператор, базовая валюта и две валюты с курсами."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = CurrencyExchangeService()
+        cls.operator = User.objects.create_user("operator", password="secret-pass")
+        cls.service.add_currency_to_cash("Доллар США", 1000)
+        cls.service.add_currency_to_cash("Евро", 1000)
+        currencies = {row[1]: row[0] for row in cls.service.get_currency()}
+        cls.usd_id = currencies["Доллар США"]
+        cls.eur_id = currencies["Евро"]
+        cls.service.add_exchange_rate(cls.usd_id, Decimal("3.2"), "2024-01-01")
+        cls.service.add_exchange_rate(cls.eur_id, Decimal("3.5"), "2024-01-01")
+
+    def setUp(self):
+        # Счётчики версий откатываются вместе с тестом, кэши - нет
+        currency_catalog.clear()
+        cache.clear()
+
+    def get_cash(self, currency_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT amount_in_cash FROM cash_reserves WHERE currency_id = %s",
+                [currency_id],
+            )
+            return cursor.fetchone()[0]
+
+
+class ExchangeCurrencyTests(ExchangeTestCase):
+    def test_base_to_foreign_uses_single_snapshot_and_insert(self):
+        base_cash = self.get_cash(BASE_CURRENCY_ID)
+        # SAVEPOINT, снимок курсов и кассы, INSERT, обороты, версия кассы, RELEASE SAVEPOINT
+        with self.assertNumQueries(6):
+            exchanged_amount, change_in_base, error = (
+                self.service.exchange_currency_with_transaction(
+                    self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), Decimal(100), None
+                )
+            )
+        self.assertIsNone(error)
+        self.assertEqual(exchanged_amount, 31)
+        self.assertEqual(change_in_base, Decimal("0.8"))
+        self.assertEqual(self.get_cash(self.usd_id), 1000 - 31)
+        self.assertEqual(self.get_cash(BASE_CURRENCY_ID), base_cash + 100 - Decimal("0.8"))
+
+    def test_single_exchange_locks_cash_rows(self):
+        # SQLite блокирует базу целиком, поэтому блокировка подменяется комментарием
+        with mock.patch.object(SQLiteDialect, "lock_rows", return_value="/* lock cr */"):
+            with CaptureQueriesContext(connection) as captured:
+                self.service.exchange_currency_with_transaction(
+                    self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), Decimal(100), None
+                )
+        snapshot_sql = next(q["sql"] for q in captured if "FROM cash_reserves cr" in q["sql"])
+        self.assertIn("/* lock cr */", snapshot_sql)
+
+    def test_insufficient_cash_reports_currency_name(self):
+        exchanged_amount, change_in_base, error = (
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), Decimal(10000), 5000
+            )
+        )
+        self.assertIsNone(exchanged_amount)
+        self.assertIn("Доллар США", error)
+        self.assertEqual(self.get_cash(self.usd_id), 1000)
+
+    def test_cross_currency_exchange_records_single_transaction(self):
+        base_cash = self.get_cash(BASE_CURRENCY_ID)
+        exchanged_amount, change_in_base, error = (
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(self.usd_id), str(self.eur_id), Decimal(100), None
+            )
+        )
+        self.assertIsNone(error)
+        # 100 USD = 320 BYN = 91 EUR и 1.5 BYN сдачи
+        self.assertEqual(exchanged_amount, 91)
+        self.assertEqual(change_in_base, Decimal("1.5"))
+        self.assertEqual(self.get_cash(self.usd_id), 1100)
+        self.assertEqual(self.get_cash(self.eur_id), 1000 - 91)
+        self.assertEqual(self.get_cash(BASE_CURRENCY_ID), base_cash - Decimal("1.5"))
+
+        page = self.service.get_transactions(self.operator.id)
+        self.assertEqual(len(page["transactions"]), 1)
+        self.assertEqual(page["transactions"][0]["amount_in_base"], Decimal("320"))
+
+    def test_batch_exchange_validates_against_one_snapshot(self):
+        orders = [
+            {"currency_from": BASE_CURRENCY_ID, "currency_to": self.usd_id, "amount": Decimal(3200)},
+            {"currency_from": BASE_CURRENCY_ID, "currency_to": self.usd_id, "amount": Decimal(320)},
+            {"currency_from": BASE_CURRENCY_ID, "currency_to": self.eur_id, "amount": Decimal(35)},
+        ]
+        # SAVEPOINT, снимок с блокировкой, пакетные INSERT транзакций и оборотов,
+        # версия кассы, RELEASE SAVEPOINT
+        with self.assertNumQueries(6):
+            results = self.service.exchange_batch(self.operator.id, orders)
+        self.assertEqual([result["ok"] for result in results], [True, False, True])
+        self.assertEqual(self.get_cash(self.usd_id), 0)
+        self.assertEqual(self.get_cash(self.eur_id), 990)
+
+
+class CurrencyCatalogTests(ExchangeTestCase):
+    def test_catalog_is_reused_until_version_changes(self):
+        self.service.get_currency_catalog()
+        # Только проверка счётчика версии
+        with self.assertNumQueries(1):
+            self.assertEqual(self.service.get_currency_name(self.usd_id), "Доллар США")
+
+        self.service.archive_currency(self.usd_id)
+        catalog = {row[0]: row for row in self.service.get_currency_catalog()}
+        self.assertTrue(catalog[self.usd_id][2])
+
+
+class StubNBRBHandler(BaseHTTPRequestHandler):
+    """Локальная заглушка API: отвечает по очереди кодами из responses."""
+
+    responses = []
+
+    def do_GET(self):
+        status, body = self.responses.pop(0) if self.responses else (500, None)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class NBRBClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubNBRBHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def make_client(self, **kwargs):
+        options = {"retries": 1, "backoff": 0, "failure_threshold": 1, "reset_timeout": 60}
+        options.update(kwargs)
+        return NBRBClient(self.base_url, **options)
+
+    def test_retries_server_errors(self):
+        StubNBRBHandler.responses = [(503, None), (200, {"Cur_ID": 431})]
+        self.assertEqual(self.make_client().get_json("rates/431"), {"Cur_ID": 431})
+
+    def test_open_circuit_serves_last_known_data(self):
+        client = self.make_client(retries=0)
+        StubNBRBHandler.responses = [(200, [{"Cur_ID": 431}])]
+        self.assertEqual(client.get_json("currencies"), [{"Cur_ID": 431}])
+
+        StubNBRBHandler.responses = [(500, None)]
+        self.assertEqual(client.get_json("currencies"), [{"Cur_ID": 431}])
+        self.assertTrue(client.breaker.is_open)
+        # Пока предохранитель разомкнут, запросы к API не отправляются
+        StubNBRBHandler.responses = [(200, [])]
+        self.assertEqual(client.get_json("currencies"), [{"Cur_ID": 431}])
+        self.assertIsNone(client.get_json("rates/431"))
+
+
+class StaleWhileRevalidateCacheTests(SimpleTestCase):
+    @staticmethod
+    def build(raw, fetched_at):
+        return {"data": raw, "fetched_at": fetched_at}
+
+    def test_expired_entry_is_served_while_one_refresh_runs(self):
+        cache = StaleWhileRevalidateCache(ttl=60)
+        stale = cache.get("currencies", lambda: ["old"], self.build)
+        cache._entries["currencies"] = (stale, stale["fetched_at"] - 120)
+        release, calls = threading.Event(), []
+
+        def slow_fetch():
+            calls.append(1)
+            release.wait(5)
+            return ["new"]
+
+        results = [cache.get("currencies", slow_fetch, self.build)["data"] for _ in range(3)]
+        self.assertEqual(results, [["old"]] * 3)
+        release.set()
+        for _ in range(100):
+            if not cache._refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get("currencies", slow_fetch, self.build)["data"], ["new"])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = StaleWhileRevalidateCache(ttl=60, max_entries=2)
+        for key in ("a", "b", "a", "c"):
+            cache.get(key, lambda key=key: [key], self.build)
+        self.assertEqual(list(cache._entries), ["a", "c"])
+
+    def test_new_worker_starts_from_disk_snapshot(self):
+        directory = tempfile.mkdtemp()
+        first = StaleWhileRevalidateCache(ttl=60, snapshot_dir=directory)
+        value = first.get("currencies", lambda: [{"Cur_ID": 431}], self.build)
+
+        def unavailable():
+            raise AssertionError("Тёплый кэш не должен обращаться к API")
+
+        second = StaleWhileRevalidateCache(ttl=60, snapshot_dir=directory)
+        self.assertEqual(second.get("currencies", unavailable, self.build), value)
+
+
+class TurnoverTests(ExchangeTestCase):
+    def test_turnover_is_maintained_and_rebuilt(self):
+        for amount in (Decimal(100), Decimal(64)):
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), amount, None
+            )
+        today = timezone.localdate()
+        expected = self.service.get_turnover(today, today)
+        self.assertEqual(len(expected), 1)
+        self.assertEqual(expected[0]["transactions_count"], 2)
+        self.assertEqual(expected[0]["volume"], 164)
+        self.assertEqual(expected[0]["exchanged_volume"], 51)
+
+        self.assertEqual(self.service.rebuild_turnover(today, today), 2)
+        self.assertEqual(self.service.get_turnover(today, today), expected)
+
+    def test_deleted_transactions_are_subtracted_from_turnover(self):
+        for amount in (Decimal(100), Decimal(64)):
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), amount, None
+            )
+        today = timezone.localdate()
+        ids = [row["transaction_id"] for row in self.service.get_transactions()["transactions"]]
+        with mock.patch.object(CurrencyExchangeService, "rebuild_turnover") as rebuild:
+            self.service.delete_exchange_transactions(ids[:1])
+        rebuild.assert_not_called()
+        turnover = self.service.get_turnover(today, today)
+        self.assertEqual(turnover[0]["transactions_count"], 1)
+        self.service.rebuild_turnover(today, today)
+        self.assertEqual(self.service.get_turnover(today, today), turnover)
+
+        # Строка оборота без транзакций удаляется
+        self.service.delete_exchange_transactions(ids[1:])
+        self.assertEqual(self.service.get_turnover(today, today), [])
+
+
+class BenchmarkTests(ExchangeTestCase):
+    def test_writing_measurements_are_rolled_back(self):
+        def exchange():
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), Decimal(32), None
+            )
+
+        result = measure_rolled_back(exchange, iterations=3)
+        self.assertEqual(result["iterations"], 3)
+        self.assertEqual(result["queries_per_call"], 6)
+        self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+        self.assertEqual(self.get_cash(self.usd_id), 1000)
+
+
+class MetricsTests(ExchangeTestCase):
+    def test_middleware_counts_request_queries(self):
+        def get_response(request):
+            self.service.get_rates()
+            self.service.get_transactions()
+            return HttpResponse()
+
+        queries_key = ("exchange_http_request_queries", (("view", "unmatched"),))
+        service_key = ("exchange_service_call_duration_seconds", (("method", "get_rates"),))
+        before = registry.snapshot()
+        MetricsMiddleware(get_response)(RequestFactory().get("/exchange/rates/"))
+        after = registry.snapshot()
+
+        # Сумма гистограммы - число запросов: два SELECT сервиса
+        self.assertEqual(after[queries_key][-1] - before.get(queries_key, [0])[-1], 2)
+        self.assertEqual(after[service_key][-2] - before.get(service_key, [0, 0])[-2], 1)
+
+    def test_workers_are_merged_from_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            workers = [MetricsRegistry(directory), MetricsRegistry(directory)]
+            for worker, seconds in zip(workers, (0.003, 0.2)):
+                worker.observe("exchange_http_request_duration_seconds", seconds, view="rates")
+                worker.flush()
+            text = render_text(workers[0].collect())
+        self.assertIn('exchange_http_request_duration_seconds_bucket{view="rates",le="0.005"} 1', text)
+        self.assertIn('exchange_http_request_duration_seconds_bucket{view="rates",le="+Inf"} 2', text)
+        self.assertIn('exchange_http_request_duration_seconds_count{view="rates"} 2', text)
+
+    def test_dead_worker_files_are_folded_into_totals(self):
+        # pid завершившегося процесса
+        finished = subprocess.Popen([sys.executable, "-c", ""])
+        finished.wait()
+        with tempfile.TemporaryDirectory() as directory:
+            worker = MetricsRegistry(directory)
+            worker.observe("exchange_http_request_duration_seconds", 0.2, view="rates")
+            worker.flush()
+            os.rename(worker._path, os.path.join(directory, f"{finished.pid}-1.json"))
+            worker._reset()
+            worker.observe("exchange_http_request_duration_seconds", 0.003, view="rates")
+
+            key = ("exchange_http_request_duration_seconds", (("view", "rates"),))
+            for _ in range(2):
+                self.assertEqual(worker.collect()[key][-2], 2)
+            self.assertEqual(
+                sorted(name for name in os.listdir(directory) if name.endswith(".json")),
+                sorted([os.path.basename(worker._path), "totals.json"]),
+            )
+
+
+    def test_metrics_are_closed_without_token_or_staff(self):
+        def get(user, **headers):
+            request = RequestFactory().get("/metrics", headers=headers)
+            request.user = user
+            return metrics_view(request).status_code
+
+        staff = User.objects.create_user("staff", password="secret", is_staff=True)
+        with override_settings(METRICS={**settings.METRICS, "TOKEN": None, "PUBLIC": False}):
+            self.assertEqual(get(AnonymousUser()), 403)
+            self.assertEqual(get(self.operator), 403)
+            self.assertEqual(get(staff), 200)
+        with override_settings(METRICS={**settings.METRICS, "TOKEN": "t0ken", "PUBLIC": False}):
+            self.assertEqual(get(AnonymousUser(), authorization="Bearer t0ken"), 200)
+            self.assertEqual(get(AnonymousUser(), authorization="Bearer other"), 403)
+        with override_settings(METRICS={**settings.METRICS, "TOKEN": None, "PUBLIC": True}):
+            self.assertEqual(get(AnonymousUser()), 200)
+
+
+class ArchiveTests(ExchangeTestCase):
+    def test_closed_month_is_moved_to_archive_file(self):
+        for amount in (Decimal(100), Decimal(64)):
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), amount, None
+            )
+        last_month = add_months(month_start(timezone.now()), -1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE exchange_transactions SET transaction_date = %s",
+                [timezone.now().replace(year=last_month.year, month=last_month.month, day=15)],
+            )
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(ARCHIVE_DIR=directory):
+            self.assertEqual(self.service.archive_transactions_month(last_month), 2)
+            self.assertEqual(self.service.get_transactions()["transactions"], [])
+            self.assertEqual(self.service.get_archived_months(), [last_month])
+
+            page = self.service.get_archived_transactions(last_month, self.operator.id, page_size=1)
+            self.assertTrue(page["has_next"])
+            self.assertEqual(page["transactions"][0]["amount"], Decimal(64))
+            self.assertEqual(page["transactions"][0]["currency_to_name"], "Доллар США")
+            page = self.service.get_archived_transactions(last_month, self.operator.id, 2, 1)
+            self.assertFalse(page["has_next"])
+            self.assertEqual(page["transactions"][0]["amount"], Decimal(100))
+
+    def test_repeated_archive_merges_and_keeps_rows_written_after_reading(self):
+        last_month = add_months(month_start(timezone.now()), -1)
+        moment = timezone.now().replace(year=last_month.year, month=last_month.month, day=15)
+
+        def exchange_in_last_month(amount):
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), amount, None
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE exchange_transactions SET transaction_date = %s "
+                    "WHERE transaction_id = (SELECT MAX(transaction_id) FROM exchange_transactions)",
+                    [moment],
+                )
+
+        exchange_in_last_month(Decimal(100))
+        write = TransactionArchive.write
+
+        def write_then_exchange(archive, month, rows):
+            count = write(archive, month, rows)
+            # Обмен, зафиксированный между чтением месяца и удалением строк
+            exchange_in_last_month(Decimal(64))
+            return count
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(ARCHIVE_DIR=directory):
+            self.assertEqual(self.service.archive_transactions_month(last_month), 1)
+            with mock.patch.object(TransactionArchive, "write", write_then_exchange):
+                self.assertEqual(self.service.archive_transactions_month(last_month), 0)
+            # Поздняя строка не удалена без архивации и попадает в архив при следующем запуске
+            self.assertEqual(len(self.service.get_transactions()["transactions"]), 1)
+            self.assertEqual(self.service.archive_transactions_month(last_month), 1)
+            self.assertEqual(self.service.get_transactions()["transactions"], [])
+            amounts = [
+                row["amount"]
+                for row in self.service.get_archived_transactions(last_month)["transactions"]
+            ]
+            self.assertEqual(sorted(amounts), [Decimal(64), Decimal(100)])
+
+        with self.assertRaises(ValueError):
+            self.service.archive_transactions_month(month_start(timezone.now()))
+        with self.assertRaises(CommandError):
+            call_command("archive_transactions", "--keep-months", "-1", stdout=StringIO())
+
+    def test_rebuild_and_purge_keep_archived_turnover(self):
+        for amount in (Decimal(100), Decimal(64)):
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), amount, None
+            )
+        last_month = add_months(month_start(timezone.now()), -1)
+        archived_day = timezone.now().replace(year=last_month.year, month=last_month.month, day=15)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE exchange_transactions SET transaction_date = %s WHERE amount = %s",
+                [archived_day, Decimal(100)],
+            )
+        today = timezone.localdate()
+        self.service.rebuild_turnover(last_month, today)
+        expected = self.service.get_turnover(last_month, today)
+        self.assertEqual(len(expected), 2)
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(ARCHIVE_DIR=directory):
+            self.service.archive_transactions_month(last_month)
+            # Архивный месяц пропускается, пересчитываются только живые дни
+            self.assertEqual(self.service.rebuild_turnover(last_month, today), 1)
+            self.assertEqual(self.service.get_turnover(last_month, today), expected)
+            self.service.purge_transactions(last_month, today)
+            turnover = self.service.get_turnover(last_month, today)
+        self.assertEqual(turnover, expected[1:])
+        self.assertEqual(turnover[0]["volume"], 100)
+
+
+class ExportTests(ExchangeTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create_superuser("admin", password="secret-pass")
+        cls.other = User.objects.create_user("other", password="secret-pass")
+        # Сделки оператора 1-5 марта, сделка другого оператора - 3 марта
+        deals = [(cls.operator, day) for day in range(1, 6)] + [(cls.other, 3)]
+        for operator, day in deals:
+            cls.service.exchange_currency_with_transaction(
+                operator.id, str(BASE_CURRENCY_ID), str(cls.usd_id), Decimal(10 * day), None
+            )
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT transaction_id FROM exchange_transactions ORDER BY transaction_id")
+            for (transaction_id,), (_, day) in zip(cursor.fetchall(), deals):
+                cursor.execute(
+                    "UPDATE exchange_transactions SET transaction_date = %s WHERE transaction_id = %s",
+                    [datetime(2024, 3, day, 12, tzinfo=dt_timezone.utc), transaction_id],
+                )
+
+    def export(self, user, **params):
+        request = RequestFactory().get("/exchange/exchange_history/export/", params)
+        request.user = user
+        with mock.patch.object(CurrencyExchangeService, "export_chunk_size", 2):
+            response = export_transactions_view(request)
+            return response, [part.decode() for part in response.streaming_content]
+
+    def test_csv_export_filters_period_and_operator_across_chunks(self):
+        response, parts = self.export(
+            self.admin, format="csv", date_from="2024-03-02", date_to="2024-03-04"
+        )
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        # Заголовок и две порции по fetchmany(2)
+        self.assertEqual(len(parts), 3)
+        rows = list(csv.reader(StringIO("".join(parts))))
+        self.assertEqual(rows[0], EXPORT_HEADER)
+        self.assertEqual([row[2] for row in rows[1:]], ["operator", "operator", "other", "operator"])
+        self.assertEqual([row[5] for row in rows[1:]], ["20", "30", "30", "40"])
+
+        _, parts = self.export(self.admin, format="csv", operator=self.other.id)
+        rows = list(csv.reader(StringIO("".join(parts))))
+        self.assertEqual([row[2] for row in rows[1:]], ["other"])
+
+    def test_ndjson_export_keeps_operator_to_own_rows(self):
+        response, parts = self.export(self.operator, format="ndjson", operator=self.other.id)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(parts), 3)
+        rows = [json.loads(line) for line in "".join(parts).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(list(rows[0]), EXPORT_HEADER)
+        self.assertEqual({row["operator"] for row in rows}, {"operator"})
+        self.assertEqual([row["amount"] for row in rows], ["10", "20", "30", "40", "50"])
+
+    def test_asgi_export_streams_chunks_asynchronously(self):
+        request = AsyncRequestFactory().get("/exchange/exchange_history/export/", {"format": "csv"})
+        request.user = self.operator
+
+        async def consume(response):
+            return [part async for part in response.streaming_content]
+
+        with mock.patch.object(CurrencyExchangeService, "export_chunk_size", 2):
+            response = export_transactions_view(request)
+            self.assertTrue(response.is_async)
+            parts = async_to_sync(consume)(response)
+        # Заголовок и три порции строк по fetchmany(2)
+        self.assertEqual(len(parts), 4)
+        lines = b"".join(parts).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[0], "transaction_id")
+        self.assertEqual(len(lines), 6)
+
+
+class HistoryTests(ExchangeTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = User.objects.create_user("other", password="secret-pass")
+        # Сделки 1-5 оператора, 6 - другого; у 2 и 3 одинаковое время
+        days = [1, 2, 2, 3, 4, 5]
+        for index, day in enumerate(days):
+            operator = cls.other if index == 5 else cls.operator
+            cls.service.exchange_currency_with_transaction(
+                operator.id, str(BASE_CURRENCY_ID), str(cls.usd_id), Decimal(10), None
+            )
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT transaction_id FROM exchange_transactions ORDER BY transaction_id")
+            cls.ids = [row[0] for row in cursor.fetchall()]
+            for transaction_id, day in zip(cls.ids, days):
+                cursor.execute(
+                    "UPDATE exchange_transactions SET transaction_date = %s WHERE transaction_id = %s",
+                    [datetime(2024, 3, day, 12, tzinfo=dt_timezone.utc), transaction_id],
+                )
+
+    def page(self, cursor_value=None, user_id=None):
+        page = self.service.get_transactions(user_id or self.operator.id, cursor_value, page_size=2)
+        ids = [row["transaction_id"] for row in page["transactions"]]
+        return ids, page
+
+    def test_keyset_pages_forward_and_back_with_tie_break(self):
+        first, second, third, fourth, fifth, _ = self.ids
+        ids, page = self.page()
+        self.assertEqual(ids, [fifth, fourth])
+        self.assertIsNone(page["prev_cursor"])
+
+        ids, page = self.page(page["next_cursor"])
+        # Одинаковое время: порядок по transaction_id, граница страницы внутри пары
+        self.assertEqual(ids, [third, second])
+        ids, page = self.page(page["next_cursor"])
+        self.assertEqual(ids, [first])
+        self.assertIsNone(page["next_cursor"])
+
+        ids, page = self.page(page["prev_cursor"])
+        self.assertEqual(ids, [third, second])
+        ids, page = self.page(page["prev_cursor"])
+        self.assertEqual(ids, [fifth, fourth])
+        self.assertIsNone(page["prev_cursor"])
+        self.assertIsNotNone(page["next_cursor"])
+
+    def test_operator_filter_and_cursor_in_other_time_zone(self):
+        page = self.service.get_transactions(page_size=2)
+        self.assertEqual([row["transaction_id"] for row in page["transactions"]], self.ids[:-3:-1])
+        self.assertEqual(page["transactions"][0]["username"], "other")
+
+        ids, page = self.page()
+        self.assertNotIn(self.ids[5], ids)
+        self.assertIsNone(page["transactions"][0]["username"])
+        # Курсор с тем же моментом в другой зоне ведёт на ту же страницу
+        minsk = dt_timezone(timedelta(hours=3))
+        cursor_value = self.service.encode_history_cursor(
+            "next", datetime(2024, 3, 2, 15, tzinfo=minsk), self.ids[2]
+        )
+        self.assertEqual(self.page(cursor_value)[0], [self.ids[1], self.ids[0]])
+        naive = self.service.encode_history_cursor("next", datetime(2024, 3, 2), self.ids[2])
+        self.assertIsNone(self.service.decode_history_cursor(naive))
+
+
+class RatesTests(ExchangeTestCase):
+    def test_rates_page_shows_latest_rate_per_currency(self):
+        self.service.add_exchange_rates(
+            [
+                [self.usd_id, Decimal("3.1"), date(2023, 12, 31)],
+                [self.usd_id, Decimal("3.3"), date(2024, 1, 2)],
+            ]
+        )
+        rates = {rate["currency_name"]: rate for rate in self.service.get_rates()}
+        self.assertEqual(len(rates), 2)
+        self.assertEqual(rates["Доллар США"]["rate_to_base"], Decimal("3.3"))
+        self.assertEqual(rates["Евро"]["rate_to_base"], Decimal("3.5"))
+
+    def test_history_is_downsampled_by_week(self):
+        # 2024-01-01 - понедельник
+        self.service.add_exchange_rates(
+            [
+                [self.usd_id, Decimal(rate), date(2024, 1, day)]
+                for day, rate in ((3, "3.4"), (7, "3.0"), (8, "3.6"))
+            ]
+        )
+        history = self.service.get_rate_history(
+            self.usd_id, date(2024, 1, 1), date(2024, 1, 31), "week"
+        )
+        self.assertEqual(
+            [(point["date"], point["rate"], point["low"], point["high"], point["count"])
+             for point in history],
+            [
+                (date(2024, 1, 1), Decimal("3.0"), Decimal("3.0"), Decimal("3.4"), 3),
+                (date(2024, 1, 8), Decimal("3.6"), Decimal("3.6"), Decimal("3.6"), 1),
+            ],
+        )
+
+    def current_rates(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT c.currency_id, c.rate_id, c.rate_to_base, c.rate_date, r.rate_id
+                FROM current_rates c
+                LEFT JOIN exchange_rates r ON c.rate_id = r.rate_id
+                """
+            )
+            rows = cursor.fetchall()
+        # Действующий курс всегда ссылается на существующую строку exchange_rates
+        self.assertNotIn(None, [row[4] for row in rows])
+        return {row[0]: (row[2], row[3]) for row in rows}
+
+    @staticmethod
+    def rate_id(currency_id, rate_date):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rate_id FROM exchange_rates WHERE currency_id = %s AND rate_date = %s",
+                [currency_id, rate_date],
+            )
+            return cursor.fetchone()[0]
+
+    def test_current_rate_follows_inserts_and_deleted_latest_rate(self):
+        self.service.add_exchange_rate(self.usd_id, Decimal("3.1"), "2023-12-31")
+        self.assertEqual(self.current_rates()[self.usd_id], (Decimal("3.2"), date(2024, 1, 1)))
+        self.service.add_exchange_rate(self.usd_id, Decimal("3.3"), "2024-01-02")
+        self.assertEqual(self.current_rates()[self.usd_id], (Decimal("3.3"), date(2024, 1, 2)))
+
+        # Удалён действующий курс - действует курс предыдущей даты
+        self.service.delete_rates([self.rate_id(self.usd_id, date(2024, 1, 2))])
+        self.assertEqual(self.current_rates()[self.usd_id], (Decimal("3.2"), date(2024, 1, 1)))
+        # Удаление старого курса действующий не меняет
+        self.service.delete_rates([self.rate_id(self.usd_id, date(2023, 12, 31))])
+        self.assertEqual(self.current_rates()[self.usd_id], (Decimal("3.2"), date(2024, 1, 1)))
+
+    def test_bulk_delete_refreshes_every_affected_currency(self):
+        self.service.add_exchange_rates(
+            [
+                [self.usd_id, Decimal("3.1"), date(2023, 12, 31)],
+                [self.usd_id, Decimal("3.3"), date(2024, 1, 2)],
+                [self.eur_id, Decimal("3.4"), date(2023, 12, 31)],
+            ]
+        )
+        self.service.delete_rates(
+            [
+                self.rate_id(self.usd_id, date(2024, 1, 2)),
+                self.rate_id(self.usd_id, date(2024, 1, 1)),
+                self.rate_id(self.eur_id, date(2024, 1, 1)),
+                self.rate_id(self.eur_id, date(2023, 12, 31)),
+            ]
+        )
+        # У евро курсов не осталось - действующего курса нет
+        self.assertEqual(
+            self.current_rates(), {self.usd_id: (Decimal("3.1"), date(2023, 12, 31))}
+        )
+
+    def test_daily_import_matches_catalog_and_skips_known_dates(self):
+        self.service.add_currency_to_cash("Фунт стерлингов", 100)
+        self.service.add_currency_to_cash("Злотый", 100)
+        currencies = {row[1]: row[0] for row in self.service.get_currency()}
+        self.service.archive_currency(currencies["Злотый"])
+
+        def entry(name, rate, scale=1, day="2024-01-02"):
+            return {
+                "Cur_Name": name, "Cur_OfficialRate": rate, "Cur_Scale": scale,
+                "Date": f"{day}T00:00:00",
+            }
+
+        daily_rates = [
+            entry("Доллар США", 3.2, day="2024-01-01"),
+            entry("Евро", 35.5, scale=10),
+            entry("Злотый", 0.8),
+            entry("Белорусский рубль", 1),
+        ]
+        with mock.patch("exchange_app.utils.fetch_daily_rates", return_value=daily_rates), \
+                mock.patch.object(statements, "executemany", wraps=statements.executemany) as insert:
+            imported, missing, error = self.service.import_rates_from_api()
+            # Курс доллара на 2024-01-01 уже есть, евро загружен - повтор ничего не вставляет
+            self.assertEqual(self.service.import_rates_from_api(), ([], ["Фунт стерлингов"], None))
+
+        self.assertIsNone(error)
+        self.assertEqual(imported, ["Евро"])
+        self.assertEqual(missing, ["Фунт стерлингов"])
+        insert.assert_called_once()
+        self.assertEqual(insert.call_args.args[2], [[self.eur_id, Decimal("3.550"), date(2024, 1, 2)]])
+
+
+@override_settings(QUOTES={"MARKUP": "2", "CACHE_TIMEOUT": None})
+class QuotesTests(ExchangeTestCase):
+    def get_quotes(self, **headers):
+        request = AsyncRequestFactory().get("/exchange/api/quotes/", headers=headers)
+        return async_to_sync(quotes_view)(request)
+
+    def test_matrix_covers_all_pairs_with_markup(self):
+        data = json.loads(self.get_quotes().content)
+        quotes = {(quote["from"], quote["to"]): quote for quote in data["quotes"]}
+        self.assertEqual(len(quotes), 6)
+        # 1 USD = 3.2 / 3.5 EUR, покупка и продажа - на 2% ниже и выше
+        self.assertEqual(quotes[(self.usd_id, self.eur_id)]["mid"], "0.914286")
+        self.assertEqual(quotes[(self.usd_id, self.eur_id)]["buy"], "0.896000")
+        self.assertEqual(quotes[(self.usd_id, self.eur_id)]["sell"], "0.932571")
+        self.assertEqual(quotes[(BASE_CURRENCY_ID, self.usd_id)]["mid"], "0.312500")
+
+    def test_unchanged_rates_return_not_modified(self):
+        response = self.get_quotes()
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_quotes(if_none_match=etag).status_code, 304)
+
+        self.service.add_exchange_rate(self.usd_id, Decimal("3.3"), "2024-01-02")
+        response = self.get_quotes(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class EventsTests(ExchangeTestCase):
+    def test_writes_publish_deltas_after_commit(self):
+        def writes():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.service.add_exchange_rate(self.usd_id, Decimal("3.3"), "2024-01-02")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.service.exchange_currency_with_transaction(
+                    self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), Decimal(100), None
+                )
+            with self.captureOnCommitCallbacks(execute=True):
+                self.service.archive_currency(self.eur_id)
+
+        async def receive():
+            subscription = broker.subscribe()
+            try:
+                await sync_to_async(writes)()
+                return [await asyncio.wait_for(subscription.get(), 1) for _ in range(4)]
+            finally:
+                broker.unsubscribe(subscription)
+
+        events = [(event_type, data) for _, event_type, data in async_to_sync(receive)()]
+        self.assertEqual(events[0][0], "rate")
+        self.assertEqual(events[0][1]["rate_to_base"], Decimal("3.3"))
+        # Обмен меняет остатки исходной (базовой) и целевой валют
+        cash = {data["currency_id"]: data["amount_in_cash"] for _, data in events[1:3]}
+        # 100 BYN по новому курсу 3.3 = 30 USD
+        self.assertEqual(cash[self.usd_id], 1000 - 30)
+        self.assertEqual(set(cash), {BASE_CURRENCY_ID, self.usd_id})
+        self.assertEqual(events[3][0], "currency")
+        self.assertTrue(events[3][1]["is_archived"])
+
+    def test_stream_hides_cash_from_operators(self):
+        async def read():
+            stream = stream_events(None, is_admin=False, keepalive=0.01)
+            chunks = [await anext(stream), await anext(stream)]
+            broker.publish("cash", {"currency_id": self.usd_id, "amount_in_cash": 5})
+            broker.publish(
+                "rate", {"currency_id": self.usd_id, "rate_to_base": "3.3", "amount_in_cash": 5}
+            )
+            chunks.append(await anext(stream))
+            await stream.aclose()
+            return chunks
+
+        retry, keepalive, event = async_to_sync(read)()
+        self.assertEqual(retry, "retry: 3000\n\n")
+        self.assertEqual(keepalive, ": keepalive\n\n")
+        self.assertIn("event: rate\n", event)
+        self.assertNotIn("amount_in_cash", event)
+        self.assertFalse(broker.is_active())
+
+        # Под WSGI бесконечный поток не отдаётся
+        async def auser():
+            return self.operator
+
+        request = RequestFactory().get("/exchange/events/")
+        request.user, request.auser = self.operator, auser
+        self.assertEqual(async_to_sync(events_view)(request).status_code, 204)
+
+    def test_spool_delivers_between_processes_and_replays(self):
+        directory = tempfile.mkdtemp()
+        reader = SpoolEventBroker(directory, poll_interval=0.01)
+        self.addCleanup(reader.close)
+        # Публикует другой воркер или команда управления
+        writer = SpoolEventBroker(directory)
+
+        async def receive():
+            subscription = reader.subscribe()
+            writer.publish("cash", {"currency_id": self.usd_id, "amount_in_cash": "5.00"})
+            writer.publish("rate_removed", {"currency_id": self.eur_id})
+            events = [await asyncio.wait_for(subscription.get(), 1) for _ in range(2)]
+            reader.unsubscribe(subscription)
+            # Переподключение с Last-Event-ID получает только пропущенное
+            replay = reader.subscribe(events[0][0])
+            missed = await asyncio.wait_for(replay.get(), 1)
+            # Идентификатор другого процесса - страница перечитывается целиком
+            foreign = reader.subscribe("0123abcd-1")
+            return events, missed, await asyncio.wait_for(foreign.get(), 1)
+
+        events, missed, foreign = async_to_sync(receive)()
+        self.assertEqual(
+            [(event_type, data) for _, event_type, data in events],
+            [
+                ("cash", {"currency_id": self.usd_id, "amount_in_cash": "5.00"}),
+                ("rate_removed", {"currency_id": self.eur_id}),
+            ],
+        )
+        self.assertEqual(missed, events[1])
+        self.assertEqual(foreign[1], "reload")
+        self.assertIsInstance(broker, EventBroker)
+
+    def test_spool_collects_deltas_only_while_someone_listens(self):
+        directory = tempfile.mkdtemp()
+        reader = SpoolEventBroker(directory, poll_interval=0.01)
+        self.addCleanup(reader.close)
+        writer = SpoolEventBroker(directory)
+        self.assertFalse(writer.is_active())
+
+        async def listen():
+            subscription = reader.subscribe()
+            active = writer.is_active()
+            reader.unsubscribe(subscription)
+            return active
+
+        self.assertTrue(async_to_sync(listen)())
+        # Отметка последнего подписчика устарела - дельты не собираются
+        idle = SpoolEventBroker(tempfile.mkdtemp())
+        idle._heartbeat()
+        stale = timezone.now().timestamp() - idle.heartbeat_ttl - 1
+        os.utime(idle.heartbeat_path, (stale, stale))
+        self.assertFalse(idle.is_active())
+        with mock.patch.object(events_module, "broker", idle), self.assertNumQueries(0):
+            events_module.publish_cash(sender=None, currency_ids=[self.usd_id])
+
+
+class FragmentCacheTests(ExchangeTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create_superuser("admin", password="secret-pass")
+
+    def get_page(self, view, user):
+        async def auser():
+            return user
+
+        request = RequestFactory().get("/")
+        request.user, request.auser = user, auser
+        if iscoroutinefunction(view):
+            return async_to_sync(view)(request)
+        return view(request)
+
+    def test_rates_table_is_cached_until_cash_changes(self):
+        self.assertIn("Доллар США", self.get_page(rates_view, self.admin).content.decode())
+        # Только счётчики версий: таблица из кэша
+        with self.assertNumQueries(1):
+            self.assertIn("Доллар США", self.get_page(rates_view, self.admin).content.decode())
+
+        self.service.update_currency_cash(5, "Доллар США")
+        page = self.get_page(rates_view, self.admin).content.decode()
+        self.assertIn("1005", page)
+        # У оператора столбца кассы нет, его таблица кэшируется отдельно
+        self.assertNotIn("1005", self.get_page(rates_view, self.operator).content.decode())
+
+    def test_exchange_invalidates_cash_page_and_catalog_invalidates_selects(self):
+        self.assertIn("1000", self.get_page(cash_reserves_view, self.admin).content.decode())
+        self.service.exchange_currency_with_transaction(
+            self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), Decimal(100), None
+        )
+        self.assertIn("969", self.get_page(cash_reserves_view, self.admin).content.decode())
+
+        self.assertIn("Евро", self.get_page(exchange_view, self.operator).content.decode())
+        self.service.archive_currency(self.eur_id)
+        self.assertNotIn("Евро", self.get_page(exchange_view, self.operator).content.decode())
+
+
+class PurgeTests(ExchangeTestCase):
+    def rate_ids(self, currency_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rate_id FROM exchange_rates WHERE currency_id = %s ORDER BY rate_id",
+                [currency_id],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_rates_are_purged_in_chunks_and_resumed(self):
+        self.service.add_exchange_rates(
+            [(self.usd_id, Decimal("3.1"), date(2023, 1, day)) for day in range(1, 6)]
+        )
+        # Действующий курс 2024 года и пять курсов 2023-го
+        usd_rates = self.rate_ids(self.usd_id)
+        # Прерванное задание остановилось после курса 1 января
+        with connection.cursor() as cursor:
+            save_checkpoint(cursor, "purge:test", usd_rates[1])
+
+        # SELECT позиции, затем на порцию: SAVEPOINT, SELECT, DELETE, позиция (UPDATE),
+        # RELEASE; последняя пустая порция и удаление позиции
+        with self.assertNumQueries(1 + 2 * 5 + 3 + 1):
+            count = self.service.purge_rates(
+                date_to=date(2023, 12, 31), chunk_size=2, job="purge:test"
+            )
+        self.assertEqual(count, 4)
+        self.assertEqual(self.rate_ids(self.usd_id), usd_rates[:2])
+        self.assertIsNone(get_checkpoint("purge:test"))
+        # Действующий курс 2024 года не попадает в период и остаётся
+        rates = {rate["currency_id"]: rate for rate in self.service.get_rates()}
+        self.assertEqual(rates[self.usd_id]["rate_to_base"], Decimal("3.2"))
+
+        # Без сохранения действующих курсов курс пересчитывается по оставшейся истории
+        self.service.purge_rates(
+            date_from=date(2024, 1, 1), currency_id=self.usd_id, keep_current=False
+        )
+        rates = {rate["currency_id"]: rate for rate in self.service.get_rates()}
+        self.assertEqual(rates[self.usd_id]["rate_date"], date(2023, 1, 1))
+
+    def test_rate_filter_delete_is_capped_per_request_and_resumed(self):
+        self.service.add_exchange_rates(
+            [(self.usd_id, Decimal("3.1"), date(2023, 1, day)) for day in range(1, 6)]
+        )
+        admin = User.objects.create_superuser("admin", password="secret")
+        data = {"date_to": "2023-12-31", "currency": str(self.usd_id)}
+        job = f"purge:rates:None:2023-12-31:{self.usd_id}:False"
+        retention = {**settings.RETENTION, "CHUNK_SIZE": 2, "REQUEST_ROWS": 3}
+        with override_settings(RETENTION=retention), \
+                mock.patch("exchange_app.views.messages") as sent:
+            before = len(self.rate_ids(self.usd_id))
+            request = RequestFactory().post("/exchange/rates/delete/", data)
+            request.user = admin
+            delete_rate(request)
+            # Запрос остановился после двух порций и оставил позицию задания
+            self.assertEqual(len(self.rate_ids(self.usd_id)), before - 4)
+            self.assertIsNotNone(get_checkpoint(job))
+            sent.warning.assert_called_once()
+
+            delete_rate(request)
+            sent.success.assert_called_once()
+        self.assertIsNone(get_checkpoint(job))
+        # Остался только курс 2024 года
+        self.assertEqual(len(self.rate_ids(self.usd_id)), 1)
+
+    def test_transactions_are_purged_by_currency_with_turnover(self):
+        for currency_id in (self.usd_id, self.eur_id):
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(currency_id), Decimal(100), None
+            )
+        today = timezone.localdate()
+        call_command(
+            "purge", "transactions", "--date-from", f"{today}", "--currency", str(self.usd_id),
+            "--pause", "0", stdout=StringIO(),
+        )
+        page = self.service.get_transactions()
+        self.assertEqual(
+            [row["currency_to_name"] for row in page["transactions"]], ["Евро"]
+        )
+        turnover = self.service.get_turnover(today, today)
+        self.assertEqual([row["transactions_count"] for row in turnover], [1])
+
+
+    def test_purge_subtracts_chunks_from_turnover_without_rebuild(self):
+        for amount in (Decimal(100), Decimal(64), Decimal(32)):
+            self.service.exchange_currency_with_transaction(
+                self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), amount, None
+            )
+        self.service.exchange_currency_with_transaction(
+            self.operator.id, str(BASE_CURRENCY_ID), str(self.eur_id), Decimal(50), None
+        )
+        today = timezone.localdate()
+        with mock.patch.object(CurrencyExchangeService, "rebuild_turnover") as rebuild:
+            count = self.service.purge_transactions(
+                today, today, currency_id=self.usd_id, chunk_size=2
+            )
+        rebuild.assert_not_called()
+        self.assertEqual(count, 3)
+        turnover = self.service.get_turnover(today, today)
+        # Опустевшая строка оборота USD удалена, строка EUR не тронута
+        self.assertEqual(len(turnover), 1)
+        self.assertEqual(turnover[0]["volume"], 50)
+        self.service.rebuild_turnover(today, today)
+        self.assertEqual(self.service.get_turnover(today, today), turnover)
+
+
+class RecordingCursor:
+    """Курсор соединения PostgreSQL, запоминающий отправленный текст."""
+
+    def __init__(self, raw_connection):
+        self.db = type("Wrapper", (), {"vendor": "postgresql", "connection": raw_connection})
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+
+class StatementTests(SimpleTestCase):
+    def test_postgres_statement_is_prepared_once_per_connection(self):
+        statements = StatementRegistry()
+        statement = statements.register(
+            "find_cash",
+            "SELECT * FROM cash_reserves WHERE currency_name LIKE %s || '%%' AND currency_id > %s",
+        )
+        with self.assertRaises(ValueError):
+            statements.register("find_cash", "SELECT 1")
+
+        first = RecordingCursor(type("Connection", (), {})())
+        statements.execute(first, statement, ["Д", 1])
+        statements.execute(first, statement, ["Е", 2])
+        self.assertEqual(
+            first.executed,
+            [
+                (
+                    "PREPARE exchange_find_cash AS SELECT * FROM cash_reserves "
+                    "WHERE currency_name LIKE $1 || '%' AND currency_id > $2",
+                    None,
+                ),
+                ("EXECUTE exchange_find_cash (%s, %s)", ["Д", 1]),
+                ("EXECUTE exchange_find_cash (%s, %s)", ["Е", 2]),
+            ],
+        )
+        # Новое соединение драйвера подготавливает запрос заново
+        second = RecordingCursor(type("Connection", (), {})())
+        statements.execute(second, statement, ["Д", 1])
+        self.assertEqual(len(second.executed), 2)
+
+        statements.prepare = False
+        statements.execute(second, statement, ["Д", 1])
+        self.assertEqual(second.executed[-1][0], statement.sql)
+
+    def test_postgres_dialect_prepare_and_execute_text(self):
+        dialect = PostgresDialect()
+        self.assertEqual(
+            dialect.prepare("exchange_rates", "SELECT %s, '%%' FROM rates WHERE id IN (%s, %s)"),
+            "PREPARE exchange_rates AS SELECT $1, '%' FROM rates WHERE id IN ($2, $3)",
+        )
+        self.assertEqual(dialect.execute_prepared("exchange_rates", 0), "EXECUTE exchange_rates")
+        self.assertEqual(
+            dialect.execute_prepared("exchange_rates", 3), "EXECUTE exchange_rates (%s, %s, %s)"
+        )
+
+    def test_prepared_names_are_tracked_per_driver_connection(self):
+        statements = StatementRegistry()
+        first = statements.register("first", "SELECT %s")
+        second = statements.register("second", "SELECT 1")
+        unprepared = statements.register("unprepared", "SELECT %s IS NULL", prepare=False)
+        raw_connection = type("Connection", (), {})()
+        cursor = RecordingCursor(raw_connection)
+        for statement in (first, second, unprepared, first):
+            statements.execute(cursor, statement, None)
+
+        self.assertEqual(
+            statements._prepared[raw_connection], {"exchange_first", "exchange_second"}
+        )
+        self.assertEqual(
+            [sql for sql, _ in cursor.executed],
+            [
+                "PREPARE exchange_first AS SELECT $1",
+                "EXECUTE exchange_first (%s)",
+                "PREPARE exchange_second AS SELECT 1",
+                "EXECUTE exchange_second",
+                unprepared.sql,
+                "EXECUTE exchange_first (%s)",
+            ],
+        )
+        # Закрытое соединение драйвера не удерживается в наборе
+        del cursor, raw_connection
+        gc.collect()
+        self.assertEqual(len(statements._prepared), 0)
+
+
+class AuthCacheTests(ExchangeTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["auth"].clear()
+
+    def request_with_session(self, session_key=None):
+        request = RequestFactory().get("/exchange/rates/")
+        request.session = SessionStore(session_key)
+        return request
+
+    def test_session_user_is_cached_until_changed_or_logged_out(self):
+        request = self.request_with_session()
+        login(request, self.operator, backend="exchange_app.auth.CachedModelBackend")
+        request.session.save()
+        session_key = request.session.session_key
+
+        self.assertEqual(get_user(self.request_with_session(session_key)), self.operator)
+        with self.assertNumQueries(0):
+            user = get_user(self.request_with_session(session_key))
+        self.assertFalse(user.is_superuser)
+
+        # Права и пароль действуют сразу: запись пользователя в кэше сброшена
+        self.operator.is_superuser = True
+        self.operator.save()
+        self.assertTrue(get_user(self.request_with_session(session_key)).is_superuser)
+        self.operator.set_password("new-secret-pass")
+        self.operator.save()
+        self.assertFalse(get_user(self.request_with_session(session_key)).is_authenticated)
+
+    def test_logout_invalidates_cached_session(self):
+        request = self.request_with_session()
+        login(request, self.operator, backend="exchange_app.auth.CachedModelBackend")
+        request.session.save()
+        session_key = request.session.session_key
+
+        request = self.request_with_session(session_key)
+        request.user = get_user(request)
+        logout(request)
+        self.assertFalse(get_user(self.request_with_session(session_key)).is_authenticated)
+        self.assertIsNone(caches["auth"].get(f"auth:user:{self.operator.pk}"))
+
+
+class LedgerTests(ExchangeTestCase):
+    def test_reconcile_reads_only_movements_after_checkpoint(self):
+        self.service.exchange_currency_with_transaction(
+            self.operator.id, str(BASE_CURRENCY_ID), str(self.usd_id), Decimal(100), None
+        )
+        self.service.update_currency_cash(Decimal(50), "Евро")
+        result = reconcile_cash(checkpoint=True)
+        self.assertEqual(result["mismatches"], [])
+        # Открытие двух валют, приход, выдача и сдача обмена, пополнение
+        self.assertEqual(result["movements"], 6)
+        self.assertEqual(result["new_checkpoint_id"], result["checkpoint_id"] + 1)
+
+        self.service.exchange_currency_with_transaction(
+            self.operator.id, str(self.eur_id), str(self.usd_id), Decimal(10), None
+        )
+        result = reconcile_cash()
+        self.assertEqual(result["mismatches"], [])
+        # Только движения кросс-обмена после точки, со сдачей в базовой валюте
+        self.assertEqual(result["movements"], 3)
+        usd = next(row for row in result["currencies"] if row["currency_id"] == self.usd_id)
+        self.assertEqual(usd["actual"], self.get_cash(self.usd_id))
+
+    def test_reconcile_locks_cash_table_before_reading(self):
+        # В SQLite блокировки таблиц нет - подменяется безвредным запросом
+        with mock.patch.object(SQLiteDialect, "lock_table", return_value="SELECT 1 /* lock */"):
+            with CaptureQueriesContext(connection) as captured:
+                reconcile_cash()
+        queries = [query["sql"] for query in captured]
+        self.assertEqual(queries[1], "SELECT 1 /* lock */")
+        self.assertIn("FROM cash_reserves cr", queries[2])
+
+    def test_balance_changed_outside_ledger_is_reported(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE cash_reserves SET amount_in_cash = amount_in_cash + 1 "
+                "WHERE currency_id = %s",
+                [self.eur_id],
+            )
+        with self.assertRaisesMessage(CommandError, "Евро"):
+            call_command("reconcile_cash", "--checkpoint", stdout=StringIO())
+        self.assertIsNone(reconcile_cash(checkpoint=True)["new_checkpoint_id"])
+
+
+class DynamicsNBRBHandler(BaseHTTPRequestHandler):
+    """Заглушка rates/dynamics: курс на каждый день окна, окна из failing - ошибка 500."""
+
+    requests = []
+    failing = set()
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        currency_id = int(path.rstrip("/").rsplit("/", 1)[1])
+        params = dict(pair.split("=") for pair in query.split("&"))
+        start = date.fromisoformat(params["startdate"])
+        end = date.fromisoformat(params["enddate"])
+        self.requests.append((currency_id, start))
+        if (currency_id, start) in self.failing:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = [
+            {
+                "Cur_ID": currency_id,
+                "Date": f"{date.fromordinal(day).isoformat()}T00:00:00",
+                "Cur_OfficialRate": 3.0,
+            }
+            for day in range(start.toordinal(), end.toordinal() + 1)
+        ]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class BackfillTests(ExchangeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), DynamicsNBRBHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.client, nbrb._client = nbrb._client, NBRBClient(
+            f"http://127.0.0.1:{self.server.server_port}", retries=0, failure_threshold=100
+        )
+        DynamicsNBRBHandler.requests = []
+        DynamicsNBRBHandler.failing = set()
+        entry = {"Cur_DateStart": "2000-01-01T00:00:00", "Cur_DateEnd": "2050-01-01T00:00:00"}
+        directory = CurrencyDirectory(
+            [
+                {**entry, "Cur_ID": 145, "Cur_Name": "Доллар США", "Cur_Scale": 1},
+                {**entry, "Cur_ID": 292, "Cur_Name": "Евро", "Cur_Scale": 10},
+            ],
+            0,
+        )
+        self.service = CurrencyExchangeService()
+        self.service.get_currency_directory = lambda: directory
+
+    def tearDown(self):
+        nbrb._client = self.client
+        super().tearDown()
+
+    def backfill(self):
+        return self.service.backfill_rates(
+            [self.usd_id, self.eur_id], date(2023, 12, 25), date(2024, 1, 5),
+            window_days=5, workers=3, batch_size=4, job="backfill:test",
+        )
+
+    def test_failed_window_is_resumed_and_existing_dates_skipped(self):
+        DynamicsNBRBHandler.failing = {(292, date(2024, 1, 4))}
+        result = self.backfill()
+        # 1 января уже есть у обеих валют, последнее окно евро не загружено
+        self.assertEqual((result["inserted"], result["skipped"]), (20, 2))
+        self.assertEqual(result["failed"], [(self.eur_id, date(2024, 1, 4), date(2024, 1, 5))])
+        self.assertEqual(get_checkpoint("backfill:test"), "2024-01-03")
+
+        DynamicsNBRBHandler.failing = set()
+        DynamicsNBRBHandler.requests = []
+        result = self.backfill()
+        self.assertEqual(len(DynamicsNBRBHandler.requests), 2)
+        self.assertEqual((result["inserted"], result["skipped"], result["failed"]), (2, 2, []))
+        self.assertIsNone(get_checkpoint("backfill:test"))
+
+        rates = {rate["currency_id"]: rate for rate in self.service.get_rates()}
+        self.assertEqual(rates[self.eur_id]["rate_date"], date(2024, 1, 5))
+        # Курс пересчитан на единицу валюты по масштабу справочника
+        self.assertEqual(rates[self.eur_id]["rate_to_base"], Decimal("0.3"))
+        self.assertEqual(self.backfill()["inserted"], 0)
@@ -4,10 +4,17 @@ from .views import (
     login_view,
     logout_view,
     rates_view,
+    rate_history_view,
+    quotes_view,
+    events_view,
     index,
     add_exchange_rate,
+    import_rates_view,
     exchange_view,
+    exchange_batch_view,
     transaction_history_view,
+    export_transactions_view,
+    turnover_report_view,
     add_currency_to_cash,
     delete_rate,
     cash_reserves_view,
@@ -27,10 +34,21 @@ urlpatterns = [
     path("accounts/logout/", logout_view, name="logout"),
     path("rates/", rates_view, name="rates"),
     path("rates/delete/", delete_rate, name="delete_rate"),
+    path("api/rates/history/", rate_history_view, name="rate_history"),
+    path("api/quotes/", quotes_view, name="quotes"),
+    path("events/", events_view, name="events"),
     path("add_exchange_rate/", add_exchange_rate, name="add_exchange_rate"),
+    path("rates/import/", import_rates_view, name="import_rates"),
     path("exchange_currency/", exchange_view, name="exchange_currency"),
+    path("api/exchange/batch/", exchange_batch_view, name="exchange_batch"),
     path("add_currency_to_cash/", add_currency_to_cash, name="add_currency_to_cash"),
     path("exchange_history/", transaction_history_view, name="exchange_history"),
+    path(
+        "exchange_history/export/",
+        export_transactions_view,
+        name="export_transactions",
+    ),
+    path("reports/turnover/", turnover_report_view, name="turnover_report"),
     path("exchange_history/delete_exchange", delete_exchange, name="delete_exchange"),
     path("register/", register_view, name="register"),
     path("cash_reserves/", cash_reserves_view, name="cash_reserves"),
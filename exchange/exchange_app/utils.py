@@ -1,14 +1,148 @@
-from datetime import datetime
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
 from decimal import Decimal
+from time import sleep
 
-import requests
-from django.db import connection, transaction
+from django.db import DatabaseError, connection, transaction
 from django.utils import timezone
 
+from .archive import (
+    add_months,
+    drop_month,
+    ensure_month_partitions,
+    get_archive,
+    month_bounds,
+    month_start,
+)
+from .checkpoints import clear_checkpoint, get_checkpoint, save_checkpoint
+from .dialects import get_dialect
+from .executors import run_http
+from .ledger import OPENING, TOPUP, record_cash_movements
+from .metrics import instrument_methods
+from .nbrb import fetch_daily_rates, fetch_rate, fetch_rate_dynamics, get_currency_directory
 
+from .signals import cash_changed, currencies_changed, rates_changed
+from .statements import statements
+from .versions import CASH, CURRENCIES, RATES, VersionedCache, bump_data_version
+
+BASE_CURRENCY_ID = 1
+# Oracle не принимает списки IN длиннее 1000 значений (ORA-01795)
+MAX_IN_LIST = 1000
+
+
+def chunks(values, size=MAX_IN_LIST):
+    """Значения порциями не длиннее size - для списков IN."""
+    values = list(values)
+    return [values[index:index + size] for index in range(0, len(values), size)]
+
+
+def purge_job(target, *filters):
+    """Имя задания удаления по фильтру: повтор с теми же параметрами продолжает его."""
+    return ":".join(["purge", target, *map(str, filters)])
+
+
+# Запросы горячего пути: текст постоянный, разбирается один раз на соединение
+CURRENCY_EXISTS = statements.register(
+    "currency_exists", "SELECT COUNT(1) FROM cash_reserves WHERE currency_name = %s"
+)
+CURRENCY_IDS_BY_NAME = statements.register(
+    "currency_ids_by_name", "SELECT currency_id FROM cash_reserves WHERE currency_name = %s"
+)
+INSERT_RATE = statements.register(
+    "insert_rate",
+    """
+    INSERT INTO exchange_rates (currency_id, rate_to_base, rate_date)
+    VALUES (%s, %s, %s)
+    """,
+)
+GET_RATES = statements.register(
+    "get_rates",
+    """
+    SELECT r.rate_id, cr.currency_name, r.rate_to_base, r.rate_date, cr.amount_in_cash,
+    cr.currency_id
+    FROM current_rates r
+    JOIN cash_reserves cr ON r.currency_id = cr.currency_id
+    WHERE cr.is_archived = 0
+    ORDER BY cr.currency_name
+    """,
+)
+GET_CURRENCIES = statements.register(
+    "get_currencies",
+    "SELECT currency_id, currency_name, amount_in_cash, is_archived FROM cash_reserves "
+    "ORDER BY currency_id",
+)
+GET_CURRENCY_CATALOG = statements.register(
+    "get_currency_catalog",
+    "SELECT currency_id, currency_name, is_archived FROM cash_reserves ORDER BY currency_id",
+)
+INSERT_TRANSACTION = statements.register(
+    "insert_transaction",
+    """
+    INSERT INTO exchange_transactions (
+        operator_id, currency_from_id, currency_to_id, amount, exchanged_amount, change_in_base,
+        amount_in_base, transaction_date
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """,
+)
+ADD_TURNOVER = statements.register(
+    "add_turnover",
+    lambda dialect: dialect.accumulate(
+        "daily_turnover",
+        ["turnover_date", "operator_id", "currency_from_id", "currency_to_id"],
+        ["volume", "exchanged_volume", "transactions_count", "base_equivalent", "change_paid"],
+    ),
+)
+# Столбцы транзакции для свёртки оборотов (aggregate_turnover)
+TURNOVER_SOURCE_COLUMNS = [
+    "transaction_date",
+    "operator_id",
+    "currency_from_id",
+    "currency_to_id",
+    "amount",
+    "exchanged_amount",
+    "change_in_base",
+    "amount_in_base",
+]
+ADD_CASH = statements.register(
+    "add_cash",
+    """
+    UPDATE cash_reserves
+    SET amount_in_cash = amount_in_cash + %s
+    WHERE currency_name = %s
+    """,
+)
+SET_ARCHIVED = statements.register(
+    "set_archived", "UPDATE cash_reserves SET is_archived = %s WHERE currency_id = %s"
+)
+
+
+def day_bounds(date_from, date_to):
+    """Границы периода из локальных дат [date_from, date_to] в виде параметров запроса."""
+    dialect = get_dialect()
+    tz = timezone.get_current_timezone()
+    period_start = period_end = None
+    if date_from:
+        period_start = dialect.datetime_param(datetime.combine(date_from, time.min, tz))
+    if date_to:
+        period_end = dialect.datetime_param(
+            datetime.combine(date_to + timedelta(days=1), time.min, tz)
+        )
+    return period_start, period_end
+
+
+def to_local_date(value):
+    """Локальная дата момента из БД; наивные значения хранятся в UTC."""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return timezone.localdate(value)
+
+
+@instrument_methods
 class CurrencyExchangeService:
-    def __init__(self):
-        self.api_url = "https://api.nbrb.by/exrates"
+    history_page_size = 50
+    export_chunk_size = 2000
 
     @staticmethod
     def apply_markup(rate, markup):
@@ -17,6 +151,13 @@ class CurrencyExchangeService:
             return (rate * (1 + Decimal(markup) / 100)).quantize(Decimal("1.000"))
         return rate
 
+    @staticmethod
+    def rate_from_api_entry(data):
+        """Курс к базовой валюте из ответа API с учётом масштаба."""
+        return Decimal(data["Cur_OfficialRate"] / data["Cur_Scale"]).quantize(
+            Decimal("1.000")
+        )
+
     @staticmethod
     def find_currency_id_by_name(currencies, currency_name):
         for currency in currencies:
@@ -25,46 +166,29 @@ class CurrencyExchangeService:
         return None
 
     def get_rate_from_api(self, currency_name):
-
-        # Получаем все доступные валюты
-        currencies_from_api = self.get_all_currencies_from_api()
-        current_date = datetime.now().date()
-
-        # Фильтруем валюты по актуальной дате
-        valid_currencies = [
-            cur
-            for cur in currencies_from_api
-            if datetime.strptime(cur.get("Cur_DateEnd"), "%Y-%m-%dT%H:%M:%S").date()
-               >= current_date
-        ]
-        currency_id_from_api = next(
-            (
-                cur["Cur_ID"]
-                for cur in valid_currencies
-                if cur.get("Cur_Name") == currency_name
-            ),
-            None,
+        # Ищем валюту в кэшированном справочнике среди действующих на сегодня
+        directory = self.get_currency_directory()
+        currency_id_from_api = (
+            directory.find_id_by_name(currency_name) if directory else None
         )
         if not currency_id_from_api:
             return None, "Такой валюты нет в API"
 
         # Запрашиваем курс конкретной валюты
-        response = requests.get(f"{self.api_url}/rates/{currency_id_from_api}")
-        if response.status_code == 200:
-            data = response.json()
-            rate_to_base = Decimal(
-                data["Cur_OfficialRate"] / data["Cur_Scale"]
-            ).quantize(Decimal("1.000"))
-            return rate_to_base, None
+        data = fetch_rate(currency_id_from_api)
+        if data:
+            return self.rate_from_api_entry(data), None
 
         return None, "Ошибка при запросе к API."
 
+    def get_currency_directory(self):
+        """Справочник валют Нацбанка из процессного кэша."""
+        return get_currency_directory()
+
     def get_all_currencies_from_api(self):
         """Получение списка валют из API"""
-        response = requests.get(f"{self.api_url}/currencies")
-        if response.status_code == 200:
-            return response.json()
-        return []
+        directory = self.get_currency_directory()
+        return directory.currencies if directory else []
 
     def get_currency_choices(self):
         """
@@ -73,70 +197,296 @@ class CurrencyExchangeService:
         - currency_choices: Полные названия валют.
         - short_currencies: Словарь аббревиатур и полных названий.
         """
-        currencies_from_api = self.get_all_currencies_from_api()
+        directory = self.get_currency_directory()
+        if directory is None:
+            return set(), {}
+        return directory.choices()
 
-        # Фильтруем валюты по Cur_DateEnd
-        today = timezone.now().date()
-        valid_currencies = [
-            cur
-            for cur in currencies_from_api
-            if datetime.strptime(cur["Cur_DateEnd"], "%Y-%m-%dT%H:%M:%S").date()
-               >= today
-        ]
+    async def aget_rate_from_api(self, currency_name):
+        """get_rate_from_api для асинхронных представлений: запрос в пуле HTTP-потоков."""
+        return await run_http(self.get_rate_from_api, currency_name)
+
+    async def aget_currency_choices(self):
+        """get_currency_choices для асинхронных представлений."""
+        return await run_http(self.get_currency_choices)
+
+    def import_rates_from_api(self, markup=None, rate_date=None):
+        """
+        Загрузка курсов всех активных валют кассы одним запросом к API
+        и одной пакетной вставкой. Курсы на даты, которые уже есть,
+        пропускаются - повторная загрузка за тот же день не дублирует их.
+        Возвращает список загруженных валют, список валют без курса в API
+        и текст ошибки.
+        """
+        rates_from_api = fetch_daily_rates(rate_date)
+        if rates_from_api is None:
+            return [], [], "Ошибка при запросе к API."
+        rates_by_name = {rate["Cur_Name"]: rate for rate in rates_from_api}
+
+        candidates, missing = [], []
+        for currency_id, currency_name, is_archived in self.get_currency_catalog():
+            if currency_id == BASE_CURRENCY_ID or is_archived:
+                continue
+            rate = rates_by_name.get(currency_name)
+            if rate is None:
+                missing.append(currency_name)
+                continue
+            candidates.append((currency_id, currency_name, rate))
+        if not candidates:
+            return [], missing, None
+
+        rate_dates = {
+            currency_id: date.fromisoformat(rate["Date"][:10])
+            for currency_id, _, rate in candidates
+        }
+        existing = self._existing_rate_dates(
+            list(rate_dates), min(rate_dates.values()), max(rate_dates.values())
+        )
+        rows, imported = [], []
+        for currency_id, currency_name, rate in candidates:
+            if (currency_id, rate_dates[currency_id]) in existing:
+                continue
+            rate_to_base = self.apply_markup(self.rate_from_api_entry(rate), markup)
+            rows.append((currency_id, rate_to_base, rate_dates[currency_id]))
+            imported.append(currency_name)
+
+        self.add_exchange_rates(rows)
+        return imported, missing, None
 
-        # Формируем выборки
-        currency_choices = {cur["Cur_Name"] for cur in valid_currencies}
-        short_currencies = {
-            cur["Cur_Abbreviation"]: cur["Cur_Name"] for cur in valid_currencies
+    def backfill_rates(
+            self, currency_ids, date_from, date_to, markup=None, window_days=365,
+            workers=4, batch_size=MAX_IN_LIST, job=None,
+    ):
+        """
+        Загрузка истории курсов валют за даты [date_from, date_to] из API Нацбанка.
+        Период делится на окна не длиннее window_days (API отдаёт не больше года
+        за запрос), окна запрашиваются параллельно в пуле из workers потоков,
+        вставка идёт в основном потоке пакетами по batch_size. Даты, курс на
+        которые уже есть, пропускаются - повторный запуск безопасен. С именем
+        задания job конец последнего полностью загруженного окна сохраняется
+        вместе с пакетом, и прерванная загрузка продолжается со следующего окна.
+        Возвращает число вставленных курсов, пропущенных дат, валюты без истории
+        в API и невыполненные запросы (currency_id, начало, конец).
+        """
+        directory = self.get_currency_directory()
+        if directory is None:
+            raise ValueError("Справочник валют API недоступен.")
+        position = get_checkpoint(job) if job else None
+        if position:
+            date_from = max(date_from, date.fromisoformat(position) + timedelta(days=1))
+
+        windows = []
+        start = date_from
+        while start <= date_to:
+            end = min(start + timedelta(days=window_days - 1), date_to)
+            windows.append((start, end))
+            start = end + timedelta(days=1)
+
+        names = {currency_id: name for currency_id, name, _ in self.get_currency_catalog()}
+        periods = {
+            currency_id: directory.periods(names.get(currency_id)) for currency_id in currency_ids
         }
+        # Запрос - окно валюты в пределах действия её записи справочника
+        tasks, remaining = [], [0] * len(windows)
+        for index, (start, end) in enumerate(windows):
+            for currency_id in currency_ids:
+                for api_id, scale, valid_from, valid_to in periods[currency_id]:
+                    if max(start, valid_from) <= min(end, valid_to):
+                        tasks.append(
+                            (index, currency_id, api_id, scale,
+                             max(start, valid_from), min(end, valid_to))
+                        )
+                        remaining[index] += 1
+        existing = self._existing_rate_dates(currency_ids, date_from, date_to)
 
-        return currency_choices, short_currencies
+        result = {
+            "inserted": 0,
+            "skipped": 0,
+            "missing": [currency_id for currency_id in currency_ids if not periods[currency_id]],
+            "failed": [],
+        }
+        buffer = []
+
+        def flush():
+            complete = 0
+            while complete < len(windows) and remaining[complete] == 0:
+                complete += 1
+            batches = chunks(buffer, batch_size) or [[]]
+            buffer.clear()
+            for number, batch in enumerate(batches, 1):
+                with transaction.atomic():
+                    self.add_exchange_rates(batch)
+                    # Строки всех завершённых окон уже в пакетах: позиция фиксируется с последним
+                    if job and complete and number == len(batches):
+                        with connection.cursor() as cursor:
+                            save_checkpoint(cursor, job, windows[complete - 1][1].isoformat())
+                result["inserted"] += len(batch)
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exchange-backfill")
+        try:
+            futures = {
+                executor.submit(fetch_rate_dynamics, api_id, start, end): (
+                    index, currency_id, scale, start, end
+                )
+                for index, currency_id, api_id, scale, start, end in tasks
+            }
+            for future in as_completed(futures):
+                index, currency_id, scale, start, end = futures[future]
+                data = future.result()
+                if data is None:
+                    result["failed"].append((currency_id, start, end))
+                    continue
+                for entry in data:
+                    rate_date = date.fromisoformat(entry["Date"][:10])
+                    if (currency_id, rate_date) in existing:
+                        result["skipped"] += 1
+                        continue
+                    existing.add((currency_id, rate_date))
+                    rate_to_base = self.rate_from_api_entry(
+                        {"Cur_OfficialRate": entry["Cur_OfficialRate"], "Cur_Scale": scale}
+                    )
+                    buffer.append((currency_id, self.apply_markup(rate_to_base, markup), rate_date))
+                remaining[index] -= 1
+                if len(buffer) >= batch_size:
+                    flush()
+            flush()
+        finally:
+            # При прерывании ещё не начатые запросы снимаются
+            executor.shutdown(cancel_futures=True)
+        if job and not result["failed"]:
+            clear_checkpoint(job)
+        return result
+
+    @staticmethod
+    def _existing_rate_dates(currency_ids, date_from, date_to):
+        """Пары (currency_id, дата), курс на которые уже есть."""
+        existing = set()
+        with connection.cursor() as cursor:
+            for chunk in chunks(currency_ids):
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(
+                    f"""
+                    SELECT currency_id, rate_date FROM exchange_rates
+                    WHERE currency_id IN ({placeholders}) AND rate_date >= %s AND rate_date <= %s
+                    """,
+                    [*chunk, date_from, date_to],
+                )
+                existing.update(
+                    # Oracle возвращает DATE как datetime
+                    (int(currency_id), rate_date.date() if isinstance(rate_date, datetime) else rate_date)
+                    for currency_id, rate_date in cursor.fetchall()
+                )
+        return existing
 
     @staticmethod
     def currency_exists(currency_name):
         """Проверка, существует ли валюта в базе."""
         with connection.cursor() as cursor:
-            cursor.execute(
-                "SELECT COUNT(1) FROM cash_reserves WHERE currency_name = %s",
-                [currency_name],
-            )
+            statements.execute(cursor, CURRENCY_EXISTS, [currency_name])
             return cursor.fetchone()[0] > 0
 
     def add_currency_to_cash(self, currency_name, amount_in_cash):
         """Добавление валюты в базу."""
-        if self.currency_exists(currency_name):
+        dialect = get_dialect()
+        if not dialect.supports_returning and self.currency_exists(currency_name):
             return False
-        with connection.cursor() as cursor:
-            cursor.execute(
-                """
-                INSERT INTO cash_reserves (currency_name, amount_in_cash)
-                VALUES (%s, %s)
-                """,
-                [currency_name, amount_in_cash],
-            )
+        with transaction.atomic(), connection.cursor() as cursor:
+            if dialect.supports_returning:
+                # Проверка существования и вставка за один запрос
+                cursor.execute(
+                    """
+                    INSERT INTO cash_reserves (currency_name, amount_in_cash)
+                    VALUES (%s, %s)
+                    ON CONFLICT (currency_name) DO NOTHING
+                    RETURNING currency_id
+                    """,
+                    [currency_name, amount_in_cash],
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    return False
+                currency_id = row[0]
+            else:
+                cursor.execute(
+                    """
+                    INSERT INTO cash_reserves (currency_name, amount_in_cash)
+                    VALUES (%s, %s)
+                    """,
+                    [currency_name, amount_in_cash],
+                )
+                statements.execute(cursor, CURRENCY_IDS_BY_NAME, [currency_name])
+                currency_id = cursor.fetchone()[0]
+            if amount_in_cash:
+                record_cash_movements(cursor, [(currency_id, amount_in_cash, OPENING)])
+            bump_data_version(cursor, CURRENCIES)
+            self._send_after_commit(currencies_changed, [currency_id])
         return True
 
-    @staticmethod
-    def add_exchange_rate(currency_id, rate_to_base, rate_date):
-        with connection.cursor() as cursor:
-            cursor.execute(
-                """
-                INSERT INTO exchange_rates (currency_id, rate_to_base, rate_date)
-                VALUES (%s, %s, TO_DATE(%s, 'YYYY-MM-DD'))
-                """,
-                [currency_id, rate_to_base, rate_date],
+    def add_exchange_rate(self, currency_id, rate_to_base, rate_date):
+        self.add_exchange_rates([(currency_id, rate_to_base, rate_date)])
+
+    def add_exchange_rates(self, rates):
+        """Пакетная вставка курсов (currency_id, rate_to_base, дата или 'YYYY-MM-DD')."""
+        if not rates:
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            statements.executemany(
+                cursor,
+                INSERT_RATE,
+                [
+                    [
+                        currency_id,
+                        rate_to_base,
+                        date.fromisoformat(rate_date) if isinstance(rate_date, str) else rate_date,
+                    ]
+                    for currency_id, rate_to_base, rate_date in rates
+                ],
             )
+            self.refresh_current_rates(cursor, {rate[0] for rate in rates})
+
+    @staticmethod
+    def refresh_current_rates(cursor, currency_ids):
+        """Пересчёт таблицы current_rates для изменившихся валют."""
+        if not currency_ids:
+            return
+        currency_ids = list(currency_ids)
+        placeholders = ", ".join(["%s"] * len(currency_ids))
+        cursor.execute(
+            f"DELETE FROM current_rates WHERE currency_id IN ({placeholders})",
+            currency_ids,
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO current_rates (currency_id, rate_id, rate_to_base, rate_date)
+            SELECT currency_id, rate_id, rate_to_base, rate_date
+            FROM (
+                SELECT currency_id, rate_id, rate_to_base, rate_date,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY currency_id ORDER BY rate_date DESC, rate_id DESC
+                       ) rn
+                FROM exchange_rates
+                WHERE currency_id IN ({placeholders})
+            ) latest
+            WHERE rn = 1
+            """,
+            currency_ids,
+        )
+        bump_data_version(cursor, RATES)
+        CurrencyExchangeService._send_after_commit(rates_changed, currency_ids)
+
+    @staticmethod
+    def _send_after_commit(signal, currency_ids):
+        """Сигнал об изменении валют уходит только после фиксации транзакции."""
+        currency_ids = sorted({int(currency_id) for currency_id in currency_ids})
+        transaction.on_commit(
+            lambda: signal.send(sender=CurrencyExchangeService, currency_ids=currency_ids)
+        )
 
     @staticmethod
     def get_rates():
+        """Действующий курс каждой неархивной валюты из current_rates."""
         with connection.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT rate_id, currency_name, rate_to_base, rate_date, amount_in_cash
-                FROM exchange_rates er
-                JOIN cash_reserves cr ON er.currency_id = cr.currency_id WHERE is_archived != 1
-            """
-            )
+            statements.execute(cursor, GET_RATES)
             rates = cursor.fetchall()
 
         # Формируем список словарей для удобства использования в шаблоне
@@ -147,66 +497,185 @@ class CurrencyExchangeService:
                 "rate_to_base": rate[2],
                 "rate_date": rate[3],
                 "amount_in_cash": rate[4],
+                "currency_id": rate[5],
             }
             for rate in rates
         ]
 
     @staticmethod
-    def get_currency():
+    def get_currency_states(currency_ids):
+        """
+        Остаток, признак архива и действующий курс указанных валют - для дельт,
+        рассылаемых открытым страницам. Удалённых валют в результате нет.
+        """
+        currency_ids = list(currency_ids)
+        if not currency_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(currency_ids))
         with connection.cursor() as cursor:
             cursor.execute(
-                "SELECT currency_id, currency_name, amount_in_cash, is_archived FROM cash_reserves"
+                f"""
+                SELECT cr.currency_id, cr.currency_name, cr.amount_in_cash, cr.is_archived,
+                r.rate_id, r.rate_to_base, r.rate_date
+                FROM cash_reserves cr
+                LEFT JOIN current_rates r ON r.currency_id = cr.currency_id
+                WHERE cr.currency_id IN ({placeholders})
+                """,
+                currency_ids,
             )
+            rows = cursor.fetchall()
+        return {
+            int(row[0]): {
+                "currency_id": int(row[0]),
+                "currency_name": row[1],
+                "amount_in_cash": row[2],
+                "is_archived": bool(row[3]),
+                "rate_id": row[4],
+                "rate_to_base": row[5],
+                "rate_date": row[6],
+            }
+            for row in rows
+        }
+
+    @staticmethod
+    def get_rate_history(currency_id, date_from, date_to, interval="day"):
+        """
+        История курса валюты за даты [date_from, date_to], прореженная по дням,
+        неделям или месяцам: на интервал - последний курс, минимум, максимум
+        и число записей.
+        """
+        bucket = get_dialect().truncate_date("rate_date", interval)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT bucket, rate_to_base, low, high, points
+                FROM (
+                    SELECT {bucket} bucket, rate_to_base,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY {bucket} ORDER BY rate_date DESC, rate_id DESC
+                    ) rn,
+                    MIN(rate_to_base) OVER (PARTITION BY {bucket}) low,
+                    MAX(rate_to_base) OVER (PARTITION BY {bucket}) high,
+                    COUNT(1) OVER (PARTITION BY {bucket}) points
+                    FROM exchange_rates
+                    WHERE currency_id = %s AND rate_date >= %s AND rate_date <= %s
+                ) buckets
+                WHERE rn = 1
+                ORDER BY bucket
+                """,
+                [currency_id, date_from, date_to],
+            )
+            rows = cursor.fetchall()
+        return [
+            {
+                # Начало интервала: строка в SQLite, DATE в Oracle и PostgreSQL
+                "date": (
+                    date.fromisoformat(row[0]) if isinstance(row[0], str)
+                    else row[0].date() if isinstance(row[0], datetime)
+                    else row[0]
+                ),
+                "rate": row[1],
+                # Агрегаты SQLite теряют тип столбца и приходят числами
+                "low": Decimal(str(row[2])),
+                "high": Decimal(str(row[3])),
+                "count": int(row[4]),
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def get_currency():
+        with connection.cursor() as cursor:
+            statements.execute(cursor, GET_CURRENCIES)
             return cursor.fetchall()
 
     @staticmethod
-    def get_exchange_rate(cursor, currency_id):
+    def load_currency_catalog():
+        with connection.cursor() as cursor:
+            statements.execute(cursor, GET_CURRENCY_CATALOG)
+            return [
+                (int(currency_id), currency_name, bool(is_archived))
+                for currency_id, currency_name, is_archived in cursor.fetchall()
+            ]
+
+    def get_currency_catalog(self):
+        """
+        Справочник валют (currency_id, currency_name, is_archived) из процессного кэша.
+        Кэш сбрасывается по счётчику версии, который увеличивают изменения валют.
+        """
+        return currency_catalog.get()
+
+    def get_versioned_currency_catalog(self):
+        """(версия, справочник валют): версия - ключ кэша списков выбора в шаблонах."""
+        return currency_catalog.get_versioned()
+
+    def get_currency_name(self, currency_id):
+        for catalog_id, currency_name, _ in self.get_currency_catalog():
+            if catalog_id == int(currency_id):
+                return currency_name
+        return None
+
+    @staticmethod
+    def load_exchange_snapshot(cursor, currency_ids, for_update=False):
+        """
+        Курсы, остатки в кассе и названия всех валют обмена одним запросом.
+        При for_update строки кассы блокируются до конца транзакции.
+        Возвращает словарь currency_id -> данные валюты.
+        """
+        currency_ids = sorted(set(currency_ids) | {BASE_CURRENCY_ID})
+        placeholders = ", ".join(["%s"] * len(currency_ids))
         cursor.execute(
-            """
-            SELECT rate_to_base
-            FROM exchange_rates
-            WHERE currency_id = %s
-            ORDER BY rate_date DESC
-            FETCH FIRST 1 ROW ONLY
-        """,
-            [currency_id],
+            f"""
+            SELECT cr.currency_id, cr.currency_name, cr.amount_in_cash, cur.rate_to_base
+            FROM cash_reserves cr
+            LEFT JOIN current_rates cur ON cur.currency_id = cr.currency_id
+            WHERE cr.currency_id IN ({placeholders})
+            {get_dialect().lock_rows("cr", "amount_in_cash") if for_update else ""}
+            """,
+            currency_ids,
         )
-        return cursor.fetchone()
+        snapshot = {
+            int(row[0]): {
+                "currency_name": row[1],
+                "amount_in_cash": row[2],
+                "rate_to_base": row[3],
+            }
+            for row in cursor.fetchall()
+        }
+        if BASE_CURRENCY_ID in snapshot:
+            snapshot[BASE_CURRENCY_ID]["rate_to_base"] = Decimal(1)
+        return snapshot
 
     @staticmethod
-    def get_currency_name(currency_id):
-        with connection.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT currency_name
-                FROM cash_reserves
-                WHERE currency_id = %s
-                FETCH FIRST 1 ROW ONLY
-            """,
-                [currency_id],
-            )
-            return cursor.fetchone()[0]
+    def apply_to_snapshot(
+            snapshot, currency_from_id, currency_to_id, amount, exchanged_amount, change_in_base
+    ):
+        """Отражение транзакции в остатках снимка (как это делает триггер)."""
+        snapshot[currency_from_id]["amount_in_cash"] += amount
+        snapshot[currency_to_id]["amount_in_cash"] -= exchanged_amount
+        snapshot[BASE_CURRENCY_ID]["amount_in_cash"] -= change_in_base
 
+    @staticmethod
     def calculate_exchange(
-            self, cursor, currency_from_id, currency_to_id, amount, amount_to_get
+            snapshot, currency_from_id, currency_to_id, amount, amount_to_get
     ):
         """
-        Расчёт обмена валют через базовую валюту.
+        Расчёт обмена валют через базовую валюту по снимку курсов и кассы.
         """
+        if currency_from_id not in snapshot or currency_to_id not in snapshot:
+            return None, None, "Валюта не найдена."
+
         # Получение курсов валют относительно базовой валюты
-        rate_from = (
-            1 if currency_from_id == "1" else self.get_exchange_rate(cursor, currency_from_id)[0]
-        )
-        rate_to = (
-            1 if currency_to_id == "1" else self.get_exchange_rate(cursor, currency_to_id)[0]
-        )
+        rate_from = snapshot[currency_from_id]["rate_to_base"]
+        rate_to = snapshot[currency_to_id]["rate_to_base"]
 
         if not rate_from or not rate_to:
             return None, None, "Курс обмена не найден."
 
         # Получение доступных средств в кассе
-        available_cash = self.get_currency_cash(cursor, currency_to_id)
-        base_currency_cash = self.get_currency_cash(cursor, "1")  # Доступно в базовой валюте
+        available_cash = snapshot[currency_to_id]["amount_in_cash"]
+        currency_to_name = snapshot[currency_to_id]["currency_name"]
+        base_currency_cash = snapshot[BASE_CURRENCY_ID]["amount_in_cash"]
 
         # Расчёт суммы в базовой валюте
         amount_in_base = amount * rate_from
@@ -220,7 +689,7 @@ class CurrencyExchangeService:
                 return (
                     None,
                     None,
-                    f"Недостаточно средств в кассе для обмена на {self.get_currency_name(currency_to_id)}. "
+                    f"Недостаточно средств в кассе для обмена на {currency_to_name}. "
                     f"Запрашиваемая сумма: {amount_to_get}, доступно: {available_cash}.",
                 )
             elif amount_to_get > max_possible_amount:
@@ -234,7 +703,7 @@ class CurrencyExchangeService:
             change_in_base = amount_in_base - exchanged_amount * rate_to
 
             # Если сдача имеется, проверяем и возвращаем её
-            if currency_to_id == "1":  # Продаётся в базовую валюту
+            if currency_to_id == BASE_CURRENCY_ID:  # Продаётся в базовую валюту
                 exchanged_amount += int(change_in_base)  # Сдача прибавляется
                 change_in_base = 0  # Сдача вся выдана в базовой валюте
 
@@ -245,10 +714,10 @@ class CurrencyExchangeService:
                 return (
                     None,
                     None,
-                    f"Недостаточно средств в кассе для обмена на {self.get_currency_name(currency_to_id)}. "
+                    f"Недостаточно средств в кассе для обмена на {currency_to_name}. "
                     f"Доступно: {available_cash}.",
                 )
-            if currency_to_id != "1":
+            if currency_to_id != BASE_CURRENCY_ID:
                 change_in_base = amount_in_base - exchanged_amount * rate_to
 
         # Проверка достаточности базовой валюты для сдачи
@@ -261,14 +730,14 @@ class CurrencyExchangeService:
             )
 
         # Если покупаем базовую валюту, сдача отсутствует
-        if currency_to_id == "1":
+        if currency_to_id == BASE_CURRENCY_ID:
             exchanged_amount += int(change_in_base)
             change_in_base = 0
 
         return exchanged_amount, change_in_base, None
 
-    @staticmethod
     def record_transaction(
+            self,
             cursor,
             operator_id,
             currency_from_id,
@@ -276,224 +745,746 @@ class CurrencyExchangeService:
             amount,
             exchanged_amount,
             change_in_base,
+            amount_in_base=None,
     ):
         """Запись транзакции в базу данных."""
-
-        cursor.execute(
-            """
-            INSERT INTO exchange_transactions (
-                operator_id, currency_from_id, currency_to_id, amount, exchanged_amount, change_in_base, transaction_date
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """,
+        self.record_transactions(
+            cursor,
             [
+                (
+                    operator_id,
+                    currency_from_id,
+                    currency_to_id,
+                    amount,
+                    exchanged_amount,
+                    change_in_base,
+                    amount_in_base,
+                )
+            ],
+        )
+
+    def record_transactions(self, cursor, transactions):
+        """
+        Пакетная запись транзакций: (operator_id, currency_from_id, currency_to_id,
+        amount, exchanged_amount, change_in_base, amount_in_base).
+        Дневные обороты обновляются в той же транзакции.
+        """
+        transaction_date = get_dialect().datetime_param(timezone.now())
+        statements.executemany(
+            cursor, INSERT_TRANSACTION, [[*row, transaction_date] for row in transactions]
+        )
+        # Остатки кассы меняет триггер: исходная, целевая и базовая валюты
+        bump_data_version(cursor, CASH)
+        self._send_after_commit(
+            cash_changed,
+            {BASE_CURRENCY_ID, *(row[1] for row in transactions), *(row[2] for row in transactions)},
+        )
+        self.add_turnover(
+            cursor,
+            self.aggregate_turnover([(transaction_date, *row) for row in transactions]),
+        )
+
+    @staticmethod
+    def aggregate_turnover(transactions):
+        """
+        Свёртка транзакций (transaction_date, operator_id, currency_from_id, currency_to_id,
+        amount, exchanged_amount, change_in_base, amount_in_base) по дню, оператору и паре.
+        """
+        turnover = {}
+        for (
+                transaction_date,
                 operator_id,
                 currency_from_id,
                 currency_to_id,
                 amount,
                 exchanged_amount,
                 change_in_base,
-                timezone.now()
-            ],
+                amount_in_base,
+        ) in transactions:
+            key = (
+                to_local_date(transaction_date),
+                int(operator_id),
+                int(currency_from_id),
+                int(currency_to_id),
+            )
+            totals = turnover.setdefault(key, [0, 0, 0, 0, 0])
+            totals[0] += amount
+            totals[1] += exchanged_amount
+            totals[2] += 1
+            totals[3] += amount_in_base or 0
+            totals[4] += change_in_base
+        return turnover
+
+    @staticmethod
+    def add_turnover(cursor, turnover):
+        """Прибавление свёрнутых оборотов к таблице daily_turnover."""
+        if not turnover:
+            return
+        statements.executemany(
+            cursor, ADD_TURNOVER, [[*key, *totals] for key, totals in turnover.items()]
         )
 
-    def exchange_currency_with_transaction(
-            self, operator_id, currency_from_id, currency_to_id, amount, amount_to_get
-    ):
+    def subtract_turnover(self, cursor, transactions):
         """
-        Логика обмена валют через базовую валюту.
+        Вычитание оборотов удаляемых транзакций (строки как у aggregate_turnover)
+        из daily_turnover: остальные транзакции их дней не перечитываются.
+        Строки оборотов, в которых не осталось транзакций, удаляются.
         """
-        with transaction.atomic():
-            try:
-                # Открываем курсор
-                cursor = connection.cursor()
-                # Начало транзакции
-                # Если валюта для обмена или покупки не базовая
-                if currency_from_id != "1" and currency_to_id != "1":
-                    # Шаг 1: Обмен валюты 1 в базовую валюту
-                    exchanged_amount_base, change_in_base_base, error = self.calculate_exchange(
-                        cursor, currency_from_id, "1", amount, None
-                    )
-                    if error:
-                        raise ValueError(error)
+        turnover = self.aggregate_turnover(transactions)
+        if not turnover:
+            return
+        self.add_turnover(
+            cursor, {key: [-value for value in totals] for key, totals in turnover.items()}
+        )
+        dates = [key[0] for key in turnover]
+        cursor.execute(
+            "DELETE FROM daily_turnover "
+            "WHERE turnover_date >= %s AND turnover_date <= %s AND transactions_count <= 0",
+            [min(dates), max(dates)],
+        )
 
-                    # Проверка сдачи и кассы базовой валюты
-                    if change_in_base_base > self.get_currency_cash(cursor, "1"):
-                        raise ValueError("Недостаточно базовой валюты для выдачи сдачи.")
+    @staticmethod
+    def live_turnover_periods(date_from, date_to):
+        """
+        Части периода [date_from, date_to] без дней архивных месяцев: их транзакций
+        в таблице уже нет. Месяц архива считается по UTC, поэтому пропускаются
+        и пограничные локальные дни, частично попавшие в него.
+        """
+        archived = []
+        for month in get_archive().months():
+            start, end = month_bounds(month)
+            archived.append((to_local_date(start), to_local_date(end - timedelta(microseconds=1))))
+        periods, day = [], date_from
+        for first, last in sorted(archived):
+            if last < day or first > date_to:
+                continue
+            if first > day:
+                periods.append((day, first - timedelta(days=1)))
+            day = max(day, last + timedelta(days=1))
+        if day <= date_to:
+            periods.append((day, date_to))
+        return periods
 
-                    # Запись транзакции: валюты 1 -> базовая валюта
-                    self.record_transaction(
-                        cursor,
-                        operator_id,
-                        currency_from_id,
-                        "1",
-                        amount,
-                        exchanged_amount_base,
-                        change_in_base_base,
-                    )
+    def rebuild_turnover(self, date_from, date_to):
+        """
+        Пересчёт дневных оборотов за период [date_from, date_to] по транзакциям.
+        Обороты архивных месяцев не трогаются - пересчёт обнулил бы их.
+        Возвращает количество учтённых транзакций.
+        """
+        count = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            for period_from, period_to in self.live_turnover_periods(date_from, date_to):
+                count += self._rebuild_turnover_period(cursor, period_from, period_to)
+        return count
 
-                    # Шаг 2: Обмен базовой валюты в валюту 2
-                    exchanged_amount_target, change_in_base, error = self.calculate_exchange(
-                        cursor, "1", currency_to_id, exchanged_amount_base, amount_to_get
-                    )
-                    if error:
-                        raise ValueError(error)
+    def _rebuild_turnover_period(self, cursor, date_from, date_to):
+        period_start, period_end = day_bounds(date_from, date_to)
+        cursor.execute(
+            "DELETE FROM daily_turnover WHERE turnover_date >= %s AND turnover_date <= %s",
+            [date_from, date_to],
+        )
+        cursor.execute(
+            """
+            SELECT transaction_date, operator_id, currency_from_id, currency_to_id,
+                   amount, exchanged_amount, change_in_base, amount_in_base
+            FROM exchange_transactions
+            WHERE transaction_date >= %s AND transaction_date < %s
+            """,
+            [period_start, period_end],
+        )
+        turnover, count = {}, 0
+        while rows := cursor.fetchmany(2000):
+            count += len(rows)
+            for key, totals in self.aggregate_turnover(rows).items():
+                current = turnover.setdefault(key, [0, 0, 0, 0, 0])
+                for index, value in enumerate(totals):
+                    current[index] += value
+        self.add_turnover(cursor, turnover)
+        return count
 
-                    # Запись транзакции: базовая валюта -> валюта 2
-                    self.record_transaction(
-                        cursor,
-                        operator_id,
-                        "1",
-                        currency_to_id,
-                        exchanged_amount_base,
-                        exchanged_amount_target,
-                        change_in_base,
-                    )
+    @staticmethod
+    def get_turnover(date_from, date_to):
+        """Отчёт по дневным оборотам за период, только из таблицы daily_turnover."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT d.turnover_date, u.username, cr_from.currency_name, cr_to.currency_name,
+                       d.volume, d.exchanged_volume, d.transactions_count,
+                       d.base_equivalent, d.change_paid
+                FROM daily_turnover d
+                JOIN cash_reserves cr_from ON d.currency_from_id = cr_from.currency_id
+                JOIN cash_reserves cr_to ON d.currency_to_id = cr_to.currency_id
+                JOIN auth_user u ON d.operator_id = u.id
+                WHERE d.turnover_date >= %s AND d.turnover_date <= %s
+                ORDER BY d.turnover_date DESC, u.username, cr_from.currency_name, cr_to.currency_name
+                """,
+                [date_from, date_to],
+            )
+            return [
+                {
+                    "turnover_date": row[0],
+                    "username": row[1],
+                    "currency_from_name": row[2],
+                    "currency_to_name": row[3],
+                    "volume": row[4],
+                    "exchanged_volume": row[5],
+                    "transactions_count": row[6],
+                    "base_equivalent": row[7],
+                    "change_paid": row[8],
+                }
+                for row in cursor.fetchall()
+            ]
 
-                # Если одна из валют базовая
-                else:
-                    # Обмен валют
-                    exchanged_amount_target, change_in_base, error = self.calculate_exchange(
-                        cursor, currency_from_id, currency_to_id, amount, amount_to_get
-                    )
-                    if error:
-                        raise ValueError(error)
+    def exchange_currency_with_transaction(
+            self, operator_id, currency_from_id, currency_to_id, amount, amount_to_get
+    ):
+        """
+        Логика обмена валют через базовую валюту.
+        Курсы и остатки читаются одним запросом с блокировкой строк кассы,
+        расчёт ведётся в памяти.
+        Кросс-обмен считается по кросс-курсу и записывается одной транзакцией,
+        подразумеваемая нога в базовой валюте хранится в amount_in_base.
+        """
+        currency_from_id, currency_to_id = int(currency_from_id), int(currency_to_id)
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Строки кассы блокируются: параллельный обмен не пройдёт проверку
+                # остатков по тем же, ещё не уменьшенным суммам
+                snapshot = self.load_exchange_snapshot(
+                    cursor, [currency_from_id, currency_to_id], for_update=True
+                )
+                exchanged_amount, change_in_base, error = self.calculate_exchange(
+                    snapshot, currency_from_id, currency_to_id, amount, amount_to_get
+                )
+                if error:
+                    raise ValueError(error)
 
-                    # Проверка сдачи и кассы базовой валюты
-                    if change_in_base > self.get_currency_cash(cursor, "1"):
-                        raise ValueError("Недостаточно базовой валюты для выдачи сдачи.")
+                self.record_transaction(
+                    cursor,
+                    operator_id,
+                    currency_from_id,
+                    currency_to_id,
+                    amount,
+                    exchanged_amount,
+                    change_in_base,
+                    self.amount_in_base(snapshot, currency_from_id, amount),
+                )
+            return exchanged_amount, change_in_base, None
+
+        except (ValueError, DatabaseError) as e:
+            # Транзакция откатывается при выходе из atomic
+            return None, None, str(e)
 
-                    # Запись транзакции
-                    self.record_transaction(
-                        cursor,
+    def exchange_batch(self, operator_id, orders):
+        """
+        Пакетный обмен: все заказы проверяются по одному снимку курсов и кассы,
+        строки кассы блокируются один раз, транзакции пишутся одной вставкой.
+        orders - список словарей currency_from, currency_to, amount, amount_to_get.
+        Возвращает результат по каждому заказу.
+        """
+        currency_ids = {
+            int(order[key]) for order in orders for key in ("currency_from", "currency_to")
+        }
+        results, rows = [], []
+        with transaction.atomic(), connection.cursor() as cursor:
+            snapshot = self.load_exchange_snapshot(cursor, currency_ids, for_update=True)
+            for order in orders:
+                currency_from_id = int(order["currency_from"])
+                currency_to_id = int(order["currency_to"])
+                amount = order["amount"]
+                exchanged_amount, change_in_base, error = self.calculate_exchange(
+                    snapshot, currency_from_id, currency_to_id, amount, order.get("amount_to_get")
+                )
+                if error:
+                    results.append({"ok": False, "error": error})
+                    continue
+                self.apply_to_snapshot(
+                    snapshot, currency_from_id, currency_to_id, amount, exchanged_amount, change_in_base
+                )
+                rows.append(
+                    (
                         operator_id,
                         currency_from_id,
                         currency_to_id,
                         amount,
-                        exchanged_amount_target,
+                        exchanged_amount,
                         change_in_base,
+                        self.amount_in_base(snapshot, currency_from_id, amount),
                     )
+                )
+                results.append(
+                    {
+                        "ok": True,
+                        "exchanged_amount": exchanged_amount,
+                        "change_in_base": change_in_base,
+                    }
+                )
+            if rows:
+                self.record_transactions(cursor, rows)
+        return results
 
-                # Фиксация транзакции
-                cursor.execute("COMMIT")
-                return exchanged_amount_target, change_in_base, None
-
-            except Exception as e:
-                # Откат транзакции в случае ошибки
-                cursor.execute("ROLLBACK")
-                return None, None, str(e)
+    @staticmethod
+    def amount_in_base(snapshot, currency_from_id, amount):
+        """Сумма продаваемой валюты в базовой валюте."""
+        return (amount * snapshot[currency_from_id]["rate_to_base"]).quantize(
+            Decimal("0.01")
+        )
 
-            finally:
-                # Закрытие курсора
-                cursor.close()
+    def update_currency_cash(self, amount_in_cash, currency_name):
+        with transaction.atomic(), connection.cursor() as cursor:
+            statements.execute(cursor, ADD_CASH, [amount_in_cash, currency_name])
+            bump_data_version(cursor, CASH)
+            statements.execute(cursor, CURRENCY_IDS_BY_NAME, [currency_name])
+            currency_ids = [row[0] for row in cursor.fetchall()]
+            record_cash_movements(
+                cursor, [(currency_id, amount_in_cash, TOPUP) for currency_id in currency_ids]
+            )
+            self._send_after_commit(cash_changed, currency_ids)
 
     @staticmethod
-    def get_currency_cash(cursor, currency_id):
-        cursor.execute(
-            "SELECT amount_in_cash FROM cash_reserves WHERE currency_id = %s",
-            [currency_id],
-        )
-        return cursor.fetchone()[0]
+    def encode_history_cursor(direction, transaction_date, transaction_id):
+        """Курсор страницы истории: направление и ключ (дата, id) граничной строки."""
+        raw = f"{direction}|{transaction_date.isoformat()}|{transaction_id}"
+        return urlsafe_b64encode(raw.encode()).decode()
 
     @staticmethod
-    def update_currency_cash(amount_in_cash, currency_name):
+    def decode_history_cursor(cursor_value):
+        try:
+            direction, transaction_date, transaction_id = (
+                urlsafe_b64decode(cursor_value.encode()).decode().split("|")
+            )
+            transaction_date = datetime.fromisoformat(transaction_date)
+            if direction not in ("next", "prev") or transaction_date.tzinfo is None:
+                return None
+            return direction, transaction_date, int(transaction_id)
+        except (ValueError, UnicodeError):
+            return None
+
+    def get_transactions(self, user_id=None, cursor_value=None, page_size=None):
+        """
+        Страница истории обменов с keyset-пагинацией по (transaction_date, transaction_id).
+        Возвращает список транзакций и курсоры соседних страниц.
+        """
+        page_size = page_size or self.history_page_size
+        position = self.decode_history_cursor(cursor_value) if cursor_value else None
+        direction = position[0] if position else "next"
+
+        conditions, params = [], []
+        if user_id:
+            conditions.append("t.operator_id = %s")
+            params.append(user_id)
+        if position:
+            _, transaction_date, transaction_id = position
+            transaction_date = get_dialect().datetime_param(transaction_date)
+            op = "<" if direction == "next" else ">"
+            conditions.append(
+                f"(t.transaction_date {op} %s "
+                f"OR (t.transaction_date = %s AND t.transaction_id {op} %s))"
+            )
+            params += [transaction_date, transaction_date, transaction_id]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "DESC" if direction == "next" else "ASC"
+
         with connection.cursor() as cursor:
             cursor.execute(
-                """
-                UPDATE cash_reserves
-                SET amount_in_cash = amount_in_cash + %s
-                WHERE currency_name = %s
-            """,
-                [amount_in_cash, currency_name],
+                f"""
+                SELECT  transaction_id, transaction_date, cr_from.currency_name  currency_from_name,
+                cr_to.currency_name currency_to_name, amount, exchanged_amount, change_in_base, username,
+                t.currency_from_id, t.currency_to_id, t.amount_in_base
+                FROM exchange_transactions t
+                JOIN
+                    cash_reserves cr_from ON t.currency_from_id = cr_from.currency_id
+                JOIN
+                    cash_reserves cr_to ON t.currency_to_id = cr_to.currency_id
+                JOIN
+                    auth_user u ON t.operator_id = u.id
+                {where}
+                ORDER BY t.transaction_date {order}, t.transaction_id {order}
+                {get_dialect().limit(page_size + 1)}
+                """,
+                params,
             )
+            rows = cursor.fetchall()
 
-    @staticmethod
-    def get_transactions(user_id=None):
-        with connection.cursor() as cursor:
-            if user_id:
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if direction == "prev":
+            rows.reverse()
+
+        transactions = [
+            {
+                "transaction_id": t[0],
+                "transaction_date": t[1],
+                "currency_from_name": t[2],
+                "currency_to_name": t[3],
+                "amount": t[4],
+                "exchanged_amount": t[5],
+                "change_in_base": t[6],
+                "username": t[7] if not user_id else None,
+                # Подразумеваемая нога в базовой валюте для кросс-обмена
+                "amount_in_base": (
+                    t[10] if BASE_CURRENCY_ID not in (t[8], t[9]) else None
+                ),
+            }
+            for t in rows
+        ]
+
+        next_cursor = prev_cursor = None
+        if rows:
+            first, last = rows[0], rows[-1]
+            if direction == "prev" or has_more:
+                next_cursor = self.encode_history_cursor("next", last[1], last[0])
+            if (direction == "next" and position) or (direction == "prev" and has_more):
+                prev_cursor = self.encode_history_cursor("prev", first[1], first[0])
+        return {
+            "transactions": transactions,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+        }
+
+    def iter_transactions_for_export(
+            self, operator_id=None, date_from=None, date_to=None, chunk_size=None
+    ):
+        """
+        Выгрузка истории обменов за даты [date_from, date_to] для отчётности.
+        Строки читаются через серверный курсор и отдаются порциями (списками)
+        по chunk_size, поэтому память не зависит от размера выборки.
+        Все порции нужно читать в одном потоке - в соединении курсора.
+        """
+        chunk_size = chunk_size or self.export_chunk_size
+        period_start, period_end = day_bounds(date_from, date_to)
+        conditions, params = [], []
+        if operator_id:
+            conditions.append("t.operator_id = %s")
+            params.append(operator_id)
+        if period_start:
+            conditions.append("t.transaction_date >= %s")
+            params.append(period_start)
+        if period_end:
+            conditions.append("t.transaction_date < %s")
+            params.append(period_end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with transaction.atomic():
+            cursor = connection.chunked_cursor()
+            try:
                 cursor.execute(
-                    """
-                    SELECT  transaction_id, transaction_date, cr_from.currency_name  currency_from_name,
-                    cr_to.currency_name currency_to_name, amount, exchanged_amount, change_in_base
+                    f"""
+                    SELECT t.transaction_id, t.transaction_date, u.username,
+                    cr_from.currency_name, cr_to.currency_name,
+                    t.amount, t.exchanged_amount, t.change_in_base, t.amount_in_base
                     FROM exchange_transactions t
-                    JOIN 
-                        cash_reserves cr_from ON t.currency_from_id = cr_from.currency_id
-                    JOIN
-                        cash_reserves cr_to ON t.currency_to_id = cr_to.currency_id
-                    WHERE operator_id = %s
-                    ORDER BY transaction_date DESC
+                    JOIN cash_reserves cr_from ON t.currency_from_id = cr_from.currency_id
+                    JOIN cash_reserves cr_to ON t.currency_to_id = cr_to.currency_id
+                    JOIN auth_user u ON t.operator_id = u.id
+                    {where}
+                    ORDER BY t.transaction_date, t.transaction_id
                     """,
-                    [user_id],
+                    params,
                 )
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cursor.close()
 
-            else:
+    @staticmethod
+    def get_archived_months():
+        return get_archive().months()
+
+    def get_archived_transactions(self, month, user_id=None, page=1, page_size=None):
+        """Страница транзакций архивного месяца, читается из файла архива."""
+        page_size = page_size or self.history_page_size
+        rows = list(
+            get_archive().read(month, user_id, (page - 1) * page_size, page_size + 1)
+        )
+        for row in rows:
+            row["username"] = row["username"] if not user_id else None
+            if BASE_CURRENCY_ID in (row["currency_from_id"], row["currency_to_id"]):
+                row["amount_in_base"] = None
+        return {
+            "transactions": rows[:page_size],
+            "page": page,
+            "has_next": len(rows) > page_size,
+        }
+
+    @staticmethod
+    def archive_transactions_month(month, chunk_size=2000):
+        """
+        Перенос транзакций закрытого месяца (UTC) в сжатый файл архива: строки
+        читаются серверным курсором и сливаются с уже заархивированными, затем
+        из таблицы удаляются ровно перенесённые строки - секцией целиком, если
+        в ней нет других. Строки, записанные после чтения, остаются в таблице
+        до следующей архивации. Обороты по дням остаются в daily_turnover.
+        Возвращает число перенесённых строк.
+        """
+        if month >= month_start(timezone.now()):
+            raise ValueError(f"Месяц {month:%Y-%m} ещё не закрыт.")
+        dialect = get_dialect()
+        start, end = month_bounds(month)
+        archived_ids = []
+
+        def track(rows):
+            for row in rows:
+                archived_ids.append(row[0])
+                yield row
+
+        with transaction.atomic():
+            cursor = connection.chunked_cursor()
+            try:
                 cursor.execute(
                     """
-                    SELECT  transaction_id, transaction_date, cr_from.currency_name  currency_from_name,
-                    cr_to.currency_name currency_to_name, amount, exchanged_amount, change_in_base, username
+                    SELECT t.transaction_id, t.transaction_date, t.operator_id, u.username,
+                    t.currency_from_id, cr_from.currency_name, t.currency_to_id, cr_to.currency_name,
+                    t.amount, t.exchanged_amount, t.change_in_base, t.amount_in_base
                     FROM exchange_transactions t
-                    JOIN 
-                        cash_reserves cr_from ON t.currency_from_id = cr_from.currency_id
-                    JOIN
-                        cash_reserves cr_to ON t.currency_to_id = cr_to.currency_id 
-                    JOIN 
-                        auth_user u ON t.operator_id = u.id 
-                    ORDER BY transaction_date DESC """
+                    JOIN cash_reserves cr_from ON t.currency_from_id = cr_from.currency_id
+                    JOIN cash_reserves cr_to ON t.currency_to_id = cr_to.currency_id
+                    JOIN auth_user u ON t.operator_id = u.id
+                    WHERE t.transaction_date >= %s AND t.transaction_date < %s
+                    ORDER BY t.transaction_date DESC, t.transaction_id DESC
+                    """,
+                    [dialect.datetime_param(start), dialect.datetime_param(end)],
                 )
-            return [
-                {
-                    "transaction_id": t[0],
-                    "transaction_date": t[1],
-                    "currency_from_name": t[2],
-                    "currency_to_name": t[3],
-                    "amount": t[4],
-                    "exchanged_amount": t[5],
-                    "change_in_base": t[6],
-                    "username": t[7] if not user_id else None,
-                }
-                for t in cursor.fetchall()
-            ]
+                get_archive().write(
+                    month,
+                    track(
+                        itertools.chain.from_iterable(
+                            iter(lambda: cursor.fetchmany(chunk_size), [])
+                        )
+                    ),
+                )
+            finally:
+                cursor.close()
+            with connection.cursor() as cursor:
+                if not drop_month(cursor, dialect, month, len(archived_ids)):
+                    for chunk in chunks(archived_ids):
+                        placeholders = ", ".join(["%s"] * len(chunk))
+                        cursor.execute(
+                            "DELETE FROM exchange_transactions "
+                            f"WHERE transaction_id IN ({placeholders})",
+                            chunk,
+                        )
+        return len(archived_ids)
 
-    @staticmethod
-    def delete_currencies(currency_id):
-        with connection.cursor() as cursor:
-            # Преобразуем список валют в строку, пригодную для SQL-запроса
-            cursor.execute(
-                f"DELETE FROM cash_reserves WHERE currency_id = %s",
-                [currency_id],
-            )
+    def archive_transactions_before(self, first_live_month):
+        """
+        Архивация всех месяцев раньше first_live_month, по одному: (месяц, число строк).
+        Текущий месяц открыт для записи и не архивируется никогда.
+        """
+        first_live_month = min(first_live_month, month_start(timezone.now()))
+        month = self.get_oldest_transaction_month()
+        while month is not None and month < first_live_month:
+            yield month, self.archive_transactions_month(month)
+            month = add_months(month, 1)
 
     @staticmethod
-    def delete_rates(rates_ids):
-        with connection.cursor() as cursor:
-            # Преобразуем список валют в строку, пригодную для SQL-запроса
-            placeholders = ", ".join(["%s"] * len(rates_ids))
-            cursor.execute(
-                f"DELETE FROM exchange_rates WHERE rate_id IN ({placeholders})",
-                rates_ids,
+    def ensure_transaction_partitions(months_ahead=3):
+        """Секции транзакций текущего и следующих месяцев (где их создают заранее)."""
+        current_month = month_start(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            ensure_month_partitions(
+                cursor, get_dialect(), current_month, add_months(current_month, months_ahead)
             )
 
     @staticmethod
-    def delete_exchange_transactions(transactions_ids):
+    def get_oldest_transaction_month():
+        dialect = get_dialect()
         with connection.cursor() as cursor:
-            # Преобразуем список валют в строку, пригодную для SQL-запроса
-            placeholders = ", ".join(["%s"] * len(transactions_ids))
             cursor.execute(
-                f"DELETE FROM exchange_transactions WHERE transaction_id IN ({placeholders})",
-                transactions_ids,
+                "SELECT transaction_date FROM exchange_transactions "
+                f"ORDER BY transaction_date {dialect.limit(1)}"
             )
+            row = cursor.fetchone()
+        return month_start(row[0]) if row else None
 
-    @staticmethod
-    def archive_currency(currency_id):
-        with connection.cursor() as cursor:
+    def delete_currencies(self, currency_id):
+        with transaction.atomic(), connection.cursor() as cursor:
             cursor.execute(
-                "UPDATE cash_reserves SET is_archived = 1 WHERE currency_id = %s",
+                "DELETE FROM cash_reserves WHERE currency_id = %s",
                 [currency_id],
             )
+            bump_data_version(cursor, CURRENCIES)
+            self._send_after_commit(currencies_changed, [currency_id])
+
+    def delete_rates(self, rates_ids):
+        if not rates_ids:
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            affected_currency_ids = set()
+            for chunk in chunks(rates_ids):
+                affected_currency_ids |= self._delete_rate_chunk(cursor, chunk)
+            self.refresh_current_rates(cursor, affected_currency_ids)
 
     @staticmethod
-    def unarchived_currency(currency_id):
-        with connection.cursor() as cursor:
+    def _delete_rate_chunk(cursor, rates_ids):
+        """
+        Удаляет курсы по списку (не длиннее MAX_IN_LIST) и возвращает валюты,
+        у которых удалён действующий курс - только их нужно пересчитать.
+        """
+        placeholders = ", ".join(["%s"] * len(rates_ids))
+        cursor.execute(
+            f"SELECT currency_id FROM current_rates WHERE rate_id IN ({placeholders})",
+            rates_ids,
+        )
+        affected_currency_ids = {row[0] for row in cursor.fetchall()}
+        cursor.execute(
+            f"DELETE FROM exchange_rates WHERE rate_id IN ({placeholders})",
+            rates_ids,
+        )
+        return affected_currency_ids
+
+    def delete_exchange_transactions(self, transactions_ids):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for chunk in chunks(transactions_ids):
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(
+                    f"""
+                    SELECT {", ".join(TURNOVER_SOURCE_COLUMNS)} FROM exchange_transactions
+                    WHERE transaction_id IN ({placeholders})
+                    """,
+                    chunk,
+                )
+                rows = cursor.fetchall()
+                cursor.execute(
+                    f"DELETE FROM exchange_transactions WHERE transaction_id IN ({placeholders})",
+                    chunk,
+                )
+                # Обороты уменьшаются на удалённые строки, дни целиком не пересчитываются
+                self.subtract_turnover(cursor, rows)
+
+    @staticmethod
+    def _delete_in_chunks(
+            table, key, conditions, params, columns=(), on_chunk=None,
+            chunk_size=MAX_IN_LIST, pause=0, job=None, max_rows=None,
+    ):
+        """
+        Удаление строк table по условиям порциями в порядке key. Каждая порция -
+        отдельная транзакция, блокировки держатся недолго; между порциями
+        пауза pause секунд. С именем задания job последний удалённый ключ
+        сохраняется вместе с порцией, и прерванное удаление продолжается с него.
+        on_chunk(cursor, rows) получает удалённые строки (key, *columns).
+        С max_rows удаление останавливается, когда удалено не меньше max_rows строк;
+        позиция задания при этом сохраняется. Возвращает число удалённых строк.
+        """
+        chunk_size = max(1, min(chunk_size, MAX_IN_LIST))
+        last_key = int(get_checkpoint(job) or 0) if job else 0
+        where = " AND ".join([*conditions, f"{key} > %s"])
+        limit = get_dialect().limit(chunk_size)
+        deleted = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT {', '.join([key, *columns])} FROM {table} "
+                    f"WHERE {where} ORDER BY {key} {limit}",
+                    [*params, last_key],
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                keys = [row[0] for row in rows]
+                placeholders = ", ".join(["%s"] * len(keys))
+                cursor.execute(f"DELETE FROM {table} WHERE {key} IN ({placeholders})", keys)
+                if on_chunk:
+                    on_chunk(cursor, rows)
+                last_key = keys[-1]
+                if job:
+                    save_checkpoint(cursor, job, last_key)
+            deleted += len(keys)
+            if max_rows and deleted >= max_rows:
+                return deleted
+            if pause:
+                sleep(pause)
+        if job:
+            clear_checkpoint(job)
+        return deleted
+
+    def purge_rates(
+            self, date_from=None, date_to=None, currency_id=None, keep_current=True, **options
+    ):
+        """
+        Удаление истории курсов по фильтру (даты курса включительно, валюта) порциями.
+        С keep_current действующие курсы не трогаются - так работает политика хранения,
+        иначе действующий курс пересчитывается по оставшейся истории.
+        options - chunk_size, pause, job и max_rows для _delete_in_chunks.
+        """
+        conditions, params = [], []
+        if date_from:
+            conditions.append("rate_date >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("rate_date <= %s")
+            params.append(date_to)
+        if currency_id:
+            conditions.append("currency_id = %s")
+            params.append(currency_id)
+        if keep_current:
+            conditions.append("rate_id NOT IN (SELECT rate_id FROM current_rates)")
+
+        def refresh(cursor, rows):
+            # Порция уже удалена, current_rates ещё ссылается на удалённые курсы
+            placeholders = ", ".join(["%s"] * len(rows))
             cursor.execute(
-                "UPDATE cash_reserves SET is_archived = 0 WHERE currency_id = %s",
-                [currency_id],
+                f"SELECT currency_id FROM current_rates WHERE rate_id IN ({placeholders})",
+                [row[0] for row in rows],
             )
+            self.refresh_current_rates(cursor, {row[0] for row in cursor.fetchall()})
+
+        return self._delete_in_chunks(
+            "exchange_rates",
+            "rate_id",
+            conditions,
+            params,
+            on_chunk=None if keep_current else refresh,
+            **options,
+        )
+
+    def purge_transactions(self, date_from=None, date_to=None, currency_id=None, **options):
+        """
+        Удаление транзакций за локальные даты [date_from, date_to] и по валюте
+        (проданной или купленной) порциями. Обороты уменьшаются на удалённые строки
+        в транзакции каждой порции, остатки кассы, как и при удалении по списку, не меняются.
+        """
+        period_start, period_end = day_bounds(date_from, date_to)
+        conditions, params = [], []
+        if period_start:
+            conditions.append("transaction_date >= %s")
+            params.append(period_start)
+        if period_end:
+            conditions.append("transaction_date < %s")
+            params.append(period_end)
+        if currency_id:
+            conditions.append("(currency_from_id = %s OR currency_to_id = %s)")
+            params += [currency_id, currency_id]
+
+        def subtract(cursor, rows):
+            self.subtract_turnover(cursor, [row[1:] for row in rows])
+
+        return self._delete_in_chunks(
+            "exchange_transactions",
+            "transaction_id",
+            conditions,
+            params,
+            columns=TURNOVER_SOURCE_COLUMNS,
+            on_chunk=subtract,
+            **options,
+        )
+
+    def archive_currency(self, currency_id):
+        with transaction.atomic(), connection.cursor() as cursor:
+            statements.execute(cursor, SET_ARCHIVED, [1, currency_id])
+            bump_data_version(cursor, CURRENCIES)
+            self._send_after_commit(currencies_changed, [currency_id])
+
+    def unarchived_currency(self, currency_id):
+        with transaction.atomic(), connection.cursor() as cursor:
+            statements.execute(cursor, SET_ARCHIVED, [0, currency_id])
+            bump_data_version(cursor, CURRENCIES)
+            self._send_after_commit(currencies_changed, [currency_id])
+
+
+currency_catalog = VersionedCache(
+    CURRENCIES, CurrencyExchangeService.load_currency_catalog
+)
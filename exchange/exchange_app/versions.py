@@ -0,0 +1,94 @@
+# exchange/versions.py
+import threading
+
+from datetime import timezone as dt_timezone
+
+from django.db import connection
+
+from .statements import statements
+
+CASH = "cash"
+CURRENCIES = "currencies"
+RATES = "rates"
+
+GET_VERSION = statements.register(
+    "get_data_version", "SELECT version FROM data_versions WHERE name = %s"
+)
+# Счётчиков несколько: все строки читаются одним запросом с постоянным текстом
+GET_VERSIONS = statements.register(
+    "get_data_versions", "SELECT name, version, updated_at FROM data_versions"
+)
+BUMP_VERSION = statements.register(
+    "bump_data_version",
+    lambda dialect: (
+        f"UPDATE data_versions SET version = version + 1, "
+        f"updated_at = {dialect.current_timestamp} WHERE name = %s"
+    ),
+)
+
+
+def get_data_version(name):
+    """Текущее значение счётчика версии данных."""
+    with connection.cursor() as cursor:
+        statements.execute(cursor, GET_VERSION, [name])
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def get_data_versions(*names):
+    """{имя: (версия, момент изменения в UTC)} одним запросом."""
+    with connection.cursor() as cursor:
+        statements.execute(cursor, GET_VERSIONS)
+        rows = cursor.fetchall()
+    versions = {name: (0, None) for name in names}
+    for name, version, updated_at in rows:
+        if name not in versions:
+            continue
+        # Oracle и SQLite возвращают момент без зоны, в UTC
+        if updated_at is not None and updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=dt_timezone.utc)
+        versions[name] = (int(version), updated_at)
+    return versions
+
+
+def get_version_numbers(*names):
+    """{имя: версия} - части ключей кэша фрагментов шаблонов."""
+    return {name: version for name, (version, _) in get_data_versions(*names).items()}
+
+
+def bump_data_version(cursor, *names):
+    """Увеличивает счётчики версий в текущей транзакции записи."""
+    for name in names:
+        statements.execute(cursor, BUMP_VERSION, [name])
+
+
+class VersionedCache:
+    """
+    Процессный кэш значения, действительного пока в БД не изменился
+    счётчик версии. Вместо перечитывания таблицы воркер сверяет одно число.
+    """
+
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self._version = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        return self.get_versioned()[1]
+
+    def get_versioned(self):
+        """(версия, значение); значение не старше своей версии."""
+        version = get_data_version(self.name)
+        with self._lock:
+            if self._version == version:
+                return version, self._value
+        value = self.load()
+        with self._lock:
+            self._version, self._value = version, value
+        return version, value
+
+    def clear(self):
+        with self._lock:
+            self._version = self._value = None
@@ -1,11 +1,23 @@
 # exchange/views.py
+import asyncio
+import csv
+import itertools
+import json
+from datetime import timedelta
 import requests
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.db import connection, IntegrityError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, DatabaseError, IntegrityError
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET, require_POST
 
 from .forms import (
     ExchangeForm,
@@ -13,8 +25,20 @@ from .forms import (
     AddCurrencyToCashForm,
     UserRegisterForm,
     AddCurrencyForm,
+    ImportRatesForm,
+    DeleteRatesForm,
+    RateHistoryForm,
+    ExportTransactionsForm,
+    TurnoverReportForm,
 )
-from .utils import CurrencyExchangeService
+from .archive import parse_month
+from .checkpoints import get_checkpoint
+from .events import stream_events
+from .executors import iterate_db, run_db
+from .metrics import registry, render_text
+from .quotes import get_quote_state, get_quotes_body
+from .utils import CurrencyExchangeService, purge_job
+from .versions import CASH, CURRENCIES, RATES, get_version_numbers
 
 currency_exchange_service = CurrencyExchangeService()
 
@@ -42,19 +66,132 @@ def logout_view(request):
 
 
 @login_required(login_url="/exchange/accounts/login/")
-def rates_view(request):
-    rates_data = currency_exchange_service.get_rates()
-    return render(request, "exchange/rates.html", {"rates": rates_data})
+async def rates_view(request):
+    user = await request.auser()
+    # Остатки кассы на странице только у администратора
+    versions = await run_db(
+        get_version_numbers, RATES, CURRENCIES, *([CASH] if user.is_superuser else [])
+    )
+    # Курсы передаются функцией: шаблон читает их, только если таблицы нет в кэше.
+    # Шаблон читает и сессию (сообщения) - рендер тоже в пуле БД
+    context = {"rates": currency_exchange_service.get_rates, "versions": versions}
+    if user.is_superuser:
+        context["delete_form"] = delete_rates_form()
+    return await run_db(render, request, "exchange/rates.html", context)
+
+
+def delete_rates_form(data=None):
+    form = DeleteRatesForm(data)
+    # Список валют читается, только когда он нужен шаблону или проверке формы
+    form.fields["currency"].choices = lambda: [("", "Все валюты")] + [
+        (str(currency_id), currency_name)
+        for currency_id, currency_name, _ in currency_exchange_service.get_currency_catalog()
+    ]
+    return form
+
+
+@login_required(login_url="/exchange/accounts/login/")
+async def rate_history_view(request):
+    """
+    История курса валюты для графиков: ?currency=<id>&date_from=&date_to=&interval=.
+    Без интервала он выбирается по длине периода, чтобы точек было не больше нескольких сотен.
+    """
+    form = RateHistoryForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({"error": form.errors.get_json_data()}, status=400)
+    currency_id = form.cleaned_data["currency"]
+    currency_name = await run_db(currency_exchange_service.get_currency_name, currency_id)
+    if currency_name is None:
+        return JsonResponse({"error": "Валюта не найдена."}, status=404)
+
+    date_to = form.cleaned_data["date_to"] or timezone.localdate()
+    date_from = form.cleaned_data["date_from"] or date_to - timedelta(days=365)
+    interval = form.cleaned_data["interval"]
+    if not interval:
+        days = (date_to - date_from).days
+        interval = "day" if days <= 180 else "week" if days <= 3 * 365 else "month"
+
+    history = await run_db(
+        currency_exchange_service.get_rate_history, currency_id, date_from, date_to, interval
+    )
+    return JsonResponse(
+        {
+            "currency_id": currency_id,
+            "currency_name": currency_name,
+            "date_from": date_from.isoformat(),
+            "date_to": date_to.isoformat(),
+            "interval": interval,
+            "points": [
+                {
+                    "date": point["date"].isoformat(),
+                    "rate": str(point["rate"]),
+                    "low": str(point["low"]),
+                    "high": str(point["high"]),
+                    "count": point["count"],
+                }
+                for point in history
+            ],
+        }
+    )
+
+
+@login_required(login_url="/exchange/accounts/login/")
+@require_GET
+async def events_view(request):
+    """
+    Поток изменений курсов, кассы и валют (server-sent events): открытые страницы
+    курсов и кассы применяют их на месте вместо перезагрузки.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI бесконечный ответ занял бы поток воркера целиком.
+        # Ответ 204 останавливает переподключения EventSource
+        return HttpResponse(status=204)
+    user = await request.auser()
+    return StreamingHttpResponse(
+        stream_events(
+            request.headers.get("Last-Event-ID"),
+            user.is_superuser,
+            keepalive=settings.EVENTS.get("KEEPALIVE", 15),
+        ),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@require_GET
+async def quotes_view(request):
+    """
+    Котировки покупки и продажи по всем парам неархивных валют для табло
+    в зале и виджетов операторов. Доступна без входа: табло не авторизуется.
+    Пока курсы не менялись, опрос получает 304 после одного короткого запроса версий.
+    """
+    # Заголовки условного GET разбираются здесь: condition() вызвал бы
+    # функции ETag и Last-Modified синхронно, внутри цикла событий
+    version, last_modified = await run_db(get_quote_state)
+    etag = quote_etag(version)
+    last_modified_timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified_timestamp
+    )
+    if response is None:
+        body = await run_db(get_quotes_body, version, last_modified)
+        response = HttpResponse(body, content_type="application/json")
+    response.headers.setdefault("ETag", etag)
+    if last_modified_timestamp:
+        response.headers.setdefault("Last-Modified", http_date(last_modified_timestamp))
+    return response
 
 
 @user_passes_test(lambda u: u.is_superuser)
-def add_exchange_rate(request):
+async def add_exchange_rate(request):
     form = AddExchangeRateForm(request.POST or None)
-    currency_choices = currency_exchange_service.get_currency()
+    catalog_version, currency_choices = await run_db(
+        currency_exchange_service.get_versioned_currency_catalog
+    )
     form.fields["currency"].choices = [
-        (f"{currency[0]}:{currency[1]}", currency[1])
-        for currency in currency_choices[1:]
-        if not currency[3]
+        (f"{currency_id}:{currency_name}", currency_name)
+        for currency_id, currency_name, is_archived in currency_choices[1:]
+        if not is_archived
     ]
     if request.method == "POST":
         if form.is_valid():
@@ -63,7 +200,7 @@ def add_exchange_rate(request):
             use_api = form.cleaned_data["use_api"]
             markup = form.cleaned_data["markup"]
             if use_api:
-                rate_to_base, error = currency_exchange_service.get_rate_from_api(
+                rate_to_base, error = await currency_exchange_service.aget_rate_from_api(
                     currency_name
                 )
                 if error:
@@ -78,8 +215,11 @@ def add_exchange_rate(request):
             rate_to_base_with_markup = currency_exchange_service.apply_markup(
                 rate_to_base, markup
             )
-            currency_exchange_service.add_exchange_rate(
-                currency_id, rate_to_base_with_markup, rate_date
+            await run_db(
+                currency_exchange_service.add_exchange_rate,
+                currency_id,
+                rate_to_base_with_markup,
+                rate_date,
             )
 
             messages.success(request, f"Курс для {currency_name} успешно добавлен!")
@@ -87,7 +227,30 @@ def add_exchange_rate(request):
         else:
             messages.error(request, "Пожалуйста, заполните все поля.")
 
-    return render(request, "exchange/add_exchange_rate.html", {"form": form})
+    return await run_db(
+        render,
+        request,
+        "exchange/add_exchange_rate.html",
+        {"form": form, "versions": {CURRENCIES: catalog_version}},
+    )
+
+
+@user_passes_test(lambda u: u.is_superuser)
+def import_rates_view(request):
+    form = ImportRatesForm(request.POST or None)
+    if request.method == "POST" and form.is_valid():
+        imported, missing, error = currency_exchange_service.import_rates_from_api(
+            markup=form.cleaned_data["markup"]
+        )
+        if error:
+            messages.error(request, error)
+        else:
+            messages.success(request, f"Загружено курсов из API: {len(imported)}.")
+            if missing:
+                messages.warning(
+                    request, f"Нет курса в API для валют: {', '.join(missing)}."
+                )
+    return redirect("exchange:rates")
 
 
 @login_required(login_url="/exchange/accounts/login/")
@@ -97,10 +260,11 @@ def exchange_view(request):
         messages.error(request, "Только операторы могут обменивать валюту.")
         return redirect("exchange:rates")
     form = ExchangeForm(request.POST or None)
+    catalog_version, catalog = currency_exchange_service.get_versioned_currency_catalog()
     currency_choices = [
-        (currency[0], currency[1])
-        for currency in currency_exchange_service.get_currency()
-        if not currency[3]
+        (str(currency_id), currency_name)
+        for currency_id, currency_name, is_archived in catalog
+        if not is_archived
     ]
     # Преобразуем множество валют в список и создаем выбор валют
     form.fields["currency_from"].choices = currency_choices
@@ -130,41 +294,245 @@ def exchange_view(request):
                     if change_in_base != 0
                     else ""
                 )
+                currency_names = dict(currency_choices)
                 messages.success(
                     request,
-                    f"Вы обменяли {amount} {currency_exchange_service.get_currency_name(currency_from_id)} на "
-                    f"{exchanged_amount:.2f} {currency_exchange_service.get_currency_name(currency_to_id)}. "
+                    f"Вы обменяли {amount} {currency_names[currency_from_id]} на "
+                    f"{exchanged_amount:.2f} {currency_names[currency_to_id]}. "
                     + change_string,
                 )
             return redirect("exchange:rates")
 
-    return render(request, "exchange/exchange.html", {"form": form})
+    return render(
+        request,
+        "exchange/exchange.html",
+        {"form": form, "versions": {CURRENCIES: catalog_version}},
+    )
+
+
+MAX_BATCH_ORDERS = 1000
+
+
+@login_required(login_url="/exchange/accounts/login/")
+@require_POST
+def exchange_batch_view(request):
+    """
+    Пакетный обмен для киосков и корпоративных заявок.
+    Принимает JSON {"orders": [{"currency_from", "currency_to", "amount", "amount_to_get"}]}
+    и возвращает результат по каждому заказу.
+    """
+    if request.user.is_superuser:
+        return JsonResponse(
+            {"error": "Только операторы могут обменивать валюту."}, status=403
+        )
+    try:
+        orders = json.loads(request.body)["orders"]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "Ожидается JSON с полем orders."}, status=400)
+    if not isinstance(orders, list) or not 0 < len(orders) <= MAX_BATCH_ORDERS:
+        return JsonResponse(
+            {"error": f"Количество заказов должно быть от 1 до {MAX_BATCH_ORDERS}."},
+            status=400,
+        )
+
+    currency_choices = [
+        (str(currency_id), currency_name)
+        for currency_id, currency_name, is_archived in (
+            currency_exchange_service.get_currency_catalog()
+        )
+        if not is_archived
+    ]
+    results = [None] * len(orders)
+    valid_orders, valid_indexes = [], []
+    for index, order in enumerate(orders):
+        form = ExchangeForm(order if isinstance(order, dict) else {})
+        form.fields["currency_from"].choices = currency_choices
+        form.fields["currency_to"].choices = currency_choices
+        if form.is_valid():
+            valid_orders.append(
+                {
+                    "currency_from": form.cleaned_data["currency_from"],
+                    "currency_to": form.cleaned_data["currency_to"],
+                    "amount": form.cleaned_data["amount"],
+                    "amount_to_get": form.cleaned_data.get("amount_to_get"),
+                }
+            )
+            valid_indexes.append(index)
+        else:
+            results[index] = {"ok": False, "error": form.errors.get_json_data()}
+
+    if valid_orders:
+        try:
+            batch_results = currency_exchange_service.exchange_batch(
+                request.user.id, valid_orders
+            )
+        except DatabaseError as e:
+            return JsonResponse({"error": str(e)}, status=409)
+        for index, result in zip(valid_indexes, batch_results):
+            results[index] = result
+
+    return JsonResponse({"results": results})
 
 
 @login_required(login_url="/exchange/accounts/login/")
-def transaction_history_view(request):
-    is_admin = request.user.is_superuser
-    # Если пользователь - администратор, показываем все транзакции
-    if is_admin:
-        transactions = currency_exchange_service.get_transactions()
+async def transaction_history_view(request):
+    user = await request.auser()
+    is_admin = user.is_superuser
+    user_id = None if is_admin else user.id
+    month = parse_month(request.GET.get("month"))
+    try:
+        page_number = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        page_number = 1
+    # Список архивных месяцев (диск) и страница истории читаются параллельно
+    if month:
+        page_call = run_db(
+            currency_exchange_service.get_archived_transactions, month, user_id, page_number
+        )
     else:
-        # Если пользователь - оператор, показываем только его транзакции
-        user_id = request.user.id
-        transactions = currency_exchange_service.get_transactions(user_id)
+        page_call = run_db(
+            currency_exchange_service.get_transactions,
+            user_id,
+            cursor_value=request.GET.get("cursor"),
+        )
+    archived_months, page = await asyncio.gather(
+        run_db(currency_exchange_service.get_archived_months), page_call
+    )
     context = {
-        "transactions": transactions,
         "is_admin": is_admin,
+        "archived_months": archived_months,
+    }
+    if month and month not in archived_months:
+        month = None
+        page = await run_db(currency_exchange_service.get_transactions, user_id)
+    if month:
+        # Закрытый месяц читается из файла архива постранично
+        context.update(
+            {
+                "transactions": page["transactions"],
+                "month": month,
+                "prev_page": page_number - 1 if page_number > 1 else None,
+                "next_page": page_number + 1 if page["has_next"] else None,
+            }
+        )
+    else:
+        # Администратор видит все транзакции, оператор - только свои
+        context.update(
+            {
+                "transactions": page["transactions"],
+                "next_cursor": page["next_cursor"],
+                "prev_cursor": page["prev_cursor"],
+            }
+        )
+    return await run_db(render, request, "exchange/history.html", context)
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+EXPORT_HEADER = [
+    "transaction_id",
+    "transaction_date",
+    "operator",
+    "currency_from",
+    "currency_to",
+    "amount",
+    "exchanged_amount",
+    "change_in_base",
+    "amount_in_base",
+]
+
+
+@login_required(login_url="/exchange/accounts/login/")
+def export_transactions_view(request):
+    form = ExportTransactionsForm(request.GET)
+    if not form.is_valid():
+        messages.error(request, "Некорректные параметры выгрузки.")
+        return redirect("exchange:exchange_history")
+
+    # Оператор выгружает только свои транзакции
+    operator_id = (
+        form.cleaned_data["operator"] if request.user.is_superuser else request.user.id
+    )
+    date_from, date_to = form.cleaned_data["date_from"], form.cleaned_data["date_to"]
+    chunks = currency_exchange_service.iter_transactions_for_export(
+        operator_id=operator_id, date_from=date_from, date_to=date_to
+    )
+
+    if form.cleaned_data["format"] == "ndjson":
+        def encode(rows):
+            return "".join(
+                json.dumps(dict(zip(EXPORT_HEADER, row)), default=str, ensure_ascii=False)
+                + "\n"
+                for row in rows
+            )
+
+        header = ""
+        content_type, extension = "application/x-ndjson", "ndjson"
+    else:
+        writer = csv.writer(Echo())
+
+        def encode(rows):
+            return "".join(writer.writerow(row) for row in rows)
+
+        header = encode([EXPORT_HEADER])
+        content_type, extension = "text/csv; charset=utf-8", "csv"
+
+    if isinstance(request, ASGIRequest):
+        # Под ASGI синхронный итератор был бы прочитан в список целиком:
+        # порции читаются асинхронно, по одной на каждую отправку клиенту
+        async def stream():
+            if header:
+                yield header
+            async for rows in iterate_db(chunks):
+                yield encode(rows)
+
+        content = stream()
+    else:
+        content = itertools.chain([header] if header else [], map(encode, chunks))
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response["Content-Disposition"] = (
+        f'attachment; filename="exchange_history.{extension}"'
+    )
+    return response
+
+
+@user_passes_test(lambda u: u.is_superuser)
+def turnover_report_view(request):
+    form = TurnoverReportForm(request.GET or None)
+    today = timezone.localdate()
+    # По умолчанию - с начала месяца
+    date_from, date_to = today.replace(day=1), today
+    if form.is_valid():
+        date_from = form.cleaned_data["date_from"] or date_from
+        date_to = form.cleaned_data["date_to"] or date_to
+    turnover = currency_exchange_service.get_turnover(date_from, date_to)
+    totals = {
+        "transactions_count": sum(row["transactions_count"] for row in turnover),
+        "base_equivalent": sum(row["base_equivalent"] for row in turnover),
+        "change_paid": sum(row["change_paid"] for row in turnover),
     }
-    return render(request, "exchange/history.html", context)
+    return render(
+        request,
+        "exchange/turnover.html",
+        {"form": form, "turnover": turnover, "totals": totals},
+    )
 
 
 @user_passes_test(lambda u: u.is_superuser)
 def add_currency_to_cash(request):
     form = AddCurrencyToCashForm(request.POST or None)
     currency_choices = [
-        (currency[1], currency[1])
-        for currency in currency_exchange_service.get_currency()
-        if not currency[3]
+        (currency_name, currency_name)
+        for _, currency_name, is_archived in (
+            currency_exchange_service.get_currency_catalog()
+        )
+        if not is_archived
     ]
     form.fields["currency_name"].choices = currency_choices
     if request.method == "POST":
@@ -202,26 +570,33 @@ def register_view(request):
 
 @user_passes_test(lambda u: u.is_superuser)
 def cash_reserves_view(request):
-    currencies_data = [
-        {
-            "currency_id": currency[0],
-            "currency_name": currency[1],
-            "amount_in_cash": currency[2],
-            "is_archived": currency[3],
-        }
-        for currency in currency_exchange_service.get_currency()
-    ]
+    def currencies_data():
+        # Вызывается шаблоном, только если таблицы нет в кэше
+        return [
+            {
+                "currency_id": currency[0],
+                "currency_name": currency[1],
+                "amount_in_cash": currency[2],
+                "is_archived": currency[3],
+            }
+            for currency in currency_exchange_service.get_currency()
+        ]
 
     return render(
-        request, "exchange/cash_reserves.html", {"currencies": currencies_data}
+        request,
+        "exchange/cash_reserves.html",
+        {
+            "currencies": currencies_data,
+            "versions": get_version_numbers(CURRENCIES, CASH),
+        },
     )
 
 
 @user_passes_test(lambda u: u.is_superuser)
-def add_currency_view(request):
+async def add_currency_view(request):
     # Получаем данные через сервис
     currency_choices, short_currencies = (
-        currency_exchange_service.get_currency_choices()
+        await currency_exchange_service.aget_currency_choices()
     )
     if request.method == "POST":
         form = AddCurrencyForm(request.POST)
@@ -238,8 +613,8 @@ def add_currency_view(request):
             # Конвертируем сокращенное название в полное
             currency_name = short_currencies.get(currency_name, currency_name)
             # Добавляем валюту в базу через сервис
-            if currency_exchange_service.add_currency_to_cash(
-                currency_name, amount_in_cash
+            if await run_db(
+                currency_exchange_service.add_currency_to_cash, currency_name, amount_in_cash
             ):
                 messages.success(
                     request, f"Валюта {currency_name} успешно добавлена в кассу!"
@@ -252,7 +627,7 @@ def add_currency_view(request):
     else:
         form = AddCurrencyForm()
 
-    return render(request, "exchange/add_currency_to_cash.html", {"form": form})
+    return await run_db(render, request, "exchange/add_currency_to_cash.html", {"form": form})
 
 
 @user_passes_test(lambda u: u.is_superuser)
@@ -276,6 +651,36 @@ def delete_currencies_view(request, currency_id):
 def delete_rate(request):
     # Проверяем права администратора
     rates_ids = request.POST.getlist("rates_ids")
+    if "date_to" in request.POST:
+        # Удаление по фильтру идёт порциями: таблица не блокируется на всё время.
+        # За запрос удаляется не больше REQUEST_ROWS строк, повторная отправка той же
+        # формы (или manage.py purge rates --include-current) продолжает задание
+        form = delete_rates_form(request.POST)
+        if form.is_valid():
+            date_from, date_to = form.cleaned_data["date_from"], form.cleaned_data["date_to"]
+            currency_id = int(form.cleaned_data["currency"] or 0) or None
+            job = purge_job("rates", date_from, date_to, currency_id, False)
+            count = currency_exchange_service.purge_rates(
+                date_from,
+                date_to,
+                currency_id,
+                keep_current=False,
+                chunk_size=settings.RETENTION["CHUNK_SIZE"],
+                job=job,
+                max_rows=settings.RETENTION["REQUEST_ROWS"],
+            )
+            if get_checkpoint(job) is None:
+                messages.success(request, f"Удалено курсов: {count}.")
+            else:
+                messages.warning(
+                    request,
+                    f"Удалено курсов: {count}. Удаление не завершено - "
+                    "отправьте форму ещё раз, чтобы продолжить.",
+                )
+        else:
+            messages.error(request, "Некорректный фильтр удаления курсов.")
+        return redirect("exchange:rates")
+
     currency_exchange_service.delete_rates(rates_ids)
     if rates_ids:
         messages.success(request, "Выбранные курсы успешно удалены.")
@@ -311,3 +716,20 @@ def unarchived_currency_view(request, currency_id):
         currency_exchange_service.unarchived_currency(currency_id)
         messages.success(request, "Валюта успешно восстановлена.")
     return redirect("exchange:cash_reserves")
+
+
+def metrics_view(request):
+    # Метрики содержат текст SQL: без METRICS_PUBLIC нужен токен или вход сотрудника
+    token = settings.METRICS.get("TOKEN")
+    authorization = request.headers.get("Authorization", "")
+    allowed = (
+        settings.METRICS.get("PUBLIC")
+        or (token and constant_time_compare(authorization, f"Bearer {token}"))
+        or request.user.is_staff
+    )
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_text(registry.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -7,6 +7,9 @@ import sys
 def main():
     """Run administrative tasks."""
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "exchange.settings")
+    if sys.argv[1:2] == ["test"]:
+        # Тесты не должны попасть в базу и кэш из окружения (см. TESTING в settings)
+        os.environ.setdefault("DJANGO_TESTING", "1")
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: